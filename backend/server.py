@@ -1,154 +1,4607 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, status, File, UploadFile
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import CursorType, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.collation import Collation
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import Nearest, PrimaryPreferred, Secondary, SecondaryPreferred
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import jwt
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
 import bcrypt
 import base64
-from bson import ObjectId
+from bson import ObjectId, Timestamp, decode as bson_decode, encode as bson_encode
+import numpy as np
+import asyncio
+import bisect
+import contextvars
+import functools
+import hashlib
+import heapq
+import inspect
+import json
+import re
+import socket
+import zlib
+import math
+import random
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# ===== BACKGROUND LOOPS =====
+# In-process periodic work, e.g. post archiving: start() spawns a loop that waits, then
+# runs tick(), logging a failed tick instead of dying on it; stop() cancels the loop and
+# runs on_stop() for any final flush.
+class BackgroundLoop(ABC):
+    def __init__(self, interval: float, failure: str):
+        self.interval = interval
+        self.failure = failure  # logged with the exception when a tick fails
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.on_stop()
+
+    async def on_stop(self):
+        pass
+
+    async def wait(self):
+        await asyncio.sleep(self.interval)
+
+    @abstractmethod
+    async def tick(self):
+        ...
+
+    async def _run(self):
+        while True:
+            await self.wait()
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.warning(f"{self.failure}: {e}")
+
+# ===== TRACING =====
+# Sampling ratio for new traces; an incoming `traceparent` header always wins.
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+TRACE_EXPORT_PATH = os.environ.get('TRACE_EXPORT_PATH', '')  # JSON lines, one OTLP batch per line
+TRACE_EXPORT_URL = os.environ.get('TRACE_EXPORT_URL', '')  # OTLP/HTTP JSON collector, e.g. http://localhost:4318/v1/traces
+TRACE_BATCH_SIZE = int(os.environ.get('TRACE_BATCH_SIZE', '512'))
+TRACE_FLUSH_INTERVAL = float(os.environ.get('TRACE_FLUSH_INTERVAL', '2'))
+TRACE_MAX_QUEUE = int(os.environ.get('TRACE_MAX_QUEUE', '10000'))
+TRACE_MAX_SPANS_PER_TRACE = int(os.environ.get('TRACE_MAX_SPANS_PER_TRACE', '256'))
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error", "db_calls")
+
+    def __init__(self, trace, name, kind, parent_id, attributes):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error = None
+        self.db_calls = None  # (start_ns, end_ns) of direct db children
+
+class TraceState:
+    __slots__ = ("trace_id", "span_count")
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.span_count = 0
+
+def parse_traceparent(header: Optional[str]):
+    # version-traceid-parentid-flags, see W3C Trace Context
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+def format_traceparent(trace_id: str, span_id: str, sampled: bool) -> str:
+    return f"00-{trace_id}-{span_id}-{'01' if sampled else '00'}"
+
+class SpanExporter(BackgroundLoop):
+    def __init__(self, path: str, url: str):
+        super().__init__(TRACE_FLUSH_INTERVAL, "Span export failed")
+        self.path = path
+        self.url = url
+        self.queue = deque()
+        self.dropped = 0
+        self.exported = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path or self.url)
+
+    def submit(self, span: Span):
+        if len(self.queue) >= TRACE_MAX_QUEUE:
+            self.dropped += 1
+            return
+        self.queue.append(span)
+
+    def start(self):
+        if self.enabled:
+            super().start()
+
+    async def tick(self):
+        while self.queue:
+            await self.flush()
+
+    async def on_stop(self):
+        await self.tick()
+
+    async def flush(self):
+        batch = [self.queue.popleft() for _ in range(min(TRACE_BATCH_SIZE, len(self.queue)))]
+        if not batch:
+            return
+        payload = json.dumps(self._encode(batch))
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, payload)
+            self.exported += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning(f"Span export failed: {e}")
+
+    def _write(self, payload: str):
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(payload + "\n")
+        if self.url:
+            request = urllib.request.Request(
+                self.url, data=payload.encode("utf-8"), headers={"Content-Type": "application/json"}
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+
+    @staticmethod
+    def _encode(batch):
+        def attr(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        kinds = {"server": 2, "client": 3}
+        spans = []
+        for span in batch:
+            spans.append({
+                "traceId": span.trace.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "kind": kinds.get(span.kind, 1),
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [attr(k, v) for k, v in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 0},
+            })
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [attr("service.name", "crewznation-api")]},
+                "scopeSpans": [{"scope": {"name": "crewznation.tracing"}, "spans": spans}],
+            }]
+        }
+
+class Tracer:
+    def __init__(self, sample_rate: float, exporter: SpanExporter):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    def should_sample(self, trace_id: str) -> bool:
+        # Ratio sampling on the trace id keeps the decision stable across services
+        return self.exporter.enabled and int(trace_id[:16], 16) < self.sample_rate * (1 << 64)
+
+    @contextmanager
+    def request_span(self, name: str, traceparent: Optional[str], **attributes):
+        parent = parse_traceparent(traceparent)
+        if parent:
+            trace_id, parent_id, sampled = parent
+            sampled = sampled and self.exporter.enabled
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = self.should_sample(trace_id)
+        if not sampled:
+            # Still hand back ids so the response can carry a traceparent downstream
+            yield None, format_traceparent(trace_id, parent_id or os.urandom(8).hex(), False)
+            return
+        span = Span(TraceState(trace_id), name, "server", parent_id, attributes)
+        with self._activate(span):
+            yield span, format_traceparent(trace_id, span.span_id, True)
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attributes):
+        parent = _current_span.get()
+        if parent is None or parent.trace.span_count >= TRACE_MAX_SPANS_PER_TRACE:
+            yield None
+            return
+        span = Span(parent.trace, name, kind, parent.span_id, attributes)
+        try:
+            with self._activate(span):
+                yield span
+        finally:
+            if kind == "client":
+                if parent.db_calls is None:
+                    parent.db_calls = []
+                parent.db_calls.append((span.start_ns, span.end_ns))
+
+    @contextmanager
+    def _activate(self, span: Span):
+        span.trace.span_count += 1
+        token = _current_span.set(span)
+        try:
+            yield
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            if span.db_calls:
+                # Back-to-back awaits on the database inside one span are candidates
+                # for asyncio.gather; surface them so they stand out in the trace view.
+                calls = sorted(span.db_calls)
+                span.attributes["db.calls"] = len(calls)
+                span.attributes["db.sequential_awaits"] = sum(
+                    1 for prev, cur in zip(calls, calls[1:]) if cur[0] >= prev[1]
+                )
+            self.exporter.submit(span)
+
+tracer = Tracer(TRACE_SAMPLE_RATE, SpanExporter(TRACE_EXPORT_PATH, TRACE_EXPORT_URL))
+
+class TracedCursor:
+    def __init__(self, cursor, collection: str, op: str):
+        self._cursor = cursor
+        self._collection = collection
+        self._op = op
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in ("sort", "skip", "limit", "batch_size", "hint"):
+            @functools.wraps(attr)
+            def chained(*args, **kwargs):
+                return TracedCursor(attr(*args, **kwargs), self._collection, self._op)
+            return chained
+        return attr
+
+    def __aiter__(self):
+        return self._cursor.__aiter__()
+
+    async def to_list(self, length):
+        with tracer.span(f"db.{self._collection}.{self._op}", kind="client",
+                         **{"db.system": "mongodb", "db.collection": self._collection, "db.operation": self._op}) as span:
+            result = await self._cursor.to_list(length)
+            if span is not None:
+                span.attributes["db.documents"] = len(result)
+            return result
+
+class TracedCollection:
+    _awaitables = frozenset((
+        "find_one", "insert_one", "insert_many", "update_one", "update_many", "delete_one", "delete_many",
+        "replace_one", "count_documents", "find_one_and_update", "find_one_and_delete", "bulk_write",
+        "create_index", "distinct",
+    ))
+    _cursors = frozenset(("find", "aggregate"))
+    _reads = frozenset(("find_one", "count_documents", "distinct", "find", "aggregate"))
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._name = collection.name
+        self._by_preference = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in self._awaitables:
+            span_name = f"db.{self._name}.{name}"
+            attributes = {"db.system": "mongodb", "db.collection": self._name, "db.operation": name}
+
+            @functools.wraps(attr)
+            async def traced(*args, **kwargs):
+                method = getattr(self._routed(name, kwargs), name)
+                with tracer.span(span_name, kind="client", **attributes):
+                    return await method(*args, **kwargs)
+            return traced
+        if name in self._cursors:
+            @functools.wraps(attr)
+            def cursor(*args, **kwargs):
+                method = getattr(self._routed(name, kwargs), name)
+                return TracedCursor(method(*args, **kwargs), self._name, name)
+            return cursor
+        return attr
+
+    def _routed(self, name, kwargs):
+        # Applies the request's read route: its causal session for every operation, and its
+        # read preference for reads
+        route = _read_route.get()
+        if route is None:
+            return self._collection
+        if route.session is not None and not route.session.has_ended:
+            kwargs.setdefault("session", route.session)
+        if route.read_preference is None or name not in self._reads:
+            return self._collection
+        key = (route.read_preference.mode, route.read_preference.max_staleness)
+        collection = self._by_preference.get(key)
+        if collection is None:
+            collection = self._by_preference[key] = self._collection.with_options(read_preference=route.read_preference)
+        return collection
+
+class TracedDatabase:
+    def __init__(self, database):
+        self._database = database
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            return getattr(self._database, name)
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = TracedCollection(self._database[name])
+        return collection
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+    def watch(self, *args, **kwargs):
+        return self._database.watch(*args, **kwargs)
+
+    async def create_collection(self, name, **kwargs):
+        await self._database.create_collection(name, **kwargs)
+        return self[name]
+
+    async def command(self, *args, **kwargs):
+        with tracer.span("db.command", kind="client", **{"db.system": "mongodb", "db.operation": "command"}):
+            return await self._database.command(*args, **kwargs)
+
+class TracedJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with tracer.span("serialize", **{"http.response.kind": "json"}):
+            return super().render(content)
+
+class TracedRoute(APIRoute):
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        span_name = f"handler {self.name}"
+
+        read_preference = READ_ROUTES.get(self.name)
+
+        async def traced_handler(request):
+            with tracer.span(span_name, **{"code.function": self.name}):
+                async with read_routing(request, read_preference) as route:
+                    response = await handler(request)
+                    if route is not None and route.session is not None and route.session.operation_time is not None:
+                        response.headers["X-Causal-Token"] = encode_causal_token(
+                            route.user_id, route.session.cluster_time, route.session.operation_time
+                        )
+                return response
+        return traced_handler
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        method = scope["method"]
+        with tracer.request_span(f"{method} {scope['path']}", traceparent,
+                                 **{"http.method": method, "http.target": scope["path"]}) as (span, header):
+            async def send_with_traceparent(message):
+                if message["type"] == "http.response.start":
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"traceparent", header.encode("latin-1"))]
+                    if span is not None:
+                        span.attributes["http.status_code"] = message["status"]
+                await send(message)
+
+            await self.app(scope, receive, send_with_traceparent)
+            if span is not None and scope.get("route") is not None:
+                span.name = f"{method} {scope['route'].path}"
+                span.attributes["http.route"] = scope["route"].path
+
 # MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+DB_BACKEND = os.environ.get('DB_BACKEND', 'mongo')  # "mongo", or "memory" for local tests and benchmarks
+if DB_BACKEND == "memory":
+    client = None
+    db = None
+else:
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(
+        mongo_url,
+        maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+        minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '10')),
+        waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')),
+        serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        connectTimeoutMS=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+        socketTimeoutMS=int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '10000')),
+    )
+    db = TracedDatabase(client[os.environ['DB_NAME']])
+
+# JWT Configuration
+JWT_SECRET = "crewz_nation_secret_key_2025"
+JWT_ALGORITHM = "HS256"
+JWT_EXPIRATION_HOURS = 24 * 7  # 7 days, the refresh token lifetime
+ACCESS_TOKEN_MINUTES = int(os.environ.get('ACCESS_TOKEN_MINUTES', '15'))
+
+# ===== READ ROUTING =====
+# Heavy read routes may be served by secondaries, bounded by maxStalenessSeconds; everything
+# else reads from the primary. Authenticated requests run in a causally consistent session
+# that starts at the user's last observed operation, so a secondary never hides the user's
+# own posts and edits from them. READ_ROUTING overrides the policy per route (handler name),
+# e.g. "get_feed=nearest,get_user_posts=primary". secondaryPreferred falls back to the
+# primary, so the defaults also run against a single-member replica set.
+READ_MAX_STALENESS_SECONDS = int(os.environ.get('READ_MAX_STALENESS_SECONDS', '90'))  # the server minimum is 90
+CAUSAL_CLOCK_USERS = int(os.environ.get('CAUSAL_CLOCK_USERS', '100000'))
+READ_ROUTE_DEFAULTS = {
+    "get_feed": "secondaryPreferred",
+    "get_ranked_feed": "secondaryPreferred",
+    "get_user_posts": "secondaryPreferred",
+    "get_user_vehicles": "secondaryPreferred",
+    "get_tag_posts": "secondaryPreferred",
+}
+READ_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+def parse_read_routing(spec: str) -> dict:
+    modes = dict(READ_ROUTE_DEFAULTS)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, mode = (part.strip() for part in item.partition("="))
+        if mode != "primary" and mode not in READ_MODES:
+            raise ValueError(f"Unknown read preference {mode!r} for route {route!r}")
+        modes[route] = mode
+    # Primary routes get no entry: None means the client's default, the primary
+    return {
+        route: READ_MODES[mode](max_staleness=READ_MAX_STALENESS_SECONDS)
+        for route, mode in modes.items() if mode != "primary"
+    }
+
+READ_ROUTES = parse_read_routing(os.environ.get('READ_ROUTING', ''))
+
+class ReadRoute:
+    __slots__ = ("user_id", "read_preference", "session")
+
+    def __init__(self, user_id, read_preference, session):
+        self.user_id = user_id
+        self.read_preference = read_preference
+        self.session = session
+
+_read_route = contextvars.ContextVar("read_route", default=None)
+
+class CausalClock:
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self.users = OrderedDict()  # user_id -> (cluster_time, operation_time)
+        self.latest = (None, None)  # newest operation this worker has seen from anyone
+
+    def get(self, user_id: str) -> tuple:
+        return self.users.get(user_id, (None, None))
+
+    def observe(self, user_id: Optional[str], cluster_time, operation_time):
+        if operation_time is None:
+            return
+        if user_id is not None:
+            known = self.users.get(user_id)
+            if known is None or known[1] < operation_time:
+                self.users[user_id] = (cluster_time, operation_time)
+            self.users.move_to_end(user_id)
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        if self.latest[1] is None or self.latest[1] < operation_time:
+            self.latest = (cluster_time or self.latest[0], operation_time)
+
+    @staticmethod
+    def advance(session, cluster_time, operation_time):
+        if cluster_time is not None:
+            session.advance_cluster_time(cluster_time)
+        if operation_time is not None:
+            session.advance_operation_time(operation_time)
+
+causal_clock = CausalClock(CAUSAL_CLOCK_USERS)
+
+def encode_causal_token(user_id: str, cluster_time, operation_time) -> str:
+    # Carries the user's clock between workers: the client echoes it as X-Causal-Token
+    payload = {"user_id": user_id, "typ": "causal", "ot": [operation_time.time, operation_time.inc]}
+    if cluster_time is not None:
+        payload["ct"] = base64.urlsafe_b64encode(bson_encode(cluster_time)).decode()
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def decode_causal_token(token: str, user_id: str) -> tuple:
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        if payload.get("typ") != "causal" or payload.get("user_id") != user_id:
+            return None, None
+        cluster_time = bson_decode(base64.urlsafe_b64decode(payload["ct"])) if "ct" in payload else None
+        return cluster_time, Timestamp(*payload["ot"])
+    except (InvalidTokenError, KeyError, TypeError, ValueError):
+        return None, None
+
+def request_user_id(request) -> Optional[str]:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return authenticate(token).user_id
+    except HTTPException:
+        return None  # the route's own auth dependency rejects it
+
+@asynccontextmanager
+async def read_routing(request, read_preference):
+    if client is None:
+        yield None
+        return
+    user_id = request_user_id(request)
+    session = None
+    if user_id is not None:
+        session = await client.start_session(causal_consistency=True)
+        CausalClock.advance(session, *causal_clock.get(user_id))
+        header = request.headers.get("x-causal-token")
+        if header:
+            CausalClock.advance(session, *decode_causal_token(header, user_id))
+    elif read_preference is None:
+        yield None
+        return
+    route = ReadRoute(user_id, read_preference, session)
+    token = _read_route.set(route)
+    try:
+        yield route
+    finally:
+        _read_route.reset(token)
+        if session is not None:
+            causal_clock.observe(user_id, session.cluster_time, session.operation_time)
+            await session.end_session()
+
+@asynccontextmanager
+async def shared_read():
+    # Results cached for every caller must not be read under one user's session. Read them
+    # after the newest operation this worker has seen instead, so a lagging secondary can't
+    # refill a just-invalidated cache entry with data older than a write made through it.
+    route = _read_route.get()
+    if client is None or route is None or route.read_preference is None:
+        token = _read_route.set(None)
+        try:
+            yield
+        finally:
+            _read_route.reset(token)
+        return
+    session = await client.start_session(causal_consistency=True)
+    CausalClock.advance(session, *causal_clock.latest)
+    token = _read_route.set(ReadRoute(None, route.read_preference, session))
+    try:
+        yield
+    finally:
+        _read_route.reset(token)
+        await session.end_session()
+
+@asynccontextmanager
+async def resumed_read(route: Optional[ReadRoute]):
+    # Re-enters a request's read route once its handler has returned, e.g. while a response
+    # body streams: read_routing() has ended the session by then, so reads go through a new
+    # one, continuing the user's clock (observed when that session ended)
+    if client is None or route is None:
+        yield
+        return
+    session = None
+    if route.user_id is not None:
+        session = await client.start_session(causal_consistency=True)
+        CausalClock.advance(session, *causal_clock.get(route.user_id))
+    token = _read_route.set(ReadRoute(route.user_id, route.read_preference, session))
+    try:
+        yield
+    finally:
+        _read_route.reset(token)
+        if session is not None:
+            causal_clock.observe(route.user_id, session.cluster_time, session.operation_time)
+            await session.end_session()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # startup() and shutdown() live at the end of the module, after everything they start
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+# Create the main app
+app = FastAPI(
+    title="CrewZNatioN API",
+    description="Automotive Social Media Platform",
+    default_response_class=TracedJSONResponse,
+    lifespan=lifespan,
+)
+
+# Create API router
+api_router = APIRouter(prefix="/api", route_class=TracedRoute)
+security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# ===== MODELS =====
+class UserCreate(BaseModel):
+    username: str
+    email: str
+    password: str
+    full_name: str
+
+class UserLogin(BaseModel):
+    email: str
+    password: str
+
+class User(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    username: str
+    email: str
+    full_name: str
+    bio: Optional[str] = ""
+    profile_image: Optional[str] = ""  # base64
+    profile_version: int = 0  # bumped whenever fields in the post author snapshot change
+    followers_count: int = 0
+    following_count: int = 0
+    posts_count: int = 0
+    vehicles_count: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Vehicle(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    make: str
+    model: str
+    year: int
+    type: str  # "car" or "motorcycle"
+    color: Optional[str] = ""
+    description: Optional[str] = ""
+    modifications: Optional[str] = ""
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 0  # bumped on every edit, for If-Match
+    image_count: int = 0  # images live in the vehicle_images gallery
+    cover_image: Optional[str] = None  # URL of the first gallery image; responses only
+
+class VehicleCreate(BaseModel):
+    make: str
+    model: str
+    year: int
+    type: str
+    color: Optional[str] = ""
+    description: Optional[str] = ""
+    modifications: Optional[str] = ""
+
+class VehicleUpdate(BaseModel):
+    # PATCH body: only the fields sent are changed
+    make: Optional[str] = None
+    model: Optional[str] = None
+    year: Optional[int] = None
+    type: Optional[str] = None
+    color: Optional[str] = None
+    description: Optional[str] = None
+    modifications: Optional[str] = None
+
+class Post(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    vehicle_id: Optional[str] = None
+    caption: str
+    images: List[str] = []  # base64 images
+    likes_count: int = 0
+    comments_count: int = 0
+    author: Optional[dict] = None  # author_snapshot() at write time, kept fresh by AuthorSnapshotPropagator
+    tags: List[str] = []  # lowercased #hashtags from the caption
+    mentions: List[str] = []  # @usernames from the caption
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ViewerPost(Post):
+    liked_by_me: bool = False
+    archived: Optional[str] = None  # cold partition key; archived posts are read-only
+
+class PostCreate(BaseModel):
+    vehicle_id: Optional[str] = None
+    caption: str
+    images: List[str] = []
+
+class Comment(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    post_id: str
+    user_id: str
+    content: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Like(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    post_id: str
+    user_id: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Notification(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str  # recipient
+    type: str  # "mention"
+    actor_id: str
+    post_id: Optional[str] = None
+    read: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class AuthResponse(BaseModel):
+    access_token: str
+    token_type: str
+    user: User
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # access token lifetime, seconds
+
+class TokenPair(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+# ===== REPOSITORIES =====
+# Handlers only talk to these; DB_BACKEND picks the Motor or the in-memory implementation.
+class UserRepo(ABC):
+    @abstractmethod
+    async def get(self, user_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def get_by_usernames(self, usernames: List[str], fields: Optional[List[str]] = None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def get_many(self, user_ids: List[str], fields: Optional[List[str]] = None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def update_returning(self, user_id: str, fields: dict, increments: dict) -> Optional[dict]:
+        # Applies $set/$inc and returns the updated user without password
+        ...
+
+    @abstractmethod
+    async def username_taken(self, username: str) -> bool:
+        # Case-insensitive, like the uniqueness constraint
+        ...
+
+    @abstractmethod
+    def iter_usernames(self):
+        ...
+
+    @abstractmethod
+    async def insert(self, user_doc: dict):
+        # Raises DuplicateKeyError when the email or username is taken, ignoring case
+        ...
+
+    @abstractmethod
+    async def update_fields(self, user_id: str, fields: dict):
+        ...
+
+    @abstractmethod
+    async def increment(self, user_id: str, field: str, amount: int):
+        ...
+
+class VehicleRepo(ABC):
+    @abstractmethod
+    async def get(self, vehicle_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def list_by_user(self, user_id: str, limit: int, fields: Optional[List[str]] = None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def iter_by_user(self, user_id: str, after: Optional[tuple] = None, limit: Optional[int] = None):
+        # Async iterator over the user's vehicles by (created_at, id), strictly after
+        # `after` when given, fetched in bounded batches
+        ...
+
+    @abstractmethod
+    async def get_many(self, vehicle_ids: List[str], fields: Optional[List[str]] = None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def iter_all(self, fields: Optional[List[str]] = None):
+        # Async iterator over every vehicle, for building in-process indexes
+        ...
+
+    @abstractmethod
+    async def insert(self, vehicle_doc: dict):
+        ...
+
+    @abstractmethod
+    async def update_owned(
+        self, vehicle_id: str, user_id: str, fields: dict, version: Optional[int] = None, image_limit: Optional[int] = None
+    ) -> Optional[dict]:
+        # One conditional write: sets `fields` and bumps the version, but only if the user
+        # owns the vehicle and, when given, `version` is still current. With `image_limit`
+        # it also reserves the next gallery position, if fewer than that many are taken.
+        # Returns the vehicle as it was before, or None if nothing matched.
+        ...
+
+    @abstractmethod
+    def iter_embedded_images(self):
+        # Async iterator of {"id", "user_id", "images"} for vehicles still storing images inline
+        ...
+
+    @abstractmethod
+    async def clear_embedded_images(self, vehicle_id: str, image_count: int):
+        ...
+
+    @abstractmethod
+    async def delete_owned(self, vehicle_id: str, user_id: str) -> Optional[dict]:
+        # Returns the deleted vehicle (without images), or None if it wasn't the user's
+        ...
+
+    @abstractmethod
+    def make_model_counts(self):
+        # Async iterator of {"make", "model", "count"} over all vehicles
+        ...
+
+class VehicleImageRepo(ABC):
+    # Gallery images, one document each, ordered by a per-vehicle position
+    @abstractmethod
+    async def insert_many(self, image_docs: List[dict]):
+        # Positions already present are left as they are
+        ...
+
+    @abstractmethod
+    async def get(self, vehicle_id: str, position: int) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def page(self, vehicle_id: str, after: Optional[int], limit: int) -> List[dict]:
+        # Image metadata (no data) in position order, after `after` when given
+        ...
+
+    @abstractmethod
+    async def delete_for_vehicle(self, vehicle_id: str):
+        ...
+
+class PostRepo(ABC):
+    @abstractmethod
+    async def get(self, post_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def insert(self, post_doc: dict):
+        ...
+
+    @abstractmethod
+    async def feed(self, after: Optional[tuple], limit: int) -> List[dict]:
+        # Newest first by (created_at, id), strictly older than `after` when given, with
+        # the author and vehicle summaries joined in
+        ...
+
+    @abstractmethod
+    async def feed_items(self, post_ids: List[str]) -> List[dict]:
+        # Same shape as feed(), for the given ids in the given order
+        ...
+
+    @abstractmethod
+    async def recent(self, limit: int, fields: Optional[List[str]] = None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def list_by_user(self, user_id: str, skip: int, limit: int) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def increment(self, post_id: str, field: str, amount: int) -> Optional[int]:
+        # Returns the counter's new value, or None if the post doesn't exist
+        ...
+
+    @abstractmethod
+    async def set_flag(self, post_id: str, flag: str, value: bool) -> bool:
+        # True only for the call that changed it, so a retried job can tell its effect landed
+        ...
+
+    @abstractmethod
+    async def stale_author_post_ids(self, user_id: str, version: int, limit: int) -> List[str]:
+        # Ids of the user's posts whose embedded author snapshot is older than `version`
+        ...
+
+    @abstractmethod
+    async def set_author_snapshots(self, post_ids: List[str], snapshot: dict):
+        ...
+
+    # Partitions (see post_partition()). Reads above fall through from hot storage to the
+    # cold partitions on demand; cold items carry "archived" with their partition key.
+    @abstractmethod
+    async def load_partitions(self):
+        # Refreshes this process's view of which partitions are cold
+        ...
+
+    @abstractmethod
+    async def archived_partition(self, post_id: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def oldest_hot(self) -> Optional[datetime]:
+        ...
+
+    @abstractmethod
+    async def claim_partition(self, key: str, owner: str, lease_seconds: float) -> Optional[dict]:
+        # The partition's catalog entry, leased to `owner`; None while another owner holds it
+        ...
+
+    @abstractmethod
+    async def copy_to_cold(self, key: str) -> List[str]:
+        # Copies the partition's hot posts to cold storage and returns their ids. Idempotent.
+        ...
+
+    @abstractmethod
+    async def mark_cold(self, key: str, count: int):
+        ...
+
+    @abstractmethod
+    async def hot_post_ids(self, key: str) -> List[str]:
+        ...
+
+    @abstractmethod
+    async def drop_hot(self, key: str):
+        ...
+
+class LikeRepo(ABC):
+    @abstractmethod
+    async def get(self, post_id: str, user_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def insert(self, like_doc: dict):
+        ...
+
+    @abstractmethod
+    async def delete(self, post_id: str, user_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def liked_post_ids(self, user_id: str, post_ids: List[str], archived: Optional[dict] = None) -> set:
+        # Which of `post_ids` the user has liked, in one lookup; `archived` maps cold
+        # partition keys to the ids among them that live there (see archived_ids())
+        ...
+
+    @abstractmethod
+    async def recent_post_ids(self, user_id: str, limit: int) -> List[str]:
+        ...
+
+    @abstractmethod
+    async def copy_to_cold(self, key: str, post_ids: List[str]):
+        # Copies the likes of `post_ids` into the partition's cold storage. Idempotent.
+        ...
+
+    @abstractmethod
+    async def drop_hot(self, post_ids: List[str]):
+        ...
+
+class TrendingRepo(ABC):
+    # Persists the trending view's score table so restarts don't start cold
+    @abstractmethod
+    async def load_snapshot(self) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def save_snapshot(self, snapshot: dict):
+        ...
+
+class TagRepo(ABC):
+    @abstractmethod
+    async def add_post(self, post_id: str, tags: List[str], created_at: datetime) -> List[str]:
+        # Returns the tags the post wasn't already indexed under
+        ...
+
+    @abstractmethod
+    async def post_ids(self, tag: str, before: Optional[tuple], limit: int) -> List[tuple]:
+        # (created_at, post_id) newest first, strictly older than `before` when given
+        ...
+
+    @abstractmethod
+    async def add_counts(self, deltas: dict):
+        ...
+
+    @abstractmethod
+    async def get_count(self, tag: str) -> int:
+        ...
+
+class NotificationRepo(ABC):
+    @abstractmethod
+    async def insert_many(self, notification_docs: List[dict]):
+        ...
+
+    @abstractmethod
+    async def list_for_user(self, user_id: str, limit: int) -> List[dict]:
+        ...
+
+class ChangeLogRepo(ABC):
+    # Append-only log of entity changes with a gap-free, increasing sequence number
+    @abstractmethod
+    async def record(self, changes: List[tuple], owner_id: str):
+        # `changes` are (entity, entity_id, op), given consecutive seqs in order
+        ...
+
+    @abstractmethod
+    async def since(self, seq: int, owner_id: str, global_entities: List[str], until: datetime, limit: int) -> List[dict]:
+        # Entries after `seq` recorded before `until`, that are either owned by `owner_id`
+        # or belong to one of `global_entities`; ascending by seq
+        ...
+
+    @abstractmethod
+    async def settled_seq(self, until: datetime) -> int:
+        # Highest seq recorded before `until`, 0 if none
+        ...
+
+    @abstractmethod
+    async def oldest_seq(self) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    async def latest_seq(self) -> int:
+        ...
+
+class IdempotencyRepo(ABC):
+    # One record per (user, Idempotency-Key): claimed while the first request runs, then
+    # holding its result until the TTL expires
+    @abstractmethod
+    async def claim(self, scope: str, fingerprint: str, resource_id: Optional[str], lock_seconds: float) -> Tuple[bool, dict]:
+        # (True, record) when the caller now owns the key: new, or a pending claim not
+        # renewed for `lock_seconds` whose worker presumably died, in which case the record
+        # keeps the resource_id that worker was creating. Otherwise (False, record).
+        ...
+
+    @abstractmethod
+    async def renew(self, scope: str):
+        # Keeps a pending claim's lock fresh while its request is still working
+        ...
+
+    @abstractmethod
+    async def get(self, scope: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def complete(self, scope: str, result):
+        ...
+
+    @abstractmethod
+    async def release(self, scope: str):
+        ...
+
+class RevocationRepo(ABC):
+    # Revoked session and token ids, kept until the tokens they cover would have expired
+    @abstractmethod
+    async def add(self, key: str, expires_at: datetime):
+        ...
+
+    @abstractmethod
+    async def since(self, revoked_after: Optional[datetime]) -> List[dict]:
+        # Unexpired entries revoked after `revoked_after` (all when None), oldest first
+        ...
+
+class JobRepo(ABC):
+    # Durable queue behind JobRunner. Held, pending and running jobs carry `due_at` (hold
+    # expiry, run time, lease expiry); the first due job of a type is claimable. Finished
+    # and dead-lettered jobs drop `due_at`.
+    @abstractmethod
+    async def insert_many(self, job_docs: List[dict]):
+        ...
+
+    @abstractmethod
+    async def release(self, job_ids: List[str]):
+        # Held jobs become due now
+        ...
+
+    @abstractmethod
+    async def claim(self, job_type: str, owner: str, lease_seconds: float) -> Optional[dict]:
+        # The most overdue job of `job_type`, now running under a lease, attempts bumped
+        ...
+
+    @abstractmethod
+    async def complete(self, job: dict):
+        ...
+
+    @abstractmethod
+    async def retry(self, job: dict, run_at: datetime, error: str):
+        ...
+
+    @abstractmethod
+    async def dead_letter(self, job: dict, error: str):
+        ...
+
+class MigrationRepo(ABC):
+    # One-off data migrations run by a single worker: a lease while running, then a done flag
+    @abstractmethod
+    async def claim(self, name: str, owner: str, lease_seconds: float) -> bool:
+        # False once the migration is done or while another owner's lease is live. The owner
+        # calls it again to extend its lease.
+        ...
+
+    @abstractmethod
+    async def finish(self, name: str):
+        ...
+
+class Repositories:
+    def __init__(
+        self,
+        users: UserRepo,
+        vehicles: VehicleRepo,
+        vehicle_images: VehicleImageRepo,
+        posts: PostRepo,
+        likes: LikeRepo,
+        trending: TrendingRepo,
+        tags: TagRepo,
+        notifications: NotificationRepo,
+        changes: ChangeLogRepo,
+        idempotency: IdempotencyRepo,
+        revocations: RevocationRepo,
+        jobs: JobRepo,
+        migrations: MigrationRepo,
+    ):
+        self.users = users
+        self.vehicles = vehicles
+        self.vehicle_images = vehicle_images
+        self.posts = posts
+        self.likes = likes
+        self.trending = trending
+        self.tags = tags
+        self.notifications = notifications
+        self.changes = changes
+        self.idempotency = idempotency
+        self.revocations = revocations
+        self.jobs = jobs
+        self.migrations = migrations
+
+    async def ensure_indexes(self):
+        for repo in vars(self).values():
+            ensure = getattr(repo, "ensure_indexes", None)
+            if ensure:
+                await ensure()
+
+def author_snapshot(user: dict) -> dict:
+    # Small, versioned copy of the author embedded in each post so feed reads need no
+    # users join; the avatar is a cacheable URL rather than the base64 payload itself.
+    version = user.get("profile_version", 0)
+    return {
+        "id": user["id"],
+        "username": user.get("username"),
+        "full_name": user.get("full_name"),
+        "avatar_url": f"/api/users/{user['id']}/avatar?v={version}" if user.get("has_avatar", user.get("profile_image")) else "",
+        "version": version,
+    }
+
+# has_avatar is derived by the repo, so snapshot reads never pull the base64 profile_image
+AUTHOR_SNAPSHOT_FIELDS = ["id", "username", "full_name", "has_avatar", "profile_version"]
+
+async def fill_missing_authors(items: List[dict], users: "UserRepo") -> List[dict]:
+    # Posts written before snapshots existed still get an author, via one $in lookup
+    missing = list({item["user_id"] for item in items if not item.get("user")})
+    if missing:
+        snapshots = {user["id"]: author_snapshot(user) for user in await users.get_many(missing, AUTHOR_SNAPSHOT_FIELDS)}
+        for item in items:
+            if not item.get("user"):
+                item["user"] = snapshots.get(item["user_id"], {})
+    return items
+
+# Posts are grouped into time partitions by created_at (POST_PARTITION: "month" or
+# "week"). The newest POST_HOT_PARTITIONS stay in the hot collections; PostArchiver moves
+# older ones, their likes included, into compressed per-partition cold storage, so the
+# hot working set stays bounded as the platform ages.
+POST_PARTITION = os.environ.get('POST_PARTITION', 'month')
+POST_HOT_PARTITIONS = int(os.environ.get('POST_HOT_PARTITIONS', '6'))
+POST_ARCHIVE_BATCH = int(os.environ.get('POST_ARCHIVE_BATCH', '500'))
+POST_ARCHIVE_COMPRESSOR = os.environ.get('POST_ARCHIVE_COMPRESSOR', 'zstd')
+
+def post_partition(created_at: datetime) -> str:
+    # Keys sort chronologically: "2025-07", or "2025-W28" by ISO week
+    if POST_PARTITION == "week":
+        year, week, _ = created_at.isocalendar()
+        return f"{year}-W{week:02d}"
+    return created_at.strftime("%Y-%m")
+
+def partition_bounds(key: str) -> tuple:
+    # [start, end) as naive UTC datetimes, like created_at
+    if "-W" in key:
+        year, week = key.split("-W")
+        start = datetime.fromisocalendar(int(year), int(week), 1)
+        return start, start + timedelta(weeks=1)
+    year, month = map(int, key.split("-"))
+    return datetime(year, month, 1), datetime(year + month // 12, month % 12 + 1, 1)
+
+def hot_floor(now: datetime) -> datetime:
+    # Start of the oldest partition kept hot
+    start = partition_bounds(post_partition(now))[0]
+    for _ in range(POST_HOT_PARTITIONS - 1):
+        start = partition_bounds(post_partition(start - timedelta(days=1)))[0]
+    return start
+
+async def read_across_partitions(skip: int, limit: int, hot, hot_count, cold_partitions: List[dict], cold, cold_count) -> list:
+    # Newest first through hot storage, then through the cold partitions (newest first).
+    # Partitions wholly inside the skipped window are only counted, never read.
+    items = await hot(skip, limit)
+    if len(items) == limit or not cold_partitions:
+        return items
+    skip = 0 if items else max(skip - await hot_count(), 0)
+    for partition in cold_partitions:
+        if skip:
+            count = await cold_count(partition)
+            if skip >= count:
+                skip -= count
+                continue
+        items += await cold(partition, skip, limit - len(items))
+        skip = 0
+        if len(items) == limit:
+            break
+    return items
+
+async def read_partitions_before(after: Optional[tuple], limit: int, hot, cold_partitions: List[dict], cold) -> list:
+    # Keyset variant: `hot` and `cold` apply the `after` bound themselves, and cold
+    # partitions that start after it hold nothing older, so they are never read
+    items = await hot(limit)
+    for partition in cold_partitions:
+        if len(items) == limit:
+            break
+        if after is None or partition["start"] <= after[0]:
+            items += await cold(partition, limit - len(items))
+    return items
+
+def _mark_archived(items: List[dict], key: str) -> List[dict]:
+    for item in items:
+        item["archived"] = key
+    return items
+
+# --- Motor ---
+def cold_collection_name(kind: str, key: str) -> str:
+    return f"{kind}_archive_{key.replace('-', '_')}"
+
+async def create_cold_collection(database, name: str):
+    try:
+        await database.create_collection(
+            name, storageEngine={"wiredTiger": {"configString": f"block_compressor={POST_ARCHIVE_COMPRESSOR}"}}
+        )
+    except CollectionInvalid:
+        pass  # created by an earlier, interrupted run
+# Strength 2 compares case-insensitively; queries must pass it to use the unique indexes
+CASE_INSENSITIVE = Collation(locale="en", strength=2)
+
+def _projection(fields: Optional[List[str]]) -> dict:
+    return {"_id": 0, **{field: 1 for field in fields}} if fields else {"_id": 0}
+
+USER_DERIVED_FIELDS = {"has_avatar": {"$gt": ["$profile_image", ""]}}
+
+def _user_projection(fields: Optional[List[str]]) -> dict:
+    projection = _projection(fields)
+    for field in fields or ():
+        if field in USER_DERIVED_FIELDS:
+            projection[field] = USER_DERIVED_FIELDS[field]
+    return projection
+
+class MotorUserRepo(UserRepo):
+    def __init__(self, database):
+        self.collection = database.users
+        self.unique_indexes = set()  # fields whose case-insensitive unique index is in place
+
+    async def get(self, user_id):
+        return await self.collection.find_one({"id": user_id})
+
+    async def get_by_email(self, email):
+        return await self.collection.find_one({"email": email}, collation=CASE_INSENSITIVE)
+
+    async def get_by_usernames(self, usernames, fields=None):
+        if not usernames:
+            return []
+        return await self.collection.find(
+            {"username": {"$in": usernames}}, _user_projection(fields), collation=CASE_INSENSITIVE
+        ).to_list(len(usernames))
+
+    async def get_many(self, user_ids, fields=None):
+        if not user_ids:
+            return []
+        return await self.collection.find({"id": {"$in": user_ids}}, _user_projection(fields)).to_list(len(user_ids))
+
+    async def update_returning(self, user_id, fields, increments):
+        update = {"$set": fields}
+        if increments:
+            update["$inc"] = increments
+        return await self.collection.find_one_and_update(
+            {"id": user_id}, update, projection={"_id": 0, "password": 0}, return_document=ReturnDocument.AFTER
+        )
+
+    async def username_taken(self, username):
+        return await self.collection.find_one({"username": username}, {"_id": 1}, collation=CASE_INSENSITIVE) is not None
+
+    async def iter_usernames(self):
+        async for user in self.collection.find({}, {"_id": 0, "username": 1}).batch_size(5000):
+            yield user["username"]
+
+    async def insert(self, user_doc):
+        for field in ("email", "username"):
+            if field not in self.unique_indexes and await self.collection.find_one(
+                {field: user_doc[field]}, {"_id": 1}, collation=CASE_INSENSITIVE
+            ):
+                # No unique index to decide, so fall back to the (racy) pre-check
+                raise DuplicateKeyError(f"duplicate {field}")
+        await self.collection.insert_one(user_doc)
+
+    async def update_fields(self, user_id, fields):
+        await self.collection.update_one({"id": user_id}, {"$set": fields})
+
+    async def increment(self, user_id, field, amount):
+        await self.collection.update_one({"id": user_id}, {"$inc": {field: amount}})
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("id", unique=True)
+        for field in ("email", "username"):
+            try:
+                await self.collection.create_index(field, name=f"{field}_unique_ci", unique=True, collation=CASE_INSENSITIVE)
+                self.unique_indexes.add(field)
+            except OperationFailure as e:
+                # Existing case-variant duplicates block the build; registration keeps a
+                # pre-check for this field, but isn't race-free until they are merged
+                logger.error(f"Could not create unique {field} index, checking duplicates before insert: {e}")
+
+class MotorVehicleRepo(VehicleRepo):
+    def __init__(self, database):
+        self.collection = database.vehicles
+
+    async def get(self, vehicle_id):
+        return await self.collection.find_one({"id": vehicle_id})
+
+    async def list_by_user(self, user_id, limit, fields=None):
+        return await self.collection.find({"user_id": user_id}, _projection(fields)).to_list(limit)
+
+    async def iter_by_user(self, user_id, after=None, limit=None):
+        query = {"user_id": user_id}
+        if after:
+            created_at, vehicle_id = after
+            query["$or"] = [{"created_at": {"$gt": created_at}}, {"created_at": created_at, "id": {"$gt": vehicle_id}}]
+        cursor = self.collection.find(query, {"_id": 0, "images": 0}).sort([("created_at", 1), ("id", 1)])
+        if limit:
+            cursor = cursor.limit(limit)
+        async for vehicle in cursor.batch_size(min(limit or VEHICLE_STREAM_BATCH, VEHICLE_STREAM_BATCH)):
+            yield vehicle
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("user_id", 1), ("created_at", 1), ("id", 1)], name="user_created")
+
+    async def get_many(self, vehicle_ids, fields=None):
+        if not vehicle_ids:
+            return []
+        return await self.collection.find({"id": {"$in": vehicle_ids}}, _projection(fields)).to_list(len(vehicle_ids))
+
+    async def iter_all(self, fields=None):
+        async for vehicle in self.collection.find({}, _projection(fields)).batch_size(1000):
+            yield vehicle
+
+    async def insert(self, vehicle_doc):
+        await self.collection.insert_one(vehicle_doc)
+
+    async def update_owned(self, vehicle_id, user_id, fields, version=None, image_limit=None):
+        query = {"id": vehicle_id, "user_id": user_id}
+        if version is not None:
+            # Vehicles written before versioning have no field and count as version 0
+            query["version"] = version if version else {"$in": [0, None]}
+        update = {"$inc": {"version": 1}}
+        if fields:
+            update["$set"] = fields
+        if image_limit is not None:
+            query["image_count"] = {"$not": {"$gte": image_limit}}  # missing counts as 0
+            update["$inc"]["image_count"] = 1
+        return await self.collection.find_one_and_update(
+            query, update, projection={"_id": 0, "images": 0}, return_document=ReturnDocument.BEFORE
+        )
+
+    async def iter_embedded_images(self):
+        async for vehicle in self.collection.find(
+            {"images": {"$exists": True}}, {"_id": 0, "id": 1, "user_id": 1, "images": 1}
+        ).batch_size(50):
+            yield vehicle
+
+    async def clear_embedded_images(self, vehicle_id, image_count):
+        # $max: an upload may already have reserved positions past the migrated images
+        await self.collection.update_one(
+            {"id": vehicle_id, "images": {"$exists": True}}, {"$max": {"image_count": image_count}, "$unset": {"images": ""}}
+        )
+
+    async def delete_owned(self, vehicle_id, user_id):
+        return await self.collection.find_one_and_delete(
+            {"id": vehicle_id, "user_id": user_id}, projection={"_id": 0, "images": 0}
+        )
+
+    async def make_model_counts(self):
+        pipeline = [{"$group": {"_id": {"make": "$make", "model": "$model"}, "count": {"$sum": 1}}}]
+        async for group in self.collection.aggregate(pipeline, allowDiskUse=True).batch_size(1000):
+            yield {"make": group["_id"].get("make"), "model": group["_id"].get("model"), "count": group["count"]}
+
+class MotorVehicleImageRepo(VehicleImageRepo):
+    def __init__(self, database):
+        self.collection = database.vehicle_images
+
+    async def insert_many(self, image_docs):
+        if not image_docs:
+            return
+        try:
+            await self.collection.insert_many(image_docs, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def get(self, vehicle_id, position):
+        return await self.collection.find_one({"vehicle_id": vehicle_id, "position": position}, {"_id": 0})
+
+    async def page(self, vehicle_id, after, limit):
+        query = {"vehicle_id": vehicle_id}
+        if after is not None:
+            query["position"] = {"$gt": after}
+        return await self.collection.find(query, {"_id": 0, "data": 0}).sort("position", 1).limit(limit).to_list(limit)
+
+    async def delete_for_vehicle(self, vehicle_id):
+        await self.collection.delete_many({"vehicle_id": vehicle_id})
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("vehicle_id", 1), ("position", 1)], name="vehicle_position", unique=True)
+
+# Projects posts into feed items: the embedded author snapshot plus a joined vehicle summary
+FEED_JOIN_STAGES = [
+    {
+        "$lookup": {
+            "from": "vehicles",
+            "localField": "vehicle_id",
+            "foreignField": "id",
+            "as": "vehicle"
+        }
+    },
+    {
+        "$project": {
+            "_id": 0,  # Exclude MongoDB _id
+            "id": 1,
+            "user_id": 1,
+            "vehicle_id": 1,
+            "caption": 1,
+            "images": 1,
+            "likes_count": 1,
+            "comments_count": 1,
+            "tags": 1,
+            "mentions": 1,
+            "created_at": 1,
+            "user": "$author",  # embedded snapshot, see author_snapshot()
+            "vehicle": {
+                "$let": {
+                    "vars": {"vehicle": {"$arrayElemAt": ["$vehicle", 0]}},
+                    "in": {
+                        "$cond": {
+                            "if": {"$ne": ["$$vehicle", None]},
+                            "then": {
+                                "id": "$$vehicle.id",
+                                "make": "$$vehicle.make",
+                                "model": "$$vehicle.model",
+                                "year": "$$vehicle.year",
+                                "type": "$$vehicle.type",
+                                "color": "$$vehicle.color"
+                            },
+                            "else": None
+                        }
+                    }
+                }
+            }
+        }
+    }
+]
+
+class MotorPostRepo(PostRepo):
+    def __init__(self, database, users: UserRepo):
+        self.database = database
+        self.collection = database.posts
+        self.partitions = database.post_partitions  # catalog: one entry per archiving/cold partition
+        self.locator = database.archived_posts  # post id -> cold partition key
+        self.users = users
+        self.cold = []  # cold partition entries, newest first
+        self.boundary = None  # end of the newest cold partition; hot reads start there
+
+    def _hot(self, query: dict) -> dict:
+        # A partition's hot copy lingers for a grace period after it goes cold; skip it
+        return {**query, "created_at": {"$gte": self.boundary}} if self.boundary else query
+
+    def _cold_posts(self, key: str):
+        return self.database[cold_collection_name("posts", key)]
+
+    async def _locate(self, post_ids: List[str]) -> dict:
+        located = {}
+        async for entry in self.locator.find({"_id": {"$in": post_ids}}):
+            located.setdefault(entry["partition"], []).append(entry["_id"])
+        return located
+
+    async def get(self, post_id):
+        post = await self.collection.find_one({"id": post_id})
+        if post is None and self.cold:
+            key = await self.archived_partition(post_id)
+            if key:
+                post = await self._cold_posts(key).find_one({"id": post_id})
+                if post:
+                    post["archived"] = key
+        return post
+
+    async def insert(self, post_doc):
+        await self.collection.insert_one(post_doc)
+
+    async def feed(self, after, limit):
+        query = {}
+        if after:
+            created_at, post_id = after
+            query["$or"] = [{"created_at": {"$lt": created_at}}, {"created_at": created_at, "id": {"$lt": post_id}}]
+
+        async def hot(limit):
+            pipeline = [
+                {"$match": self._hot(query)},
+                {"$sort": {"created_at": -1, "id": -1}},
+                {"$limit": limit},
+                *FEED_JOIN_STAGES
+            ]
+            return await self.collection.aggregate(pipeline).to_list(limit)
+
+        async def cold(partition, limit):
+            pipeline = [{"$match": query}, {"$sort": {"created_at": -1, "id": -1}}, {"$limit": limit}, *FEED_JOIN_STAGES]
+            items = await self._cold_posts(partition["_id"]).aggregate(pipeline).to_list(limit)
+            return _mark_archived(items, partition["_id"])
+
+        items = await read_partitions_before(after, limit, hot, self.cold, cold)
+        return await fill_missing_authors(items, self.users)
+
+    async def feed_items(self, post_ids):
+        if not post_ids:
+            return []
+        pipeline = [{"$match": {"id": {"$in": post_ids}}}, *FEED_JOIN_STAGES]
+        items = {item["id"]: item for item in await self.collection.aggregate(pipeline).to_list(len(post_ids))}
+        missing = [post_id for post_id in post_ids if post_id not in items]
+        if missing and self.cold:
+            for key, ids in (await self._locate(missing)).items():
+                pipeline = [{"$match": {"id": {"$in": ids}}}, *FEED_JOIN_STAGES]
+                for item in _mark_archived(await self._cold_posts(key).aggregate(pipeline).to_list(len(ids)), key):
+                    items[item["id"]] = item
+        return await fill_missing_authors([items[post_id] for post_id in post_ids if post_id in items], self.users)
+
+    async def recent(self, limit, fields=None):
+        return await self.collection.find(self._hot({}), _projection(fields)).sort("created_at", -1).limit(limit).to_list(limit)
+
+    async def list_by_user(self, user_id, skip, limit):
+        async def hot(skip, limit):
+            query = self._hot({"user_id": user_id})
+            return await self.collection.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+
+        async def hot_count():
+            return await self.collection.count_documents(self._hot({"user_id": user_id}))
+
+        async def cold(partition, skip, limit):
+            posts = await self._cold_posts(partition["_id"]).find({"user_id": user_id}).sort(
+                "created_at", -1
+            ).skip(skip).limit(limit).to_list(limit)
+            return _mark_archived(posts, partition["_id"])
+
+        async def cold_count(partition):
+            return await self._cold_posts(partition["_id"]).count_documents({"user_id": user_id})
+
+        return await read_across_partitions(skip, limit, hot, hot_count, self.cold, cold, cold_count)
+
+    async def increment(self, post_id, field, amount):
+        post = await self.collection.find_one_and_update(
+            {"id": post_id}, {"$inc": {field: amount}},
+            projection={"_id": 0, field: 1}, return_document=ReturnDocument.AFTER,
+        )
+        return post[field] if post else None
+
+    async def set_flag(self, post_id, flag, value):
+        result = await self.collection.update_one({"id": post_id, flag: {"$ne": value}}, {"$set": {flag: value}})
+        return result.modified_count == 1
+
+    async def stale_author_post_ids(self, user_id, version, limit):
+        posts = await self.collection.find(
+            {"user_id": user_id, "$or": [{"author.version": {"$lt": version}}, {"author": {"$exists": False}}]},
+            {"_id": 0, "id": 1},
+        ).limit(limit).to_list(limit)
+        return [post["id"] for post in posts]
+
+    async def set_author_snapshots(self, post_ids, snapshot):
+        # Guarded on version so a slow, older propagation never overwrites a newer one
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"id": post_id, "$or": [{"author.version": {"$lt": snapshot["version"]}}, {"author": {"$exists": False}}]},
+                {"$set": {"author": snapshot}},
+            )
+            for post_id in post_ids
+        ], ordered=False)
+
+    async def load_partitions(self):
+        entries = await self.partitions.find({"state": "cold"}).sort("_id", -1).to_list(None)
+        self.cold = entries
+        self.boundary = max((entry["end"] for entry in entries), default=None)
+
+    async def archived_partition(self, post_id):
+        # Checked even before this process has seen a partition go cold: once the
+        # archiver has copied a post, writes to its hot copy would be lost
+        entry = await self.locator.find_one({"_id": post_id})
+        return entry["partition"] if entry else None
+
+    async def oldest_hot(self):
+        post = await self.collection.find_one({}, {"_id": 0, "created_at": 1}, sort=[("created_at", 1)])
+        return post["created_at"] if post else None
+
+    async def claim_partition(self, key, owner, lease_seconds):
+        start, end = partition_bounds(key)
+        now = datetime.utcnow()
+        try:
+            return await self.partitions.find_one_and_update(
+                {"_id": key, "$or": [{"lease_until": {"$lt": now}}, {"owner": owner}]},
+                {
+                    "$set": {"owner": owner, "lease_until": now + timedelta(seconds=lease_seconds)},
+                    "$setOnInsert": {"state": "archiving", "start": start, "end": end},
+                },
+                upsert=True, return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return None  # leased to another worker
+
+    async def copy_to_cold(self, key):
+        start, end = partition_bounds(key)
+        name = cold_collection_name("posts", key)
+        await create_cold_collection(self.database, name)
+        cold = self.database[name]
+        await cold.create_index("id", unique=True)
+        await cold.create_index([("created_at", -1), ("id", -1)])
+        await cold.create_index([("user_id", 1), ("created_at", -1)])
+        post_ids = []
+        batch = []
+        cursor = self.collection.find({"created_at": {"$gte": start, "$lt": end}}).batch_size(POST_ARCHIVE_BATCH)
+        async for post in cursor:
+            batch.append(post)
+            if len(batch) == POST_ARCHIVE_BATCH:
+                post_ids += await self._copy_batch(cold, key, batch)
+                batch = []
+        if batch:
+            post_ids += await self._copy_batch(cold, key, batch)
+        return post_ids
+
+    async def _copy_batch(self, cold, key, posts):
+        # Upserts keyed on _id, so a rerun after a crash just rewrites the same documents
+        await cold.bulk_write([ReplaceOne({"_id": post["_id"]}, post, upsert=True) for post in posts], ordered=False)
+        await self.locator.bulk_write(
+            [ReplaceOne({"_id": post["id"]}, {"partition": key}, upsert=True) for post in posts], ordered=False
+        )
+        return [post["id"] for post in posts]
+
+    async def mark_cold(self, key, count):
+        await self.partitions.update_one(
+            {"_id": key}, {"$set": {"state": "cold", "count": count, "cold_at": datetime.utcnow()}}
+        )
+
+    async def hot_post_ids(self, key):
+        start, end = partition_bounds(key)
+        posts = await self.collection.find({"created_at": {"$gte": start, "$lt": end}}, {"_id": 0, "id": 1}).to_list(None)
+        return [post["id"] for post in posts]
+
+    async def drop_hot(self, key):
+        start, end = partition_bounds(key)
+        await self.collection.delete_many({"created_at": {"$gte": start, "$lt": end}})
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("id")
+        await self.collection.create_index([("created_at", -1), ("id", -1)])
+        await self.collection.create_index([("user_id", 1), ("created_at", -1)])
+
+class MotorLikeRepo(LikeRepo):
+    def __init__(self, database):
+        self.database = database
+        self.collection = database.likes
+
+    async def get(self, post_id, user_id):
+        return await self.collection.find_one({"post_id": post_id, "user_id": user_id})
+
+    async def insert(self, like_doc):
+        await self.collection.insert_one(like_doc)
+
+    async def delete(self, post_id, user_id):
+        result = await self.collection.delete_one({"post_id": post_id, "user_id": user_id})
+        return result.deleted_count > 0
+
+    async def liked_post_ids(self, user_id, post_ids, archived=None):
+        if not post_ids:
+            return set()
+        likes = await self.collection.find(
+            {"user_id": user_id, "post_id": {"$in": post_ids}}, {"_id": 0, "post_id": 1}
+        ).to_list(len(post_ids))
+        liked = {like["post_id"] for like in likes}
+        for key, ids in (archived or {}).items():
+            likes = await self.database[cold_collection_name("likes", key)].find(
+                {"user_id": user_id, "post_id": {"$in": ids}}, {"_id": 0, "post_id": 1}
+            ).to_list(len(ids))
+            liked.update(like["post_id"] for like in likes)
+        return liked
+
+    async def recent_post_ids(self, user_id, limit):
+        likes = await self.collection.find(
+            {"user_id": user_id}, {"_id": 0, "post_id": 1}
+        ).sort("created_at", -1).limit(limit).to_list(limit)
+        return [like["post_id"] for like in likes]
+
+    async def copy_to_cold(self, key, post_ids):
+        name = cold_collection_name("likes", key)
+        await create_cold_collection(self.database, name)
+        cold = self.database[name]
+        await cold.create_index([("user_id", 1), ("post_id", 1)], name="user_post")
+        for start in range(0, len(post_ids), POST_ARCHIVE_BATCH):
+            likes = await self.collection.find({"post_id": {"$in": post_ids[start:start + POST_ARCHIVE_BATCH]}}).to_list(None)
+            if likes:
+                await cold.bulk_write([ReplaceOne({"_id": like["_id"]}, like, upsert=True) for like in likes], ordered=False)
+
+    async def drop_hot(self, post_ids):
+        for start in range(0, len(post_ids), POST_ARCHIVE_BATCH):
+            await self.collection.delete_many({"post_id": {"$in": post_ids[start:start + POST_ARCHIVE_BATCH]}})
+
+    async def ensure_indexes(self):
+        # Covers toggle_like's point lookup and the per-page liked_by_me $in query
+        await self.collection.create_index([("user_id", 1), ("post_id", 1)], name="user_post")
+        await self.collection.create_index("post_id")  # moving a partition's likes to cold storage
+
+class MotorTrendingRepo(TrendingRepo):
+    def __init__(self, database):
+        self.collection = database.trending
+
+    async def load_snapshot(self):
+        return await self.collection.find_one({"_id": "scores"}, {"_id": 0})
+
+    async def save_snapshot(self, snapshot):
+        await self.collection.replace_one({"_id": "scores"}, snapshot, upsert=True)
+
+class MotorTagRepo(TagRepo):
+    def __init__(self, database):
+        self.collection = database.post_tags
+        self.counts = database.tags
+        self.unique_index = False  # whether the unique (tag, post_id) index is in place
+
+    async def add_post(self, post_id, tags, created_at):
+        if tags and not self.unique_index:
+            # No unique index to reject a retry's duplicates, so fall back to the (racy) pre-check
+            indexed = set(await self.collection.distinct("tag", {"post_id": post_id, "tag": {"$in": tags}}))
+            tags = [tag for tag in tags if tag not in indexed]
+        if not tags:
+            return []
+        try:
+            await self.collection.insert_many(
+                [{"tag": tag, "created_at": created_at, "post_id": post_id} for tag in tags], ordered=False
+            )
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            duplicates = {error["index"] for error in errors}
+            return [tag for index, tag in enumerate(tags) if index not in duplicates]
+        return tags
+
+    async def post_ids(self, tag, before, limit):
+        query = {"tag": tag}
+        if before:
+            created_at, post_id = before
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "post_id": {"$lt": post_id}},
+            ]
+        entries = await self.collection.find(query, {"_id": 0, "created_at": 1, "post_id": 1}).sort(
+            [("created_at", -1), ("post_id", -1)]
+        ).limit(limit).to_list(limit)
+        return [(entry["created_at"], entry["post_id"]) for entry in entries]
+
+    async def add_counts(self, deltas):
+        if deltas:
+            await self.counts.bulk_write(
+                [UpdateOne({"tag": tag}, {"$inc": {"posts_count": delta}}, upsert=True) for tag, delta in deltas.items()],
+                ordered=False,
+            )
+
+    async def get_count(self, tag):
+        doc = await self.counts.find_one({"tag": tag}, {"_id": 0, "posts_count": 1})
+        return doc["posts_count"] if doc else 0
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("tag", 1), ("created_at", -1), ("post_id", -1)], name="tag_timeline")
+        try:
+            await self.collection.create_index([("tag", 1), ("post_id", 1)], name="tag_post_unique", unique=True)
+            self.unique_index = True
+        except OperationFailure as e:
+            # Entries duplicated by earlier job retries block the build until they are removed
+            logger.error(f"Could not create unique post_tags index, checking for entries before insert: {e}")
+        await self.counts.create_index("tag", unique=True)
+
+class MotorNotificationRepo(NotificationRepo):
+    def __init__(self, database):
+        self.collection = database.notifications
+
+    async def insert_many(self, notification_docs):
+        if not notification_docs:
+            return
+        try:
+            await self.collection.insert_many(
+                [{**notification, "_id": notification["id"]} for notification in notification_docs], ordered=False
+            )
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def list_for_user(self, user_id, limit):
+        return await self.collection.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("user_id", 1), ("created_at", -1)], name="user_timeline")
+
+class MotorChangeLogRepo(ChangeLogRepo):
+    def __init__(self, database):
+        self.collection = database.changes
+        self.counters = database.counters
+
+    async def record(self, changes, owner_id):
+        # One $inc reserves seqs for the whole batch, one insert_many writes it
+        counter = await self.counters.find_one_and_update(
+            {"_id": "changes"}, {"$inc": {"seq": len(changes)}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        first, now = counter["seq"] - len(changes) + 1, datetime.utcnow()
+        await self.collection.insert_many([
+            {"seq": first + i, "entity": entity, "entity_id": entity_id, "op": op, "owner_id": owner_id, "at": now}
+            for i, (entity, entity_id, op) in enumerate(changes)
+        ])
+
+    async def since(self, seq, owner_id, global_entities, until, limit):
+        return await self.collection.find(
+            {
+                "seq": {"$gt": seq},
+                "at": {"$lt": until},
+                "$or": [{"owner_id": owner_id}, {"entity": {"$in": global_entities}}],
+            },
+            {"_id": 0},
+        ).sort("seq", 1).limit(limit).to_list(limit)
+
+    async def settled_seq(self, until):
+        # Walks the seq index back from the newest entry; only the unsettled tail is skipped
+        settled = await self.collection.find({"at": {"$lt": until}}, {"_id": 0, "seq": 1}).sort("seq", -1).limit(1).to_list(1)
+        return settled[0]["seq"] if settled else 0
+
+    async def oldest_seq(self):
+        oldest = await self.collection.find({}, {"_id": 0, "seq": 1}).sort("seq", 1).limit(1).to_list(1)
+        return oldest[0]["seq"] if oldest else None
+
+    async def latest_seq(self):
+        counter = await self.counters.find_one({"_id": "changes"})
+        return counter["seq"] if counter else 0
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("seq", unique=True)
+        await self.collection.create_index("at", expireAfterSeconds=SYNC_RETENTION_SECONDS)
+
+class MotorIdempotencyRepo(IdempotencyRepo):
+    def __init__(self, database):
+        self.collection = database.idempotency_keys
+
+    async def claim(self, scope, fingerprint, resource_id, lock_seconds):
+        now = datetime.utcnow()
+        record = {
+            "_id": scope, "fingerprint": fingerprint, "status": "pending", "resource_id": resource_id,
+            "created_at": now, "locked_at": now,
+        }
+        try:
+            await self.collection.insert_one(record)
+            return True, record
+        except DuplicateKeyError:
+            pass
+        taken_over = await self.collection.find_one_and_update(
+            {"_id": scope, "fingerprint": fingerprint, "status": "pending",
+             "locked_at": {"$lt": now - timedelta(seconds=lock_seconds)}},
+            {"$set": {"locked_at": now}},
+        )
+        if taken_over:
+            return True, taken_over
+        existing = await self.get(scope)
+        if existing is None:
+            return await self.claim(scope, fingerprint, resource_id, lock_seconds)  # expired in between
+        return False, existing
+
+    async def renew(self, scope):
+        await self.collection.update_one({"_id": scope, "status": "pending"}, {"$set": {"locked_at": datetime.utcnow()}})
+
+    async def get(self, scope):
+        return await self.collection.find_one({"_id": scope})
+
+    async def complete(self, scope, result):
+        await self.collection.update_one({"_id": scope}, {"$set": {"status": "done", "result": result}})
+
+    async def release(self, scope):
+        await self.collection.delete_one({"_id": scope, "status": "pending"})
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+
+class MotorRevocationRepo(RevocationRepo):
+    def __init__(self, database):
+        self.collection = database.revoked_tokens
+
+    async def add(self, key, expires_at):
+        await self.collection.update_one(
+            {"_id": key}, {"$set": {"expires_at": expires_at, "revoked_at": datetime.utcnow()}}, upsert=True
+        )
+
+    async def since(self, revoked_after):
+        query = {"expires_at": {"$gt": datetime.utcnow()}}
+        if revoked_after:
+            query["revoked_at"] = {"$gt": revoked_after}
+        return await self.collection.find(query).sort("revoked_at", 1).to_list(None)
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.collection.create_index("revoked_at")
+
+class MotorJobRepo(JobRepo):
+    def __init__(self, database):
+        self.collection = database.jobs
+
+    async def insert_many(self, job_docs):
+        await self.collection.insert_many(job_docs)
+
+    async def release(self, job_ids):
+        await self.collection.update_many(
+            {"_id": {"$in": job_ids}, "state": "held"}, {"$set": {"state": "pending", "due_at": datetime.utcnow()}}
+        )
+
+    async def claim(self, job_type, owner, lease_seconds):
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"type": job_type, "due_at": {"$lte": now}},
+            {
+                "$set": {"state": "running", "owner": owner, "due_at": now + timedelta(seconds=lease_seconds)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("due_at", 1)], return_document=ReturnDocument.AFTER,
+        )
+
+    async def _finish(self, job, fields, unset_due=True):
+        # Guarded on attempts: a run whose lease lapsed and was reclaimed can't overwrite the newer one
+        update = {"$set": fields}
+        if unset_due:
+            update["$unset"] = {"due_at": ""}
+        await self.collection.update_one({"_id": job["_id"], "attempts": job["attempts"]}, update)
+
+    async def complete(self, job):
+        await self._finish(job, {"state": "done", "done_at": datetime.utcnow()})
+
+    async def retry(self, job, run_at, error):
+        await self._finish(job, {"state": "pending", "due_at": run_at, "last_error": error}, unset_due=False)
+
+    async def dead_letter(self, job, error):
+        await self._finish(job, {"state": "dead", "dead_at": datetime.utcnow(), "last_error": error})
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("type", 1), ("due_at", 1)], name="due")
+        await self.collection.create_index("done_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+
+class MotorMigrationRepo(MigrationRepo):
+    def __init__(self, database):
+        self.collection = database.migrations
+
+    async def claim(self, name, owner, lease_seconds):
+        now = datetime.utcnow()
+        try:
+            await self.collection.update_one(
+                {"_id": name, "done": {"$ne": True}, "$or": [{"lease_until": {"$lt": now}}, {"owner": owner}]},
+                {"$set": {"owner": owner, "lease_until": now + timedelta(seconds=lease_seconds)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False  # done, or leased to another worker
+        return True
+
+    async def finish(self, name):
+        await self.collection.update_one(
+            {"_id": name}, {"$set": {"done": True, "done_at": datetime.utcnow()}, "$unset": {"lease_until": ""}}
+        )
+
+# --- In-memory ---
+# Documents are stored by id with secondary indexes kept alongside; reads hand out
+# shallow copies so callers can pop fields (e.g. password) without touching the store.
+def _project(doc: dict, fields: Optional[List[str]]) -> dict:
+    return {field: doc[field] for field in fields if field in doc} if fields else dict(doc)
+
+def _project_user(user: dict, fields: Optional[List[str]]) -> dict:
+    return _project({**user, "has_avatar": bool(user.get("profile_image"))}, fields) if fields else dict(user)
+
+def _newest_first(keys: list, skip: int, limit: int) -> list:
+    # `keys` is sorted ascending by (created_at, id)
+    end = max(len(keys) - skip, 0)
+    return [key[1] for key in reversed(keys[max(end - limit, 0):end])]
+
+def _newest_before(keys: list, after: Optional[tuple], limit: int) -> list:
+    end = bisect.bisect_left(keys, after) if after else len(keys)
+    return [key[1] for key in reversed(keys[max(end - limit, 0):end])]
+
+class MemoryUserRepo(UserRepo):
+    def __init__(self):
+        self.by_id = {}
+        self.by_email = {}  # case-folded email -> id
+        self.by_username = {}  # case-folded username -> id
+
+    async def get(self, user_id):
+        user = self.by_id.get(user_id)
+        return dict(user) if user else None
+
+    async def get_by_email(self, email):
+        user_id = self.by_email.get(email.casefold())
+        return await self.get(user_id) if user_id else None
+
+    async def get_by_usernames(self, usernames, fields=None):
+        user_ids = dict.fromkeys(self.by_username[key] for key in map(str.casefold, usernames) if key in self.by_username)
+        return [_project_user(self.by_id[user_id], fields) for user_id in user_ids]
+
+    async def get_many(self, user_ids, fields=None):
+        return [_project_user(self.by_id[user_id], fields) for user_id in user_ids if user_id in self.by_id]
+
+    async def update_returning(self, user_id, fields, increments):
+        user = self.by_id.get(user_id)
+        if not user:
+            return None
+        user.update(fields)
+        for field, amount in increments.items():
+            user[field] = user.get(field, 0) + amount
+        return {k: v for k, v in user.items() if k != "password"}
+
+    async def username_taken(self, username):
+        return username.casefold() in self.by_username
+
+    async def iter_usernames(self):
+        for user_id in list(self.by_username.values()):
+            yield self.by_id[user_id]["username"]
+
+    async def insert(self, user_doc):
+        if user_doc["email"].casefold() in self.by_email or user_doc["username"].casefold() in self.by_username:
+            raise DuplicateKeyError("duplicate email or username")
+        self.by_id[user_doc["id"]] = dict(user_doc)
+        self.by_email[user_doc["email"].casefold()] = user_doc["id"]
+        self.by_username[user_doc["username"].casefold()] = user_doc["id"]
+
+    async def update_fields(self, user_id, fields):
+        user = self.by_id.get(user_id)
+        if user:
+            user.update(fields)
+
+    async def increment(self, user_id, field, amount):
+        user = self.by_id.get(user_id)
+        if user:
+            user[field] = user.get(field, 0) + amount
+
+class MemoryVehicleRepo(VehicleRepo):
+    def __init__(self):
+        self.by_id = {}
+        self.by_user = {}  # user_id -> vehicle ids in insertion order
+
+    async def get(self, vehicle_id):
+        vehicle = self.by_id.get(vehicle_id)
+        return dict(vehicle) if vehicle else None
+
+    async def list_by_user(self, user_id, limit, fields=None):
+        return [_project(self.by_id[vehicle_id], fields) for vehicle_id in self.by_user.get(user_id, [])[:limit]]
+
+    async def iter_by_user(self, user_id, after=None, limit=None):
+        keys = sorted((self.by_id[vehicle_id]["created_at"], vehicle_id) for vehicle_id in self.by_user.get(user_id, []))
+        start = bisect.bisect_right(keys, after) if after else 0
+        for _, vehicle_id in keys[start:start + limit if limit else None]:
+            if vehicle_id in self.by_id:
+                yield {k: v for k, v in self.by_id[vehicle_id].items() if k != "images"}
+
+    async def get_many(self, vehicle_ids, fields=None):
+        return [_project(self.by_id[vehicle_id], fields) for vehicle_id in vehicle_ids if vehicle_id in self.by_id]
+
+    async def iter_all(self, fields=None):
+        for vehicle in list(self.by_id.values()):
+            yield _project(vehicle, fields)
+
+    async def insert(self, vehicle_doc):
+        self.by_id[vehicle_doc["id"]] = dict(vehicle_doc)
+        self.by_user.setdefault(vehicle_doc["user_id"], []).append(vehicle_doc["id"])
+
+    async def update_owned(self, vehicle_id, user_id, fields, version=None, image_limit=None):
+        vehicle = self.by_id.get(vehicle_id)
+        if not vehicle or vehicle["user_id"] != user_id:
+            return None
+        if version is not None and vehicle.get("version", 0) != version:
+            return None
+        if image_limit is not None and vehicle.get("image_count", 0) >= image_limit:
+            return None
+        before = {k: v for k, v in vehicle.items() if k != "images"}
+        vehicle.update(fields)
+        vehicle["version"] = vehicle.get("version", 0) + 1
+        if image_limit is not None:
+            vehicle["image_count"] = vehicle.get("image_count", 0) + 1
+        return before
+
+    async def iter_embedded_images(self):
+        for vehicle in list(self.by_id.values()):
+            if "images" in vehicle:
+                yield {"id": vehicle["id"], "user_id": vehicle["user_id"], "images": list(vehicle["images"])}
+
+    async def clear_embedded_images(self, vehicle_id, image_count):
+        vehicle = self.by_id.get(vehicle_id)
+        if vehicle and "images" in vehicle:
+            del vehicle["images"]
+            vehicle["image_count"] = max(vehicle.get("image_count", 0), image_count)
+
+    async def delete_owned(self, vehicle_id, user_id):
+        vehicle = self.by_id.get(vehicle_id)
+        if not vehicle or vehicle["user_id"] != user_id:
+            return None
+        del self.by_id[vehicle_id]
+        self.by_user[user_id].remove(vehicle_id)
+        return {k: v for k, v in vehicle.items() if k != "images"}
+
+    async def make_model_counts(self):
+        counts = {}
+        for vehicle in self.by_id.values():
+            key = (vehicle.get("make"), vehicle.get("model"))
+            counts[key] = counts.get(key, 0) + 1
+        for (make, model), count in counts.items():
+            yield {"make": make, "model": model, "count": count}
+
+class MemoryVehicleImageRepo(VehicleImageRepo):
+    def __init__(self):
+        self.by_vehicle = {}  # vehicle_id -> {position: image doc}
+
+    async def insert_many(self, image_docs):
+        for image in image_docs:
+            self.by_vehicle.setdefault(image["vehicle_id"], {}).setdefault(image["position"], dict(image))
+
+    async def get(self, vehicle_id, position):
+        image = self.by_vehicle.get(vehicle_id, {}).get(position)
+        return dict(image) if image else None
+
+    async def page(self, vehicle_id, after, limit):
+        images = self.by_vehicle.get(vehicle_id, {})
+        positions = sorted(position for position in images if after is None or position > after)[:limit]
+        return [{k: v for k, v in images[position].items() if k != "data"} for position in positions]
+
+    async def delete_for_vehicle(self, vehicle_id):
+        self.by_vehicle.pop(vehicle_id, None)
+
+class MemoryPostRepo(PostRepo):
+    def __init__(self, users: MemoryUserRepo, vehicles: MemoryVehicleRepo):
+        self.users = users
+        self.vehicles = vehicles
+        self.by_id = {}
+        self.timeline = []  # sorted (created_at, id)
+        self.by_user = {}  # user_id -> sorted (created_at, id)
+        self.catalog = {}  # partition key -> entry
+        self.archive = {}  # partition key -> {"by_id", "timeline", "by_user"} like the hot fields
+        self.locator = {}  # archived post id -> partition key
+        self.cold = []  # cold partition entries, newest first
+        self.boundary = None
+
+    def _hot(self, keys: list) -> list:
+        return keys[bisect.bisect_left(keys, (self.boundary,)):] if self.boundary else keys
+
+    async def get(self, post_id):
+        post = self.by_id.get(post_id)
+        if post is None and post_id in self.locator:
+            key = self.locator[post_id]
+            return dict(self.archive[key]["by_id"][post_id], archived=key)
+        return dict(post) if post else None
+
+    async def insert(self, post_doc):
+        self.by_id[post_doc["id"]] = dict(post_doc)
+        key = (post_doc["created_at"], post_doc["id"])
+        bisect.insort(self.timeline, key)
+        bisect.insort(self.by_user.setdefault(post_doc["user_id"], []), key)
+
+    def _feed_item(self, post):
+        vehicle = self.vehicles.by_id.get(post.get("vehicle_id"))
+        return {
+            "id": post["id"],
+            "user_id": post["user_id"],
+            "vehicle_id": post.get("vehicle_id"),
+            "caption": post["caption"],
+            "images": post["images"],
+            "likes_count": post["likes_count"],
+            "comments_count": post["comments_count"],
+            "tags": post.get("tags", []),
+            "mentions": post.get("mentions", []),
+            "created_at": post["created_at"],
+            "user": dict(post["author"]) if post.get("author") else None,
+            "vehicle": {
+                k: vehicle.get(k) for k in ("id", "make", "model", "year", "type", "color")
+            } if vehicle else None,
+        }
+
+    async def feed(self, after, limit):
+        async def hot(limit):
+            return [self._feed_item(self.by_id[post_id]) for post_id in _newest_before(self._hot(self.timeline), after, limit)]
+
+        async def cold(partition, limit):
+            archive = self.archive[partition["_id"]]
+            items = [self._feed_item(archive["by_id"][post_id]) for post_id in _newest_before(archive["timeline"], after, limit)]
+            return _mark_archived(items, partition["_id"])
+
+        items = await read_partitions_before(after, limit, hot, self.cold, cold)
+        return await fill_missing_authors(items, self.users)
+
+    async def feed_items(self, post_ids):
+        items = []
+        for post_id in post_ids:
+            if post_id in self.by_id:
+                items.append(self._feed_item(self.by_id[post_id]))
+            elif post_id in self.locator:
+                key = self.locator[post_id]
+                items.append(dict(self._feed_item(self.archive[key]["by_id"][post_id]), archived=key))
+        return await fill_missing_authors(items, self.users)
+
+    async def recent(self, limit, fields=None):
+        return [_project(self.by_id[post_id], fields) for post_id in _newest_first(self._hot(self.timeline), 0, limit)]
+
+    async def list_by_user(self, user_id, skip, limit):
+        async def hot(skip, limit):
+            keys = self._hot(self.by_user.get(user_id, []))
+            return [dict(self.by_id[post_id]) for post_id in _newest_first(keys, skip, limit)]
+
+        async def hot_count():
+            return len(self._hot(self.by_user.get(user_id, [])))
+
+        async def cold(partition, skip, limit):
+            archive = self.archive[partition["_id"]]
+            keys = archive["by_user"].get(user_id, [])
+            return _mark_archived([dict(archive["by_id"][post_id]) for post_id in _newest_first(keys, skip, limit)], partition["_id"])
+
+        async def cold_count(partition):
+            return len(self.archive[partition["_id"]]["by_user"].get(user_id, []))
+
+        return await read_across_partitions(skip, limit, hot, hot_count, self.cold, cold, cold_count)
+
+    async def increment(self, post_id, field, amount):
+        post = self.by_id.get(post_id)
+        if post:
+            post[field] = post.get(field, 0) + amount
+            return post[field]
+        return None
+
+    async def set_flag(self, post_id, flag, value):
+        post = self.by_id.get(post_id)
+        if post is None or post.get(flag, False) == value:
+            return False
+        post[flag] = value
+        return True
+
+    async def stale_author_post_ids(self, user_id, version, limit):
+        stale = []
+        for _, post_id in self.by_user.get(user_id, []):
+            author = self.by_id[post_id].get("author")
+            if not author or author["version"] < version:
+                stale.append(post_id)
+                if len(stale) == limit:
+                    break
+        return stale
+
+    async def set_author_snapshots(self, post_ids, snapshot):
+        for post_id in post_ids:
+            post = self.by_id.get(post_id)
+            if post and (not post.get("author") or post["author"]["version"] < snapshot["version"]):
+                post["author"] = dict(snapshot)
+
+    async def load_partitions(self):
+        self.cold = sorted((entry for entry in self.catalog.values() if entry["state"] == "cold"),
+                           key=lambda entry: entry["_id"], reverse=True)
+        self.boundary = max((entry["end"] for entry in self.cold), default=None)
+
+    async def archived_partition(self, post_id):
+        return self.locator.get(post_id)
+
+    async def oldest_hot(self):
+        return self.timeline[0][0] if self.timeline else None
+
+    async def claim_partition(self, key, owner, lease_seconds):
+        now = datetime.utcnow()
+        entry = self.catalog.get(key)
+        if entry is None:
+            start, end = partition_bounds(key)
+            entry = self.catalog[key] = {"_id": key, "state": "archiving", "start": start, "end": end}
+        elif entry["lease_until"] >= now and entry["owner"] != owner:
+            return None
+        entry.update(owner=owner, lease_until=now + timedelta(seconds=lease_seconds))
+        return dict(entry)
+
+    def _range(self, key: str) -> list:
+        start, end = partition_bounds(key)
+        return self.timeline[bisect.bisect_left(self.timeline, (start,)):bisect.bisect_left(self.timeline, (end,))]
+
+    async def copy_to_cold(self, key):
+        archive = self.archive.setdefault(key, {"by_id": {}, "timeline": [], "by_user": {}})
+        post_ids = []
+        for created_at, post_id in self._range(key):
+            if post_id not in archive["by_id"]:
+                post = archive["by_id"][post_id] = dict(self.by_id[post_id])
+                bisect.insort(archive["timeline"], (created_at, post_id))
+                bisect.insort(archive["by_user"].setdefault(post["user_id"], []), (created_at, post_id))
+            self.locator[post_id] = key
+            post_ids.append(post_id)
+        return post_ids
+
+    async def mark_cold(self, key, count):
+        self.catalog[key].update(state="cold", count=count, cold_at=datetime.utcnow())
+
+    async def hot_post_ids(self, key):
+        return [post_id for _, post_id in self._range(key)]
+
+    async def drop_hot(self, key):
+        for entry in self._range(key):
+            post = self.by_id.pop(entry[1])
+            keys = self.by_user[post["user_id"]]
+            del keys[bisect.bisect_left(keys, entry)]
+        start, end = partition_bounds(key)
+        del self.timeline[bisect.bisect_left(self.timeline, (start,)):bisect.bisect_left(self.timeline, (end,))]
+
+class MemoryLikeRepo(LikeRepo):
+    def __init__(self):
+        self.by_key = {}  # (post_id, user_id) -> like
+        self.by_user = {}  # user_id -> {post_id: None}, oldest like first
+        self.archive = {}  # partition key -> {(post_id, user_id): like}
+
+    async def get(self, post_id, user_id):
+        like = self.by_key.get((post_id, user_id))
+        return dict(like) if like else None
+
+    async def insert(self, like_doc):
+        self.by_key[(like_doc["post_id"], like_doc["user_id"])] = dict(like_doc)
+        self.by_user.setdefault(like_doc["user_id"], {})[like_doc["post_id"]] = None
+
+    async def delete(self, post_id, user_id):
+        self.by_user.get(user_id, {}).pop(post_id, None)
+        return self.by_key.pop((post_id, user_id), None) is not None
+
+    async def liked_post_ids(self, user_id, post_ids, archived=None):
+        liked = {post_id for post_id in post_ids if (post_id, user_id) in self.by_key}
+        for key, ids in (archived or {}).items():
+            cold = self.archive.get(key, {})
+            liked.update(post_id for post_id in ids if (post_id, user_id) in cold)
+        return liked
+
+    async def recent_post_ids(self, user_id, limit):
+        return list(reversed(self.by_user.get(user_id, {})))[:limit]
+
+    async def copy_to_cold(self, key, post_ids):
+        post_ids = set(post_ids)
+        cold = self.archive.setdefault(key, {})
+        cold.update({like_key: dict(like) for like_key, like in self.by_key.items() if like_key[0] in post_ids})
+
+    async def drop_hot(self, post_ids):
+        post_ids = set(post_ids)
+        for post_id, user_id in [like_key for like_key in self.by_key if like_key[0] in post_ids]:
+            del self.by_key[(post_id, user_id)]
+            self.by_user[user_id].pop(post_id, None)
+
+class MemoryTrendingRepo(TrendingRepo):
+    def __init__(self):
+        self.snapshot = None
+
+    async def load_snapshot(self):
+        return self.snapshot
+
+    async def save_snapshot(self, snapshot):
+        self.snapshot = snapshot
+
+class MemoryTagRepo(TagRepo):
+    def __init__(self):
+        self.timelines = {}  # tag -> sorted (created_at, post_id)
+        self.indexed = set()  # (tag, post_id)
+        self.counts = {}
+
+    async def add_post(self, post_id, tags, created_at):
+        added = [tag for tag in tags if (tag, post_id) not in self.indexed]
+        for tag in added:
+            self.indexed.add((tag, post_id))
+            bisect.insort(self.timelines.setdefault(tag, []), (created_at, post_id))
+        return added
+
+    async def post_ids(self, tag, before, limit):
+        timeline = self.timelines.get(tag, [])
+        end = bisect.bisect_left(timeline, before) if before else len(timeline)
+        return list(reversed(timeline[max(end - limit, 0):end]))
+
+    async def add_counts(self, deltas):
+        for tag, delta in deltas.items():
+            self.counts[tag] = self.counts.get(tag, 0) + delta
+
+    async def get_count(self, tag):
+        return self.counts.get(tag, 0)
+
+class MemoryNotificationRepo(NotificationRepo):
+    def __init__(self):
+        self.by_user = {}  # user_id -> notifications, oldest first
+        self.ids = set()
+
+    async def insert_many(self, notification_docs):
+        for notification in notification_docs:
+            if notification["id"] not in self.ids:
+                self.ids.add(notification["id"])
+                self.by_user.setdefault(notification["user_id"], []).append(dict(notification))
+
+    async def list_for_user(self, user_id, limit):
+        return [dict(notification) for notification in reversed(self.by_user.get(user_id, [])[-limit:])]
+
+class MemoryChangeLogRepo(ChangeLogRepo):
+    def __init__(self):
+        self.entries = []  # ascending seq
+        self.seq = 0
+
+    async def record(self, changes, owner_id):
+        now = datetime.utcnow()
+        for entity, entity_id, op in changes:
+            self.seq += 1
+            self.entries.append({
+                "seq": self.seq, "entity": entity, "entity_id": entity_id, "op": op, "owner_id": owner_id, "at": now,
+            })
+
+    async def since(self, seq, owner_id, global_entities, until, limit):
+        matches = []
+        for entry in self.entries[max(seq, 0):]:  # entry i has seq i + 1
+            if entry["at"] >= until:
+                break
+            if entry["owner_id"] == owner_id or entry["entity"] in global_entities:
+                matches.append(dict(entry))
+                if len(matches) == limit:
+                    break
+        return matches
+
+    async def settled_seq(self, until):
+        for entry in reversed(self.entries):
+            if entry["at"] < until:
+                return entry["seq"]
+        return 0
+
+    async def oldest_seq(self):
+        return self.entries[0]["seq"] if self.entries else None
+
+    async def latest_seq(self):
+        return self.seq
+
+class MemoryRevocationRepo(RevocationRepo):
+    def __init__(self):
+        self.entries = {}  # key -> {"_id", "expires_at", "revoked_at"}
+
+    async def add(self, key, expires_at):
+        self.entries[key] = {"_id": key, "expires_at": expires_at, "revoked_at": datetime.utcnow()}
+
+    async def since(self, revoked_after):
+        now = datetime.utcnow()
+        return sorted(
+            (dict(entry) for entry in self.entries.values()
+             if entry["expires_at"] > now and (revoked_after is None or entry["revoked_at"] > revoked_after)),
+            key=lambda entry: entry["revoked_at"],
+        )
+
+class MemoryIdempotencyRepo(IdempotencyRepo):
+    def __init__(self):
+        self.records = {}
+
+    async def claim(self, scope, fingerprint, resource_id, lock_seconds):
+        now = datetime.utcnow()
+        record = await self.get(scope)
+        if record is None:
+            self.records[scope] = {
+                "fingerprint": fingerprint, "status": "pending", "resource_id": resource_id,
+                "created_at": now, "locked_at": now,
+            }
+            return True, dict(self.records[scope])
+        if (record["fingerprint"] == fingerprint and record["status"] == "pending"
+                and record["locked_at"] < now - timedelta(seconds=lock_seconds)):
+            self.records[scope]["locked_at"] = now
+            return True, record
+        return False, record
+
+    async def renew(self, scope):
+        if self.records.get(scope, {}).get("status") == "pending":
+            self.records[scope]["locked_at"] = datetime.utcnow()
+
+    async def get(self, scope):
+        record = self.records.get(scope)
+        if record and record["created_at"] < datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS):
+            del self.records[scope]
+            return None
+        return dict(record) if record else None
+
+    async def complete(self, scope, result):
+        if scope in self.records:
+            self.records[scope].update(status="done", result=result)
+
+    async def release(self, scope):
+        if self.records.get(scope, {}).get("status") == "pending":
+            del self.records[scope]
+
+class MemoryJobRepo(JobRepo):
+    def __init__(self):
+        self.jobs = {}
+
+    async def insert_many(self, job_docs):
+        for job in job_docs:
+            self.jobs[job["_id"]] = dict(job)
+
+    async def release(self, job_ids):
+        now = datetime.utcnow()
+        for job_id in job_ids:
+            job = self.jobs.get(job_id)
+            if job and job["state"] == "held":
+                job.update(state="pending", due_at=now)
+
+    async def claim(self, job_type, owner, lease_seconds):
+        now = datetime.utcnow()
+        due = [job for job in self.jobs.values() if job["type"] == job_type and job.get("due_at") and job["due_at"] <= now]
+        if not due:
+            return None
+        job = min(due, key=lambda job: job["due_at"])
+        job.update(state="running", owner=owner, due_at=now + timedelta(seconds=lease_seconds), attempts=job["attempts"] + 1)
+        return dict(job)
+
+    def _finish(self, job, **fields):
+        stored = self.jobs.get(job["_id"])
+        if stored and stored["attempts"] == job["attempts"]:
+            stored.update(fields)
+            if fields.get("due_at") is None:
+                stored.pop("due_at", None)
+
+    async def complete(self, job):
+        self._finish(job, state="done", done_at=datetime.utcnow())
+
+    async def retry(self, job, run_at, error):
+        self._finish(job, state="pending", due_at=run_at, last_error=error)
+
+    async def dead_letter(self, job, error):
+        self._finish(job, state="dead", dead_at=datetime.utcnow(), last_error=error)
+
+class MemoryMigrationRepo(MigrationRepo):
+    def __init__(self):
+        self.entries = {}
+
+    async def claim(self, name, owner, lease_seconds):
+        now = datetime.utcnow()
+        entry = self.entries.setdefault(name, {"done": False, "owner": None, "lease_until": now})
+        if entry["done"] or (entry["lease_until"] >= now and entry["owner"] not in (None, owner)):
+            return False
+        entry.update(owner=owner, lease_until=now + timedelta(seconds=lease_seconds))
+        return True
+
+    async def finish(self, name):
+        self.entries[name] = {"done": True, "owner": None, "lease_until": datetime.utcnow()}
+
+def create_repositories() -> Repositories:
+    if DB_BACKEND == "memory":
+        users, vehicles = MemoryUserRepo(), MemoryVehicleRepo()
+        return Repositories(
+            users=users,
+            vehicles=vehicles,
+            vehicle_images=MemoryVehicleImageRepo(),
+            posts=MemoryPostRepo(users, vehicles),
+            likes=MemoryLikeRepo(),
+            trending=MemoryTrendingRepo(),
+            tags=MemoryTagRepo(),
+            notifications=MemoryNotificationRepo(),
+            changes=MemoryChangeLogRepo(),
+            idempotency=MemoryIdempotencyRepo(),
+            revocations=MemoryRevocationRepo(),
+            jobs=MemoryJobRepo(),
+            migrations=MemoryMigrationRepo(),
+        )
+    users = MotorUserRepo(db)
+    return Repositories(
+        users=users,
+        vehicles=MotorVehicleRepo(db),
+        vehicle_images=MotorVehicleImageRepo(db),
+        posts=MotorPostRepo(db, users),
+        likes=MotorLikeRepo(db),
+        trending=MotorTrendingRepo(db),
+        tags=MotorTagRepo(db),
+        notifications=MotorNotificationRepo(db),
+        changes=MotorChangeLogRepo(db),
+        idempotency=MotorIdempotencyRepo(db),
+        revocations=MotorRevocationRepo(db),
+        jobs=MotorJobRepo(db),
+        migrations=MotorMigrationRepo(db),
+    )
+
+repos = create_repositories()
+
+# ===== HELPER FUNCTIONS =====
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+def verify_password(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+def create_access_token(user_id: str, session_id: Optional[str] = None) -> str:
+    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_MINUTES)
+    payload = {"user_id": user_id, "sid": session_id or str(uuid.uuid4()), "typ": "access", "exp": expire}
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def create_refresh_token(user_id: str, session_id: str) -> str:
+    expire = datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS)
+    payload = {"user_id": user_id, "sid": session_id, "jti": str(uuid.uuid4()), "typ": "refresh", "exp": expire}
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def issue_tokens(user_id: str, session_id: Optional[str] = None) -> TokenPair:
+    # Each login starts a session; refreshing keeps its id so logout can revoke it whole
+    session_id = session_id or str(uuid.uuid4())
+    return TokenPair(
+        access_token=create_access_token(user_id, session_id),
+        refresh_token=create_refresh_token(user_id, session_id),
+        expires_in=ACCESS_TOKEN_MINUTES * 60,
+    )
+
+def decode_token(token: str, token_type: str) -> dict:
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # Tokens issued before refresh tokens existed carry no type and count as access tokens
+    if payload.get("user_id") is None or payload.get("typ", "access") != token_type:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+async def get_principal(credentials: HTTPAuthorizationCredentials = Depends(security)) -> "Principal":
+    return authenticate(credentials.credentials)
+
+async def get_current_user(principal: "Principal" = Depends(get_principal)) -> str:
+    return principal.user_id
+
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> Optional[str]:
+    if credentials is None:
+        return None
+    return authenticate(credentials.credentials).user_id
+
+BATCH_GET_MAX = int(os.environ.get('BATCH_GET_MAX', '100'))
+
+class BatchGetRequest(BaseModel):
+    ids: List[str]
+
+def batch_ids(batch: BatchGetRequest) -> List[str]:
+    if len(batch.ids) > BATCH_GET_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_GET_MAX} ids per batch")
+    return list(dict.fromkeys(batch.ids))
+
+def batch_response(requested: List[str], found: dict) -> dict:
+    # Items in request order, null where an id wasn't found, plus the misses listed
+    return {
+        "items": [found.get(item_id) for item_id in requested],
+        "missing": [item_id for item_id in dict.fromkeys(requested) if item_id not in found],
+    }
+
+def archived_ids(posts: List[dict]) -> dict:
+    # Cold partition key -> ids of the posts read from it, for liked_post_ids()
+    archived = {}
+    for post in posts:
+        if post.get("archived"):
+            archived.setdefault(post["archived"], []).append(post["id"])
+    return archived
+
+async def annotate_liked_by_me(posts: List[dict], viewer_id: Optional[str]) -> List[dict]:
+    liked = await repos.likes.liked_post_ids(
+        viewer_id, [post["id"] for post in posts], archived_ids(posts)
+    ) if viewer_id else set()
+    for post in posts:
+        post["liked_by_me"] = post["id"] in liked
+    return posts
+
+# ===== METRICS =====
+# Each collector returns (name, labels, value) samples; rendered in Prometheus text format.
+metrics_collectors = []
+
+def render_metrics() -> str:
+    lines = []
+    for collect in metrics_collectors:
+        for name, labels, value in collect():
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def _tracing_metrics():
+    return [
+        ("crewz_trace_spans_exported_total", {}, tracer.exporter.exported),
+        ("crewz_trace_spans_dropped_total", {}, tracer.exporter.dropped),
+        ("crewz_trace_queue_depth", {}, len(tracer.exporter.queue)),
+    ]
+
+metrics_collectors.append(_tracing_metrics)
+
+# ===== ADMISSION CONTROL =====
+# Expensive route classes get a concurrency cap, a bounded FIFO wait queue and a
+# deadline to start; anything that can't start in time is shed with a fast 503.
+def _admission_setting(route_class: str, setting: str, default):
+    return type(default)(os.environ.get(f'ADMISSION_{route_class.upper()}_{setting}', default))
+
+class AdmissionController:
+    def __init__(self, name: str, concurrency: int, max_queue: int, deadline: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.shed = 0
+
+    @classmethod
+    def from_env(cls, name: str, concurrency: int, max_queue: int, deadline: float):
+        return cls(
+            name,
+            _admission_setting(name, "CONCURRENCY", concurrency),
+            _admission_setting(name, "QUEUE", max_queue),
+            _admission_setting(name, "DEADLINE", deadline),
+        )
+
+    def _shed(self):
+        self.shed += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": str(max(1, math.ceil(self.deadline)))},
+        )
+
+    async def acquire(self):
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self.waiters) >= self.max_queue:
+            self._shed()
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            # release() hands its slot straight to the waiter, so `active` is already counted
+            await asyncio.wait_for(waiter, self.deadline)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self._shed()
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # the slot arrived just as the request was cancelled
+            else:
+                self._discard(waiter)
+            raise
+        self.admitted += 1
+
+    def _discard(self, waiter):
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+admission_controllers = {
+    # get_feed aggregations
+    "feed": AdmissionController.from_env("feed", concurrency=32, max_queue=64, deadline=1.0),
+    # base64 image payloads (posts, vehicle images)
+    "upload": AdmissionController.from_env("upload", concurrency=8, max_queue=16, deadline=2.0),
+    # bcrypt hashing/verification
+    "auth": AdmissionController.from_env("auth", concurrency=4, max_queue=32, deadline=2.0),
+}
+
+def admission(route_class: str):
+    controller = admission_controllers[route_class]
+
+    async def admit():
+        await controller.acquire()
+        try:
+            yield
+        finally:
+            controller.release()
+    return admit
+
+class TokenBucketLimiter:
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int = 100000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, last refill), least recently used first
+        self.limited = 0
+
+    def hit(self, key: str):
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            self.limited += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts, please slow down",
+                headers={"Retry-After": str(max(1, math.ceil((1 - tokens) / self.rate)))},
+            )
+        self.buckets[key] = (tokens - 1, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+
+auth_rate_limiter = TokenBucketLimiter(
+    rate_per_minute=float(os.environ.get('AUTH_RATE_PER_MINUTE', '10')),
+    burst=int(os.environ.get('AUTH_RATE_BURST', '5')),
+)
+
+def auth_rate_limit(action: str):
+    # Runs ahead of admission("auth"), so throttled attempts never take a bcrypt slot
+    async def check(request: Request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return  # malformed; the route's own validation rejects it
+        email = body.get("email") if isinstance(body, dict) else None
+        if isinstance(email, str):
+            auth_rate_limiter.hit(f"{action}:{email.lower()}")
+    return check
+
+def _admission_metrics():
+    samples = []
+    for name, controller in admission_controllers.items():
+        labels = {"route_class": name}
+        samples += [
+            ("crewz_admission_active", labels, controller.active),
+            ("crewz_admission_queue_depth", labels, len(controller.waiters)),
+            ("crewz_admission_admitted_total", labels, controller.admitted),
+            ("crewz_admission_shed_total", labels, controller.shed),
+        ]
+    samples.append(("crewz_auth_rate_limited_total", {}, auth_rate_limiter.limited))
+    return samples
+
+metrics_collectors.append(_admission_metrics)
+
+# ===== AUTH TOKENS =====
+# Access tokens are short-lived and verified once per process: the digest of each
+# verified token is kept in an LRU with its claims until it expires, so repeat requests
+# skip the HMAC check and JSON decode. Revocation (logout, refresh-token reuse) is by
+# session id and checked against an in-memory denylist. Revocations are persisted in
+# revoked_tokens and polled from there, so every worker learns of them within
+# DENYLIST_POLL_SECONDS.
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+DENYLIST_POLL_SECONDS = float(os.environ.get('DENYLIST_POLL_SECONDS', '5'))
+
+class Principal:
+    # The authenticated caller, resolved once per request
+    __slots__ = ("user_id", "session_id", "expires_at", "_profile")
+
+    def __init__(self, user_id: str, session_id: Optional[str], expires_at: float):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.expires_at = expires_at
+        self._profile = None
+
+    async def profile(self) -> "User":
+        # Public user fields, through the coalesced/cached get_user read
+        if self._profile is None:
+            self._profile = await get_user(user_id=self.user_id)
+        return self._profile
+
+class VerifiedTokenCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # sha256(token) -> Principal claims tuple
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, token: str) -> tuple:
+        digest = hashlib.sha256(token.encode()).digest()
+        claims = self.entries.get(digest)
+        if claims and claims[2] > time.time():
+            self.hits += 1
+            self.entries.move_to_end(digest)
+            return claims
+        self.misses += 1
+        payload = decode_token(token, "access")
+        claims = (payload["user_id"], payload.get("sid"), float(payload["exp"]))
+        self.entries[digest] = claims
+        self.entries.move_to_end(digest)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return claims
+
+class TokenDenylist(BackgroundLoop):
+    def __init__(self):
+        super().__init__(DENYLIST_POLL_SECONDS, "Token denylist sync failed")
+        self.revoked = {}  # session or token id -> expiry (epoch seconds)
+        self.synced_at = None  # revoked_at of the newest entry loaded from the repo
+
+    def __contains__(self, key) -> bool:
+        return key is not None and self.revoked.get(key, 0) > time.time()
+
+    async def revoke(self, key: str, expires_at: datetime):
+        self.revoked[key] = expires_at.replace(tzinfo=timezone.utc).timestamp()
+        await repos.revocations.add(key, expires_at)
+
+    async def sync(self):
+        for entry in await repos.revocations.since(self.synced_at):
+            self.revoked[entry["_id"]] = entry["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+            self.synced_at = entry["revoked_at"]
+        now = time.time()
+        for key in [key for key, expires_at in self.revoked.items() if expires_at <= now]:
+            del self.revoked[key]
+
+    async def tick(self):
+        await self.sync()
+
+verified_tokens = VerifiedTokenCache(TOKEN_CACHE_SIZE)
+token_denylist = TokenDenylist()
+
+def authenticate(token: str) -> Principal:
+    user_id, session_id, expires_at = verified_tokens.verify(token)
+    if session_id in token_denylist:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return Principal(user_id, session_id, expires_at)
+
+def _auth_metrics():
+    return [
+        ("crewz_token_cache_hits_total", {}, verified_tokens.hits),
+        ("crewz_token_cache_misses_total", {}, verified_tokens.misses),
+        ("crewz_token_denylist_size", {}, len(token_denylist.revoked)),
+    ]
+
+metrics_collectors.append(_auth_metrics)
+
+# ===== TRENDING =====
+# Time-decayed engagement score per post, maintained incrementally from post/like/comment
+# events. Scores are kept "boosted" relative to a fixed epoch, i.e. each event adds
+# weight * 2^((t - epoch) / half_life), so ordering by the stored value equals ordering by
+# the decayed score at any instant and nothing needs re-decaying between events.
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', '6'))
+TRENDING_TOP_K = int(os.environ.get('TRENDING_TOP_K', '100'))
+TRENDING_MAX_POSTS = int(os.environ.get('TRENDING_MAX_POSTS', '10000'))
+TRENDING_REFRESH_SECONDS = float(os.environ.get('TRENDING_REFRESH_SECONDS', '15'))
+TRENDING_SNAPSHOT_SECONDS = float(os.environ.get('TRENDING_SNAPSHOT_SECONDS', '300'))
+TRENDING_SEED_POSTS = int(os.environ.get('TRENDING_SEED_POSTS', '1000'))
+TRENDING_WEIGHTS = {"post": 1.0, "like": 1.0, "comment": 2.0}
+
+class TrendingView(BackgroundLoop):
+    def __init__(self, half_life_hours: float):
+        super().__init__(TRENDING_REFRESH_SECONDS, "Trending refresh failed")
+        self.half_life = half_life_hours * 3600
+        self.epoch = time.time()
+        self.scores = {}  # post_id -> boosted score
+        self.top = []  # materialized top-K feed items, best first
+        self.dirty = False
+        self.snapshot_at = time.monotonic()
+
+    def _boost(self, at: float) -> float:
+        return 2 ** ((at - self.epoch) / self.half_life)
+
+    def _rebase(self, now: float):
+        # Keep the exponent small so boosted scores never overflow
+        if (now - self.epoch) / self.half_life > 64:
+            factor = self._boost(now)
+            self.scores = {post_id: score / factor for post_id, score in self.scores.items()}
+            self.epoch = now
+
+    def record(self, post_id: str, event: str, at: Optional[datetime] = None, count: int = 1):
+        when = at.replace(tzinfo=timezone.utc).timestamp() if at else time.time()
+        self._rebase(time.time())
+        score = self.scores.get(post_id, 0.0) + count * TRENDING_WEIGHTS[event] * self._boost(when)
+        self.scores[post_id] = max(score, 0.0)
+        self.dirty = True
+
+    def current_score(self, post_id: str) -> float:
+        return self.scores.get(post_id, 0.0) / self._boost(time.time())
+
+    async def refresh(self):
+        self.dirty = False
+        if len(self.scores) > TRENDING_MAX_POSTS:
+            self.scores = dict(heapq.nlargest(TRENDING_MAX_POSTS, self.scores.items(), key=lambda item: item[1]))
+        top_ids = [post_id for post_id, _ in heapq.nlargest(TRENDING_TOP_K, self.scores.items(), key=lambda item: item[1])]
+        self.top = await repos.posts.feed_items(top_ids)
+
+    async def load(self):
+        snapshot = await repos.trending.load_snapshot()
+        if snapshot:
+            self.epoch = snapshot["epoch"]
+            self.scores = dict(snapshot["scores"])
+        else:
+            # Cold start: seed once from recent posts' counters instead of scanning likes
+            for post in await repos.posts.recent(TRENDING_SEED_POSTS):
+                self.record(post["id"], "post", post["created_at"])
+                for event, count in (("like", post.get("likes_count", 0)), ("comment", post.get("comments_count", 0))):
+                    if count > 0:
+                        self.record(post["id"], event, post["created_at"], count=count)
+        await self.refresh()
+
+    async def snapshot(self):
+        await repos.trending.save_snapshot({
+            "epoch": self.epoch,
+            "scores": list(self.scores.items()),
+            "saved_at": datetime.utcnow(),
+        })
+        self.snapshot_at = time.monotonic()
+
+    async def tick(self):
+        if self.dirty:
+            await self.refresh()
+        if time.monotonic() - self.snapshot_at >= TRENDING_SNAPSHOT_SECONDS:
+            await self.snapshot()
+
+    async def on_stop(self):
+        await self.snapshot()
+
+trending = TrendingView(TRENDING_HALF_LIFE_HOURS)
+
+# ===== FEED RANKING =====
+# Personalized "for you" ordering over a candidate pool (recent posts + trending top-K).
+# The pool is kept as column arrays so every request scores all candidates in one
+# vectorized pass; per-viewer affinity is cached between requests.
+RANK_POOL_SIZE = int(os.environ.get('RANK_POOL_SIZE', '5000'))
+RANK_POOL_REFRESH_SECONDS = float(os.environ.get('RANK_POOL_REFRESH_SECONDS', '30'))
+RANK_AFFINITY_TTL_SECONDS = float(os.environ.get('RANK_AFFINITY_TTL_SECONDS', '300'))
+RANK_AFFINITY_MAX_USERS = int(os.environ.get('RANK_AFFINITY_MAX_USERS', '10000'))
+RANK_AFFINITY_LIKES = 500  # recent likes considered per viewer
+RANK_RECENCY_HOURS = 24.0
+RANK_WEIGHTS = {"recency": 1.0, "affinity": 1.5, "vehicle_type": 0.5, "engagement": 0.3}
+RANK_POOL_FIELDS = ["id", "user_id", "vehicle_id", "created_at", "likes_count", "comments_count"]
+
+class CandidatePool:
+    def __init__(self, posts: List[dict], vehicle_types: dict):
+        self.post_ids = [post["id"] for post in posts]
+        self.author_codes = {}
+        self.type_codes = {None: 0}
+        n = len(posts)
+        self.created = np.empty(n, dtype=np.float64)
+        self.authors = np.empty(n, dtype=np.int32)
+        self.types = np.empty(n, dtype=np.int16)
+        self.engagement = np.empty(n, dtype=np.float32)
+        for i, post in enumerate(posts):
+            self.created[i] = post["created_at"].replace(tzinfo=timezone.utc).timestamp()
+            self.authors[i] = self.author_codes.setdefault(post["user_id"], len(self.author_codes))
+            vehicle_type = vehicle_types.get(post.get("vehicle_id"))
+            self.types[i] = self.type_codes.setdefault(vehicle_type, len(self.type_codes))
+            self.engagement[i] = post.get("likes_count", 0) + 2 * post.get("comments_count", 0)
+        np.log1p(self.engagement, out=self.engagement)
+        self.author_of = {post["id"]: post["user_id"] for post in posts}
+        self.built_at = time.monotonic()
+
+class FeedRanker:
+    def __init__(self):
+        self.pool = None
+        self.affinity = OrderedDict()  # user_id -> (expires, {author_id: weight}, {vehicle types})
+        self._lock = asyncio.Lock()
+
+    async def get_pool(self) -> CandidatePool:
+        pool = self.pool
+        if pool is None or time.monotonic() - pool.built_at > RANK_POOL_REFRESH_SECONDS:
+            async with self._lock:
+                if self.pool is pool:
+                    # Shared by every viewer, so not read under the triggering user's session
+                    async with shared_read():
+                        self.pool = await self._build_pool()
+        return self.pool
+
+    async def _build_pool(self) -> CandidatePool:
+        posts = await repos.posts.recent(RANK_POOL_SIZE, RANK_POOL_FIELDS)
+        seen = {post["id"] for post in posts}
+        for item in trending.top:
+            if item["id"] not in seen:
+                posts.append({field: item.get(field) for field in RANK_POOL_FIELDS})
+        vehicle_ids = list({post["vehicle_id"] for post in posts if post.get("vehicle_id")})
+        vehicles = await repos.vehicles.get_many(vehicle_ids, ["id", "type"])
+        return CandidatePool(posts, {vehicle["id"]: vehicle.get("type") for vehicle in vehicles})
+
+    async def viewer_profile(self, user_id: str, pool: CandidatePool):
+        cached = self.affinity.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            self.affinity.move_to_end(user_id)
+            return cached[1], cached[2]
+        # One after the other: both run in the request's causal session, which doesn't
+        # support concurrent operations
+        liked = await repos.likes.recent_post_ids(user_id, RANK_AFFINITY_LIKES)
+        vehicles = await repos.vehicles.list_by_user(user_id, 100, ["type"])
+        authors = {}
+        for post_id in liked:
+            author = pool.author_of.get(post_id)
+            if author and author != user_id:
+                authors[author] = authors.get(author, 0) + 1
+        top = max(authors.values(), default=1)
+        affinity = {author: count / top for author, count in authors.items()}
+        vehicle_types = {vehicle.get("type") for vehicle in vehicles}
+        self.affinity[user_id] = (time.monotonic() + RANK_AFFINITY_TTL_SECONDS, affinity, vehicle_types)
+        if len(self.affinity) > RANK_AFFINITY_MAX_USERS:
+            self.affinity.popitem(last=False)
+        return affinity, vehicle_types
+
+    def invalidate_viewer(self, user_id: str):
+        self.affinity.pop(user_id, None)
+
+    def score(self, pool: CandidatePool, affinity: dict, vehicle_types: set, now: float) -> np.ndarray:
+        author_weights = np.zeros(len(pool.author_codes), dtype=np.float32)
+        for author, weight in affinity.items():
+            code = pool.author_codes.get(author)
+            if code is not None:
+                author_weights[code] = weight
+        type_match = np.zeros(len(pool.type_codes), dtype=np.float32)
+        for vehicle_type in vehicle_types:
+            code = pool.type_codes.get(vehicle_type)
+            if code:
+                type_match[code] = 1.0
+        recency = np.exp((pool.created - now) / (RANK_RECENCY_HOURS * 3600))
+        return (
+            RANK_WEIGHTS["recency"] * recency
+            + RANK_WEIGHTS["affinity"] * author_weights[pool.authors]
+            + RANK_WEIGHTS["vehicle_type"] * type_match[pool.types]
+            + RANK_WEIGHTS["engagement"] * pool.engagement
+        )
+
+    async def rank(self, user_id: str, skip: int, limit: int) -> List[str]:
+        pool = await self.get_pool()
+        n = len(pool.post_ids)
+        end = min(skip + limit, n)
+        if skip >= end:
+            return []
+        affinity, vehicle_types = await self.viewer_profile(user_id, pool)
+        scores = self.score(pool, affinity, vehicle_types, time.time())
+        top = np.argpartition(-scores, end - 1)[:end] if end < n else np.arange(n)
+        ordered = top[np.argsort(-scores[top], kind="stable")]
+        return [pool.post_ids[i] for i in ordered[skip:end]]
+
+feed_ranker = FeedRanker()
+
+# ===== SIMILAR VEHICLES =====
+# Every vehicle is an L2-normalised vector: the year as a point on a quarter circle (so
+# the dot product falls off with the age gap), hashed `modifications` tokens, then one-hot
+# make and type from a vocabulary that grows as new values appear. The one-hot part is
+# stored as an int32 code per row rather than as columns, so the matrix keeps a fixed
+# width; its contribution to the dot product is the row scales of the pairs whose codes
+# match. Cosine top-k is a single mat-vec plus two code comparisons.
+SIMILAR_TOKEN_DIMS = 34
+SIMILAR_YEAR_RANGE = (1900, 2030)
+SIMILAR_FIELDS = ["id", "make", "type", "year", "modifications"]
+VEHICLE_SUMMARY_FIELDS = ["id", "user_id", "make", "model", "year", "type", "color"]
+
+def _bucket(value: str, dims: int) -> int:
+    # Stable across processes, unlike hash()
+    return zlib.crc32(value.encode("utf-8")) % dims
+
+class VehicleFeatureIndex:
+    dims = 2 + SIMILAR_TOKEN_DIMS
+
+    def __init__(self, capacity: int = 1024):
+        self.matrix = np.zeros((capacity, self.dims), dtype=np.float32)
+        self.makes = np.full(capacity, -1, dtype=np.int32)
+        self.types = np.full(capacity, -1, dtype=np.int32)
+        self.scales = np.zeros(capacity, dtype=np.float32)  # each one-hot entry's normalised value
+        self.active = np.zeros(capacity, dtype=bool)
+        self.ids = []
+        self.row_of = {}
+        self.dead = 0
+        self.category_codes = {}  # ("make" | "type", normalised value) -> code
+
+    def _category(self, kind: str, value: Optional[str]) -> int:
+        key = (kind, (value or "").strip().lower())
+        code = self.category_codes.get(key)
+        if code is None:
+            code = self.category_codes[key] = len(self.category_codes)
+        return code
+
+    def _features(self, vehicle: dict) -> tuple:
+        row = np.zeros(self.dims, dtype=np.float32)
+        low, high = SIMILAR_YEAR_RANGE
+        angle = min(max((vehicle.get("year", low) - low) / (high - low), 0.0), 1.0) * (math.pi / 2)
+        row[0], row[1] = math.cos(angle), math.sin(angle)
+        tokens = re.findall(r"[a-z0-9]+", (vehicle.get("modifications") or "").lower())
+        for token in tokens:
+            row[2 + _bucket(token, SIMILAR_TOKEN_DIMS)] += 1.0 / math.sqrt(len(tokens))
+        norm = math.sqrt(float(row @ row) + 2.0)  # plus the make and type entries, 1.0 each
+        return row / norm, 1.0 / norm
+
+    def upsert(self, vehicle: dict):
+        row = self.row_of.get(vehicle["id"])
+        if row is None:
+            row = len(self.ids)
+            if row == len(self.matrix):
+                self._resize(2 * len(self.matrix))
+            self.ids.append(vehicle["id"])
+            self.row_of[vehicle["id"]] = row
+        self.matrix[row], self.scales[row] = self._features(vehicle)
+        self.makes[row] = self._category("make", vehicle.get("make"))
+        self.types[row] = self._category("type", vehicle.get("type"))
+        self.active[row] = True
+
+    def remove(self, vehicle_id: str):
+        row = self.row_of.pop(vehicle_id, None)
+        if row is None:
+            return
+        self.matrix[row] = 0.0
+        self.scales[row] = 0.0
+        self.makes[row] = self.types[row] = -1
+        self.active[row] = False
+        self.ids[row] = None
+        self.dead += 1
+        if self.dead > 1024 and self.dead > len(self.ids) // 4:
+            self.compact()
+
+    def compact(self):
+        live = np.flatnonzero(self.active[:len(self.ids)])
+        columns = (self.matrix[live], self.makes[live], self.types[live], self.scales[live])
+        self._allocate(max(1024, 2 * len(live)))
+        self.matrix[:len(live)], self.makes[:len(live)], self.types[:len(live)], self.scales[:len(live)] = columns
+        self.active[:len(live)] = True
+        self.ids = [self.ids[i] for i in live]
+        self.row_of = {vehicle_id: row for row, vehicle_id in enumerate(self.ids)}
+        self.dead = 0
+
+    def _allocate(self, capacity: int):
+        self.matrix = np.zeros((capacity, self.dims), dtype=np.float32)
+        self.makes = np.full(capacity, -1, dtype=np.int32)
+        self.types = np.full(capacity, -1, dtype=np.int32)
+        self.scales = np.zeros(capacity, dtype=np.float32)
+        self.active = np.zeros(capacity, dtype=bool)
+
+    def _resize(self, capacity: int):
+        n = len(self.matrix)
+        columns = (self.matrix, self.makes, self.types, self.scales, self.active)
+        self._allocate(capacity)
+        self.matrix[:n], self.makes[:n], self.types[:n], self.scales[:n], self.active[:n] = columns
+
+    def similar(self, vehicle_id: str, k: int) -> Optional[List[tuple]]:
+        row = self.row_of.get(vehicle_id)
+        if row is None:
+            return None
+        n = len(self.ids)
+        scores = self.matrix[:n] @ self.matrix[row]
+        shared = (self.makes[:n] == self.makes[row]).astype(np.float32)
+        shared += self.types[:n] == self.types[row]
+        scores += shared * (self.scales[:n] * self.scales[row])
+        scores[~self.active[:n]] = -np.inf
+        scores[row] = -np.inf
+        k = min(k, n - 1 - self.dead)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    async def build(self):
+        async for vehicle in repos.vehicles.iter_all(SIMILAR_FIELDS):
+            self.upsert(vehicle)
+
+similar_vehicles = VehicleFeatureIndex()
+
+# ===== MAKE/MODEL AUTOCOMPLETE =====
+# Prefix index over a single sorted array of (normalised key, entry id) pairs instead of
+# trie nodes: a lookup is a bisect plus a short scan. Each make is keyed by its name and
+# each model by both "model" and "make model". Entries carry live vehicle counts.
+AUTOCOMPLETE_SCAN_LIMIT = 2000
+
+class MakeModelIndex:
+    def __init__(self):
+        self.keys = []  # sorted (key, entry_id)
+        self.entries = {}  # entry_id -> [kind, make, model, count]
+        self.entry_ids = {}  # (kind, make key, model key) -> entry_id
+        self._next_id = 0
+
+    @staticmethod
+    def _normalize(value: Optional[str]) -> str:
+        return " ".join((value or "").lower().split())
+
+    def add(self, make: Optional[str], model: Optional[str], delta: int):
+        make_key, model_key = self._normalize(make), self._normalize(model)
+        if not make_key:
+            return
+        self._bump(("make", make_key, ""), [make_key], make, None, delta)
+        if model_key:
+            self._bump(("model", make_key, model_key), [model_key, f"{make_key} {model_key}"], make, model, delta)
+
+    def _bump(self, identity: tuple, keys: List[str], make, model, delta: int):
+        entry_id = self.entry_ids.get(identity)
+        if entry_id is None:
+            if delta <= 0:
+                return
+            entry_id = self.entry_ids[identity] = self._next_id
+            self._next_id += 1
+            self.entries[entry_id] = [identity[0], make.strip(), model.strip() if model else None, 0]
+            for key in keys:
+                bisect.insort(self.keys, (key, entry_id))
+        entry = self.entries[entry_id]
+        entry[3] += delta
+        if entry[3] <= 0:
+            del self.entries[entry_id], self.entry_ids[identity]
+            for key in keys:
+                index = bisect.bisect_left(self.keys, (key, entry_id))
+                if index < len(self.keys) and self.keys[index] == (key, entry_id):
+                    del self.keys[index]
+
+    def suggest(self, prefix: str, limit: int) -> List[dict]:
+        prefix = self._normalize(prefix)
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self.keys, (prefix, -1))
+        matches = {}
+        for key, entry_id in self.keys[start:start + AUTOCOMPLETE_SCAN_LIMIT]:
+            if not key.startswith(prefix):
+                break
+            matches[entry_id] = self.entries[entry_id]
+        best = heapq.nlargest(limit, matches.values(), key=lambda entry: (entry[3], entry[0] == "make"))
+        return [
+            {"kind": kind, "make": make, "model": model, "count": count}
+            for kind, make, model, count in best
+        ]
+
+    async def build(self):
+        async for group in repos.vehicles.make_model_counts():
+            self.add(group["make"], group["model"], group["count"])
+
+make_model_index = MakeModelIndex()
+
+# ===== HASHTAGS & MENTIONS =====
+HASHTAG_PATTERN = re.compile(r"(?<![\w#])#(\w{1,64})")
+MENTION_PATTERN = re.compile(r"(?<![\w@])@([A-Za-z0-9_.]{1,30})")
+TAG_COUNT_FLUSH_SECONDS = float(os.environ.get('TAG_COUNT_FLUSH_SECONDS', '5'))
+MAX_TAGS_PER_POST = 30
+MAX_MENTIONS_PER_POST = 20
+
+def extract_tags(caption: str) -> List[str]:
+    return list(dict.fromkeys(tag.lower() for tag in HASHTAG_PATTERN.findall(caption or "")))[:MAX_TAGS_PER_POST]
+
+def extract_mentions(caption: str) -> List[str]:
+    mentions = (mention.rstrip(".") for mention in MENTION_PATTERN.findall(caption or ""))
+    return list(dict.fromkeys(mention for mention in mentions if mention))[:MAX_MENTIONS_PER_POST]
+
+def encode_cursor(created_at: datetime, item_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{item_id}".encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, item_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(created_at), item_id
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+class TagCountBuffer(BackgroundLoop):
+    # Per-tag post counts are accumulated in memory and flushed as one bulk $inc,
+    # so hot tags don't turn every create_post into a write on the same document.
+    def __init__(self):
+        super().__init__(TAG_COUNT_FLUSH_SECONDS, "Tag count flush failed")
+        self.pending = {}
+
+    def add(self, tags: List[str], delta: int = 1):
+        for tag in tags:
+            self.pending[tag] = self.pending.get(tag, 0) + delta
+
+    async def count(self, tag: str) -> int:
+        return await repos.tags.get_count(tag) + self.pending.get(tag, 0)
+
+    async def flush(self):
+        deltas, self.pending = self.pending, {}
+        try:
+            await repos.tags.add_counts(deltas)
+        except Exception:
+            for tag, delta in deltas.items():
+                self.pending[tag] = self.pending.get(tag, 0) + delta
+            raise
+
+    async def tick(self):
+        await self.flush()
+
+    async def on_stop(self):
+        await self.flush()
+
+tag_counts = TagCountBuffer()
+
+async def notify_mentions(post: Post):
+    if not post.mentions:
+        return
+    users = await repos.users.get_by_usernames(post.mentions, ["id"])
+    # Ids are derived from the mention, so a retried job can't notify anyone twice
+    await repos.notifications.insert_many([
+        Notification(
+            id=f"mention:{post.id}:{user['id']}", user_id=user["id"], type="mention", actor_id=post.user_id, post_id=post.id
+        ).dict()
+        for user in users if user["id"] != post.user_id
+    ])
+
+# ===== AUTHOR SNAPSHOT PROPAGATION =====
+# Profile edits rewrite the embedded author snapshot across the user's posts in the
+# background, in small throttled bulk_write batches. Repeated edits by the same user
+# coalesce into a single pass carrying the newest snapshot.
+AUTHOR_PROPAGATION_BATCH = int(os.environ.get('AUTHOR_PROPAGATION_BATCH', '500'))
+AUTHOR_PROPAGATION_PAUSE_SECONDS = float(os.environ.get('AUTHOR_PROPAGATION_PAUSE_SECONDS', '0.05'))
+
+class AuthorSnapshotPropagator(BackgroundLoop):
+    def __init__(self):
+        super().__init__(0, "Author snapshot propagation failed")
+        self.pending = OrderedDict()  # user_id -> newest snapshot
+        self._wakeup = asyncio.Event()
+
+    def enqueue(self, snapshot: dict):
+        self.pending[snapshot["id"]] = snapshot
+        self.pending.move_to_end(snapshot["id"])
+        self._wakeup.set()
+
+    async def propagate(self, snapshot: dict):
+        while True:
+            post_ids = await repos.posts.stale_author_post_ids(snapshot["id"], snapshot["version"], AUTHOR_PROPAGATION_BATCH)
+            if not post_ids:
+                return
+            await repos.posts.set_author_snapshots(post_ids, snapshot)
+            for post_id in post_ids:
+                invalidation_bus.publish("posts", "update", post_id, doc={"id": post_id, "author": snapshot})
+            await asyncio.sleep(AUTHOR_PROPAGATION_PAUSE_SECONDS)
+
+    async def drain(self):
+        while self.pending:
+            _, snapshot = self.pending.popitem(last=False)
+            try:
+                await self.propagate(snapshot)
+            except Exception as e:
+                logger.warning(f"Author snapshot propagation failed for {snapshot['id']}: {e}")
+
+    async def wait(self):
+        # Runs when something is enqueued rather than on an interval
+        await self._wakeup.wait()
+        self._wakeup.clear()
+
+    async def tick(self):
+        await self.drain()
+
+    async def on_stop(self):
+        await self.drain()
+
+author_propagator = AuthorSnapshotPropagator()
+
+# ===== POST ARCHIVE =====
+# Moves partitions older than the hot window (see post_partition()) to cold storage, one
+# stage at a time: copy posts and likes, mark the partition cold, and only after a grace
+# period, by which every worker has reloaded the catalog and reads the cold copy, drop
+# the hot one. Each stage is idempotent, and a per-partition lease keeps workers from
+# archiving the same partition at once. Archived posts are read-only: likes are refused
+# and author snapshot propagation leaves them as they were.
+POST_ARCHIVER = os.environ.get('POST_ARCHIVER', 'on')  # "off": this worker only reloads the catalog
+POST_ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('POST_ARCHIVE_INTERVAL_SECONDS', '3600'))
+POST_PARTITION_REFRESH_SECONDS = float(os.environ.get('POST_PARTITION_REFRESH_SECONDS', '60'))
+POST_ARCHIVE_GRACE_SECONDS = float(os.environ.get('POST_ARCHIVE_GRACE_SECONDS', '300'))  # > the refresh interval
+POST_ARCHIVE_LEASE_SECONDS = float(os.environ.get('POST_ARCHIVE_LEASE_SECONDS', '900'))
+
+class PostArchiver(BackgroundLoop):
+    def __init__(self):
+        super().__init__(POST_PARTITION_REFRESH_SECONDS, "Post archiving failed")
+        self.archived = 0
+        self.dropped = 0
+        self.ran_at = None
+
+    async def step(self) -> bool:
+        # Advances the oldest partition outside the hot window by one stage; False when
+        # there is nothing to do yet
+        oldest = await repos.posts.oldest_hot()
+        if oldest is None or oldest >= hot_floor(datetime.utcnow()):
+            return False
+        key = post_partition(oldest)
+        entry = await repos.posts.claim_partition(key, WORKER_ID, POST_ARCHIVE_LEASE_SECONDS)
+        if entry is None:
+            return False
+        if entry["state"] != "cold":
+            post_ids = await repos.posts.copy_to_cold(key)
+            await repos.likes.copy_to_cold(key, post_ids)
+            await repos.posts.mark_cold(key, len(post_ids))
+            await repos.posts.load_partitions()
+            self.archived += 1
+            logger.info(f"Archived post partition {key} ({len(post_ids)} posts)")
+            return True
+        if entry["cold_at"] > datetime.utcnow() - timedelta(seconds=POST_ARCHIVE_GRACE_SECONDS):
+            return False
+        post_ids = await repos.posts.hot_post_ids(key)
+        await repos.likes.drop_hot(post_ids)
+        await repos.posts.drop_hot(key)
+        self.dropped += 1
+        return True
+
+    async def run_once(self):
+        self.ran_at = time.monotonic()
+        while await self.step():
+            pass
+
+    async def tick(self):
+        await repos.posts.load_partitions()
+        if POST_ARCHIVER != "off" and (self.ran_at is None or time.monotonic() - self.ran_at >= POST_ARCHIVE_INTERVAL_SECONDS):
+            await self.run_once()
+
+post_archiver = PostArchiver()
+
+def _archive_metrics():
+    return [
+        ("crewz_post_partitions_cold", {}, len(repos.posts.cold)),
+        ("crewz_post_partitions_archived_total", {}, post_archiver.archived),
+        ("crewz_post_partitions_dropped_total", {}, post_archiver.dropped),
+    ]
+
+metrics_collectors.append(_archive_metrics)
+
+# ===== BACKGROUND JOBS =====
+# Side effects of a write run as jobs from a durable queue (the jobs collection) rather
+# than on the request path. They are written held before the primary write and released
+# right after it, so a crash in between leaves them queued: held jobs fall due by
+# themselves after JOB_HOLD_SECONDS, and handlers skip work whose write never landed.
+# Claims are leases, so a worker dying mid-job only delays it. Each type runs with its
+# own concurrency (JOB_CONCURRENCY, e.g. "post.mentions=8"); failures retry with
+# exponential backoff and jitter, and jobs out of attempts are dead-lettered (state
+# "dead", with last_error). Delivery is at-least-once, so handlers are idempotent: a
+# retry after a partial failure skips the effects that already landed.
+JOB_HOLD_SECONDS = float(os.environ.get('JOB_HOLD_SECONDS', '30'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '5'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '8'))
+JOB_BACKOFF_SECONDS = float(os.environ.get('JOB_BACKOFF_SECONDS', '1'))
+JOB_BACKOFF_MAX_SECONDS = float(os.environ.get('JOB_BACKOFF_MAX_SECONDS', '600'))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', str(24 * 3600)))  # finished jobs
+JOB_CONCURRENCY = {
+    job_type.strip(): int(count)
+    for job_type, _, count in (item.partition("=") for item in os.environ.get('JOB_CONCURRENCY', '').split(",") if item.strip())
+}
+
+class JobRunner:
+    def __init__(self):
+        self.handlers = {}  # job type -> (handler, concurrency)
+        self.wakeups = {}
+        self.completed = {}
+        self.retried = {}
+        self.dead = {}
+        self._tasks = []
+
+    def handler(self, job_type: str, concurrency: int = 2):
+        def register(fn):
+            self.handlers[job_type] = (fn, JOB_CONCURRENCY.get(job_type, concurrency))
+            self.wakeups[job_type] = asyncio.Event()
+            return fn
+        return register
+
+    @asynccontextmanager
+    async def outbox(self, jobs: List[tuple]):
+        # Queues (type, payload) jobs around the primary write made inside the block
+        now = datetime.utcnow()
+        docs = [
+            {"_id": str(uuid.uuid4()), "type": job_type, "payload": payload, "state": "held", "attempts": 0,
+             "created_at": now, "due_at": now + timedelta(seconds=JOB_HOLD_SECONDS)}
+            for job_type, payload in jobs
+        ]
+        await repos.jobs.insert_many(docs)
+        yield
+        await repos.jobs.release([doc["_id"] for doc in docs])
+        for doc in docs:
+            self.wakeups[doc["type"]].set()
+
+    async def execute(self, job: dict):
+        handler, _ = self.handlers[job["type"]]
+        try:
+            await handler(**job["payload"])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job["attempts"] >= JOB_MAX_ATTEMPTS:
+                await repos.jobs.dead_letter(job, error)
+                self.dead[job["type"]] = self.dead.get(job["type"], 0) + 1
+                logger.warning(f"Job {job['_id']} ({job['type']}) dead-lettered: {error}")
+                return
+            delay = min(JOB_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1), JOB_BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1)
+            await repos.jobs.retry(job, datetime.utcnow() + timedelta(seconds=delay), error)
+            self.retried[job["type"]] = self.retried.get(job["type"], 0) + 1
+            # Short backoffs shouldn't wait out a full poll interval
+            asyncio.get_running_loop().call_later(delay, self.wakeups[job["type"]].set)
+            return
+        await repos.jobs.complete(job)
+        self.completed[job["type"]] = self.completed.get(job["type"], 0) + 1
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._work(job_type))
+                for job_type, (_, concurrency) in self.handlers.items() for _ in range(concurrency)
+            ]
+
+    async def stop(self):
+        # Jobs cut off mid-run are picked up again once their lease lapses
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _work(self, job_type: str):
+        wakeup = self.wakeups[job_type]
+        while True:
+            wakeup.clear()
+            try:
+                job = await repos.jobs.claim(job_type, WORKER_ID, JOB_LEASE_SECONDS)
+                if job:
+                    await self.execute(job)
+                    continue
+            except Exception as e:
+                logger.warning(f"Job worker for {job_type} failed: {e}")
+            try:
+                await asyncio.wait_for(wakeup.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+job_runner = JobRunner()
+
+@job_runner.handler("post.posts_count")
+async def count_post(post_id: str, user_id: str):
+    # Claims the post's "counted" flag first: a retry after the increment landed finds it
+    # set, as does a job whose insert never landed. The flag is handed back if the
+    # increment fails, so only a worker dying in between loses the count.
+    if not await repos.posts.set_flag(post_id, "counted", True):
+        return
+    try:
+        await repos.users.increment(user_id, "posts_count", 1)
+    except Exception:
+        await repos.posts.set_flag(post_id, "counted", False)
+        raise
+    invalidation_bus.publish("users", "update", user_id)
+
+@job_runner.handler("post.tags")
+async def index_post_tags(post_id: str):
+    post = await repos.posts.get(post_id)
+    if post and post.get("tags"):
+        # Only tags this run indexed are counted, so a retry doesn't count a post twice
+        tag_counts.add(await repos.tags.add_post(post_id, post["tags"], post["created_at"]))
+
+@job_runner.handler("post.mentions", concurrency=4)
+async def notify_post_mentions(post_id: str):
+    post = await repos.posts.get(post_id)
+    if post:
+        await notify_mentions(Post(**post))
+
+def _job_metrics():
+    samples = []
+    for job_type in job_runner.handlers:
+        samples += [
+            ("crewz_jobs_completed_total", {"type": job_type}, job_runner.completed.get(job_type, 0)),
+            ("crewz_jobs_retried_total", {"type": job_type}, job_runner.retried.get(job_type, 0)),
+            ("crewz_jobs_dead_total", {"type": job_type}, job_runner.dead.get(job_type, 0)),
+        ]
+    return samples
+
+metrics_collectors.append(_job_metrics)
+
+# ===== DELTA SYNC =====
+# Writes append to a change log; GET /api/sync replays it from the client's token so a
+# refresh costs O(changes) instead of refetching whole lists. Entries only become visible
+# once they are SYNC_SETTLE_SECONDS old, which covers the window between a sequence
+# number being allocated and its entry landing, so a token never skips past a gap.
+SYNC_RETENTION_SECONDS = int(os.environ.get('SYNC_RETENTION_SECONDS', str(7 * 24 * 3600)))
+SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', '1'))
+SYNC_MAX_CHANGES = 500
+SYNC_GLOBAL_ENTITIES = ["post"]  # everyone's feed; vehicles, likes and profile are per-owner
+
+async def record_change(entity: str, entity_id: str, op: str, owner_id: str):
+    await record_changes([(entity, entity_id, op)], owner_id)
+
+async def record_changes(changes: List[tuple], owner_id: str):
+    # Changes from one request share a single seq allocation and insert
+    try:
+        await repos.changes.record(changes, owner_id)
+    except Exception as e:
+        # A lost entry only costs clients a stale item until their next full refresh
+        logger.warning(f"Change log write failed for {changes}: {e}")
+
+# ===== CACHE INVALIDATION BUS =====
+# In-process indexes and caches (similar vehicles, autocomplete, trending, ranking
+# affinity, ...) subscribe to entity changes here instead of being poked by handlers.
+# With a replica set, events come from a MongoDB change stream over users/posts/
+# vehicles/likes, so every worker sees every write (its own included) exactly once, and
+# the resume token is persisted so a restart picks up where it left off. Without change
+# streams (standalone mongod) handlers publish instead: the event is dispatched in this
+# process and relayed through a capped `invalidations` collection, which other workers
+# follow with a tailable cursor. Only DB_BACKEND=memory, or an explicit "local", keeps
+# events in-process, which is only correct for a single worker.
+INVALIDATION_BUS = os.environ.get('INVALIDATION_BUS', 'auto')  # "auto", "changestream", "capped" or "local"
+# Unique per process: partition leases and change stream resume tokens are keyed by it.
+# Set it to a stable name (e.g. the pod name) for a worker to resume its stream after a restart.
+WORKER_ID = os.environ.get('WORKER_ID', f"{socket.gethostname()}:{os.getpid()}")
+BUS_TOKEN_SAVE_SECONDS = float(os.environ.get('BUS_TOKEN_SAVE_SECONDS', '5'))
+BUS_CAPPED_BYTES = int(os.environ.get('BUS_CAPPED_BYTES', str(64 * 1024 * 1024)))
+BUS_RELAY_BATCH = 500
+BUS_HEAVY_FIELDS = ("images", "profile_image", "password")  # never relayed; no subscriber reads them
+BUS_COLLECTIONS = ["users", "posts", "vehicles", "likes"]
+
+class ChangeEvent:
+    __slots__ = ("collection", "op", "id", "doc", "before", "fields")
+
+    def __init__(self, collection: str, op: str, id: Optional[str], doc: Optional[dict] = None,
+                 before: Optional[dict] = None, fields: Optional[set] = None):
+        self.collection = collection
+        self.op = op  # "insert", "update" or "delete"
+        self.id = id  # None when a change-stream delete arrives without a pre-image
+        self.doc = doc  # document after the change when known; local updates may carry only the changed fields
+        self.before = before  # document before the change, when known
+        self.fields = fields  # top-level fields a change-stream update set or removed; None when unknown
+
+class InvalidationBus:
+    def __init__(self):
+        self.subscribers = {collection: [] for collection in BUS_COLLECTIONS}
+        self.resync_handlers = {collection: [] for collection in BUS_COLLECTIONS}
+        self.source = "local"
+        self.dispatched = 0
+        self.errors = 0
+        self._resync_pending = set()
+        self._task = None
+        self._relay_task = None
+        self._outbox = None  # events waiting to be relayed, when source == "capped"
+        self.origin = uuid.uuid4().hex  # tells this process's relayed events apart
+
+    def subscribe(self, collection: str, handler):
+        self.subscribers[collection].append(handler)
+
+    def on_resync(self, collection: str, handler):
+        # `handler` is an async rebuild, used when events for `collection` may have been lost
+        self.resync_handlers[collection].append(handler)
+
+    def publish(self, collection: str, op: str, id: Optional[str], doc: Optional[dict] = None, before: Optional[dict] = None):
+        # Called by handlers after a write; the change stream delivers these itself
+        if self.source == "changestream":
+            return
+        self.dispatch(ChangeEvent(collection, op, id, doc, before))
+        if self._outbox is not None:
+            self._outbox.put_nowait({
+                "origin": self.origin, "collection": collection, "op": op, "id": id,
+                "doc": self._slim(doc), "before": self._slim(before),
+            })
+
+    @staticmethod
+    def _slim(doc: Optional[dict]) -> Optional[dict]:
+        return {k: v for k, v in doc.items() if k not in BUS_HEAVY_FIELDS} if doc else doc
+
+    def dispatch(self, event: ChangeEvent):
+        self.dispatched += 1
+        for handler in self.subscribers.get(event.collection, ()):
+            try:
+                handler(event)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Invalidation handler failed for {event.collection}: {e}")
+
+    def request_resync(self, collection: str):
+        if collection not in self._resync_pending:
+            self._resync_pending.add(collection)
+            asyncio.get_running_loop().call_later(1.0, lambda: asyncio.ensure_future(self._resync(collection)))
+
+    async def _resync(self, collection: str):
+        self._resync_pending.discard(collection)
+        for handler in self.resync_handlers[collection]:
+            try:
+                await handler()
+            except Exception as e:
+                logger.warning(f"Resync of {collection} caches failed: {e}")
+
+    async def start(self):
+        if INVALIDATION_BUS == "local" or db is None:
+            return
+        if INVALIDATION_BUS == "capped":
+            await self._start_capped()
+            return
+        try:
+            # Probe: standalone servers reject $changeStream outright
+            async with db.watch([], max_await_time_ms=1):
+                pass
+        except PyMongoError as e:
+            if INVALIDATION_BUS == "changestream":
+                raise
+            logger.warning(f"Change streams unavailable, relaying invalidations through a capped collection: {e}")
+            await self._start_capped()
+            return
+        for collection in BUS_COLLECTIONS:
+            try:
+                # Pre-images let deletes carry their document (MongoDB 6.0+)
+                await db.command("collMod", collection, changeStreamPreAndPostImages={"enabled": True})
+            except PyMongoError:
+                pass
+        self.source = "changestream"
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        for task in (self._task, self._relay_task):
+            if task:
+                task.cancel()
+        self._task = self._relay_task = None
+        self._outbox = None
+
+    async def _start_capped(self):
+        try:
+            await db.create_collection("invalidations", capped=True, size=BUS_CAPPED_BYTES)
+        except CollectionInvalid:
+            pass  # another worker created it
+        counter = await db.counters.find_one({"_id": "invalidations"})
+        self.source = "capped"
+        self._outbox = asyncio.Queue()
+        self._relay_task = asyncio.create_task(self._relay())
+        # Caches are built from the database at startup, so only later events matter
+        self._task = asyncio.create_task(self._tail(counter["seq"] if counter else 0))
+
+    async def _relay(self):
+        while True:
+            entries = [await self._outbox.get()]
+            while len(entries) < BUS_RELAY_BATCH and not self._outbox.empty():
+                entries.append(self._outbox.get_nowait())
+            try:
+                # seqs order the entries across workers, so a reconnecting tail can resume
+                counter = await db.counters.find_one_and_update(
+                    {"_id": "invalidations"}, {"$inc": {"seq": len(entries)}},
+                    upsert=True, return_document=ReturnDocument.AFTER,
+                )
+                first = counter["seq"] - len(entries) + 1
+                await db.invalidations.insert_many([dict(entry, seq=first + i) for i, entry in enumerate(entries)])
+            except PyMongoError as e:
+                # Other workers miss these events; their caches stay stale until they resync
+                self.errors += 1
+                logger.warning(f"Could not relay {len(entries)} invalidations: {e}")
 
-# JWT Configuration
-JWT_SECRET = "crewz_nation_secret_key_2025"
-JWT_ALGORITHM = "HS256"
-JWT_EXPIRATION_HOURS = 24 * 7  # 7 days
+    async def _tail(self, seq: int):
+        while True:
+            try:
+                oldest = await db.invalidations.find_one({}, {"seq": 1}, sort=[("$natural", 1)])
+                if oldest and oldest["seq"] > seq + 1:
+                    # Entries after our position were overwritten in the capped collection
+                    logger.warning("Invalidation log wrapped past this worker, resyncing caches")
+                    for collection in BUS_COLLECTIONS:
+                        self.request_resync(collection)
+                cursor = db.invalidations.find({"seq": {"$gt": seq}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for entry in cursor:
+                    seq = max(seq, entry["seq"])
+                    if entry["origin"] != self.origin:
+                        self.dispatch(ChangeEvent(entry["collection"], entry["op"], entry["id"], entry["doc"], entry["before"]))
+            except PyMongoError as e:
+                self.errors += 1
+                logger.warning(f"Invalidation tail interrupted: {e}")
+            # The cursor also dies when nothing matched yet; reopen after a pause
+            await asyncio.sleep(0.5)
 
-# Create the main app
-app = FastAPI(title="CrewZNatioN API", description="Automotive Social Media Platform")
+    async def _watch(self):
+        state = await db.bus_state.find_one({"_id": WORKER_ID})
+        token = state["resume_token"] if state else None
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": BUS_COLLECTIONS},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }}]
+        backoff = 0.5
+        while True:
+            try:
+                async with db.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    full_document_before_change="whenAvailable",
+                    resume_after=token,
+                ) as stream:
+                    backoff = 0.5
+                    saved_at = time.monotonic()
+                    async for change in stream:
+                        causal_clock.observe(None, None, change.get("clusterTime"))
+                        self.dispatch(self._event(change))
+                        token = stream.resume_token
+                        if time.monotonic() - saved_at >= BUS_TOKEN_SAVE_SECONDS:
+                            await self._save_token(token)
+                            saved_at = time.monotonic()
+            except asyncio.CancelledError:
+                if token:
+                    await self._save_token(token)
+                raise
+            except OperationFailure as e:
+                if token and e.code in (260, 280, 286):
+                    # Resume point fell off the oplog: start fresh and rebuild from the database
+                    logger.warning(f"Change stream history lost, resyncing caches: {e}")
+                    token = None
+                    for collection in BUS_COLLECTIONS:
+                        self.request_resync(collection)
+                    continue
+                self.errors += 1
+                logger.warning(f"Change stream failed: {e}")
+            except PyMongoError as e:
+                self.errors += 1
+                logger.warning(f"Change stream interrupted: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
 
-# Create API router
-api_router = APIRouter(prefix="/api")
-security = HTTPBearer()
+    async def _save_token(self, token):
+        try:
+            await db.bus_state.replace_one(
+                {"_id": WORKER_ID}, {"resume_token": token, "saved_at": datetime.utcnow()}, upsert=True
+            )
+        except PyMongoError as e:
+            logger.warning(f"Could not persist change stream resume token: {e}")
 
-# ===== MODELS =====
-class UserCreate(BaseModel):
-    username: str
-    email: str
-    password: str
-    full_name: str
+    @staticmethod
+    def _event(change: dict) -> ChangeEvent:
+        op = {"replace": "update"}.get(change["operationType"], change["operationType"])
+        doc = change.get("fullDocument")
+        before = change.get("fullDocumentBeforeChange")
+        known = doc or before or {}
+        fields = None
+        if change["operationType"] == "update":
+            description = change.get("updateDescription") or {}
+            paths = list(description.get("updatedFields") or ()) + list(description.get("removedFields") or ())
+            fields = {path.split(".", 1)[0] for path in paths}
+        return ChangeEvent(change["ns"]["coll"], op, known.get("id"), doc, before, fields)
 
-class UserLogin(BaseModel):
-    email: str
-    password: str
+invalidation_bus = InvalidationBus()
 
-class User(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    username: str
-    email: str
-    full_name: str
-    bio: Optional[str] = ""
-    profile_image: Optional[str] = ""  # base64
-    followers_count: int = 0
-    following_count: int = 0
-    posts_count: int = 0
-    vehicles_count: int = 0
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+def _on_vehicle_change(event: ChangeEvent):
+    if event.id is None:
+        invalidation_bus.request_resync("vehicles")
+        return
+    if event.op == "delete":
+        similar_vehicles.remove(event.id)
+    elif event.doc:
+        similar_vehicles.upsert(event.doc)
+    owner = (event.doc or event.before or {}).get("user_id")
+    if owner:
+        feed_ranker.invalidate_viewer(owner)
+    if event.op == "insert":
+        make_model_index.add(event.doc.get("make"), event.doc.get("model"), 1)
+    elif event.op == "delete" or (event.doc and "make" in event.doc):
+        if event.before is None:
+            if event.fields is not None and not event.fields & {"make", "model"}:
+                return  # no pre-image (MongoDB < 6.0), but the update left make/model alone
+            # Can't tell what the counts were without the previous document
+            invalidation_bus.request_resync("vehicles")
+            return
+        before = (event.before.get("make"), event.before.get("model"))
+        after = (event.doc.get("make"), event.doc.get("model")) if event.doc else None
+        if before != after:
+            make_model_index.add(*before, -1)
+            if after:
+                make_model_index.add(*after, 1)
 
-class Vehicle(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    make: str
-    model: str
-    year: int
-    type: str  # "car" or "motorcycle"
-    color: Optional[str] = ""
-    description: Optional[str] = ""
-    images: List[str] = []  # base64 images
-    modifications: Optional[str] = ""
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+async def _resync_vehicle_indexes():
+    global similar_vehicles, make_model_index
+    rebuilt_similar, rebuilt_makes = VehicleFeatureIndex(), MakeModelIndex()
+    await rebuilt_similar.build()
+    await rebuilt_makes.build()
+    similar_vehicles, make_model_index = rebuilt_similar, rebuilt_makes
 
-class VehicleCreate(BaseModel):
-    make: str
-    model: str
-    year: int
-    type: str
-    color: Optional[str] = ""
-    description: Optional[str] = ""
-    modifications: Optional[str] = ""
+def _on_like_change(event: ChangeEvent):
+    if event.op == "insert" and event.doc:
+        trending.record(event.doc["post_id"], "like")
+        feed_ranker.invalidate_viewer(event.doc["user_id"])
+    elif event.op == "delete" and event.before:
+        # Without a pre-image an unlike is simply not subtracted; the overestimate decays away
+        trending.record(event.before["post_id"], "like", count=-1)
+        feed_ranker.invalidate_viewer(event.before["user_id"])
 
-class Post(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    vehicle_id: Optional[str] = None
-    caption: str
-    images: List[str] = []  # base64 images
-    likes_count: int = 0
-    comments_count: int = 0
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+def _on_post_change(event: ChangeEvent):
+    if event.op == "insert" and event.doc:
+        trending.record(event.doc["id"], "post", event.doc["created_at"])
 
-class PostCreate(BaseModel):
-    vehicle_id: Optional[str] = None
-    caption: str
-    images: List[str] = []
+invalidation_bus.subscribe("vehicles", _on_vehicle_change)
+invalidation_bus.on_resync("vehicles", _resync_vehicle_indexes)
+invalidation_bus.subscribe("likes", _on_like_change)
+invalidation_bus.subscribe("posts", _on_post_change)
 
-class Comment(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    post_id: str
-    user_id: str
-    content: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+def _bus_metrics():
+    return [
+        ("crewz_invalidation_events_total", {"source": invalidation_bus.source}, invalidation_bus.dispatched),
+        ("crewz_invalidation_errors_total", {"source": invalidation_bus.source}, invalidation_bus.errors),
+    ]
 
-class Like(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    post_id: str
-    user_id: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+metrics_collectors.append(_bus_metrics)
 
-class AuthResponse(BaseModel):
-    access_token: str
-    token_type: str
-    user: User
+# ===== IDEMPOTENCY =====
+# Create/upload routes accept an Idempotency-Key header so client retries on flaky
+# networks don't insert duplicates, bump counters twice or store another image copy.
+# The first request claims the key; concurrent repeats in this process wait on it
+# (single-flight), repeats on other workers poll the shared record, and later repeats
+# replay the stored result. Records live in a TTL collection, fronted by a small LRU.
+# The claim's lock is renewed while the request works, so only a dead worker's claim is
+# taken over. Routes that create a resource (`load`) fix its id in the claim: a takeover
+# first checks whether the dead worker already created it, and completes with it if so.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '2048'))
 
-# ===== HELPER FUNCTIONS =====
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+class IdempotencyGuard:
+    def __init__(self, cache_size: int):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # scope -> (fingerprint, result, expires_at)
+        self.inflight = {}  # scope -> Future resolved with the leader's result
+        self.replayed = 0
+        self.coalesced = 0
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    async def run(self, user_id: str, key: Optional[str], payload: dict, work, load=None):
+        # `work` performs the request. With `load`, it is called with the id to create the
+        # resource under; only that id is stored and repeats re-read it through
+        # `load(id)`, so large bodies (images) aren't copied into the idempotency store.
+        if key is None:
+            return await (work(str(uuid.uuid4())) if load else work())
+        if not 0 < len(key) <= 255:
+            raise HTTPException(status_code=400, detail="Idempotency-Key must be 1-255 characters")
+        scope = f"{user_id}:{key}"
+        fingerprint = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
 
-def create_access_token(user_id: str) -> str:
-    expire = datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS)
-    payload = {"user_id": user_id, "exp": expire}
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+        cached = self.cache.get(scope)
+        if cached and cached[2] > time.monotonic():
+            self.cache.move_to_end(scope)
+            return await self._replay(cached[0], fingerprint, cached[1], load)
+        leader = self.inflight.get(scope)
+        if leader:
+            self.coalesced += 1
+            stored_fingerprint, result = await asyncio.shield(leader)
+            return await self._replay(stored_fingerprint, fingerprint, result, load)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[scope] = future
+        try:
+            new_id = str(uuid.uuid4()) if load else None
+            owned, record = await repos.idempotency.claim(scope, fingerprint, new_id, IDEMPOTENCY_LOCK_SECONDS)
+            if not owned:
+                # Another worker owns or finished the key
+                if record["status"] == "pending":
+                    record = await self._wait_for(scope)
+                future.set_result((record["fingerprint"], record["result"]))
+                self._remember(scope, record["fingerprint"], record["result"])
+                return await self._replay(record["fingerprint"], fingerprint, record["result"], load)
+            resource_id = record.get("resource_id") or new_id
+            response = None
+            if load and resource_id != new_id:
+                # Taken over from a dead worker, which may have created the resource already
+                response = await load(resource_id)
+            if response is None:
+                renewal = asyncio.create_task(self._renew(scope))
+                try:
+                    response = await (work(resource_id) if load else work())
+                except BaseException:
+                    await repos.idempotency.release(scope)
+                    raise
+                finally:
+                    renewal.cancel()
+            result = resource_id if load else jsonable_encoder(response)
+            try:
+                await repos.idempotency.complete(scope, result)
+            except Exception as e:
+                # The work is done; the claim stays pending and a retry after the lock
+                # expires finds the resource (or, without `load`, redoes the work)
+                logger.warning(f"Could not complete idempotency record {scope}: {e}")
+            future.set_result((fingerprint, result))
+            self._remember(scope, fingerprint, result)
+            return response
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                future.exception()  # mark retrieved when nobody is waiting
+            raise
+        finally:
+            self.inflight.pop(scope, None)
+
+    async def _renew(self, scope: str):
+        # The task inherits the request's read route; its session can't be shared with work()
+        _read_route.set(None)
+        while True:
+            await asyncio.sleep(IDEMPOTENCY_LOCK_SECONDS / 3)
+            try:
+                await repos.idempotency.renew(scope)
+            except Exception as e:
+                logger.warning(f"Could not renew idempotency claim {scope}: {e}")
+
+    async def _wait_for(self, scope: str) -> dict:
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        delay = 0.05
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+            record = await repos.idempotency.get(scope)
+            if record is None:
+                break  # the other request failed and released the key
+            if record["status"] == "done":
+                return record
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+    async def _replay(self, stored_fingerprint: str, fingerprint: str, result, load):
+        if stored_fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        self.replayed += 1
+        if load is None:
+            return result
+        resource = await load(result)
+        if resource is None:
+            raise HTTPException(status_code=410, detail="The resource created by this request no longer exists")
+        return resource
+
+    def _remember(self, scope: str, fingerprint: str, result):
+        self.cache[scope] = (fingerprint, result, time.monotonic() + IDEMPOTENCY_TTL_SECONDS)
+        self.cache.move_to_end(scope)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+idempotency = IdempotencyGuard(IDEMPOTENCY_CACHE_SIZE)
+
+def _idempotency_metrics():
+    return [
+        ("crewz_idempotent_replays_total", {}, idempotency.replayed),
+        ("crewz_idempotent_coalesced_total", {}, idempotency.coalesced),
+    ]
+
+metrics_collectors.append(_idempotency_metrics)
+
+# ===== REQUEST COALESCING =====
+# Hot reads (a viral profile or post) arrive as bursts of identical queries. A coalesced
+# function shares one in-flight call among concurrent callers with the same arguments,
+# and can optionally keep the result briefly (`ttl`), serve it a little longer while
+# one caller refreshes it in the background (`stale`), and remember 404s
+# (`negative_ttl`). Entries are dropped early through the invalidation bus.
+HOT_READ_TTL_SECONDS = float(os.environ.get('HOT_READ_TTL_SECONDS', '1'))
+HOT_READ_STALE_SECONDS = float(os.environ.get('HOT_READ_STALE_SECONDS', '5'))
+HOT_READ_NEGATIVE_TTL_SECONDS = float(os.environ.get('HOT_READ_NEGATIVE_TTL_SECONDS', '2'))
+HOT_READ_CACHE_SIZE = int(os.environ.get('HOT_READ_CACHE_SIZE', '4096'))
+
+class CoalescedRead:
+    def __init__(self, name: str, fn, ttl: float, stale: float, negative_ttl: float):
+        self.name = name
+        self.fn = fn
+        self.signature = inspect.signature(fn)
+        self.ttl = ttl
+        self.stale = stale
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # key -> (result or HTTPException, stored_at)
+        self.inflight = {}  # key -> Future
+        self.refreshing = set()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+
+    async def __call__(self, *args, **kwargs):
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = tuple(bound.arguments.items())
+        self.calls += 1
+
+        entry = self.entries.get(key)
+        if entry:
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if isinstance(value, HTTPException):
+                if age < self.negative_ttl:
+                    self.negative_hits += 1
+                    raise HTTPException(status_code=value.status_code, detail=value.detail)
+            elif age < self.ttl:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return value
+            elif age < self.ttl + self.stale:
+                self.stale_hits += 1
+                if key not in self.inflight and key not in self.refreshing:
+                    self.refreshing.add(key)
+                    asyncio.ensure_future(self._refresh(key, bound))
+                return value
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+        leader = self.inflight.get(key)
+        if leader:
+            self.coalesced += 1
+            return await asyncio.shield(leader)
+        return await self._execute(key, bound)
+
+    async def _execute(self, key, bound):
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        self.executions += 1
+        try:
+            async with shared_read():
+                result = await self.fn(*bound.args, **bound.kwargs)
+        except HTTPException as e:
+            if e.status_code == 404 and self.negative_ttl > 0:
+                self._store(key, e)
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody is waiting
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            if self.ttl > 0 or self.stale > 0:
+                self._store(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            self.inflight.pop(key, None)
+
+    async def _refresh(self, key, bound):
+        try:
+            await self._execute(key, bound)
+        except Exception:
+            self.entries.pop(key, None)
+        finally:
+            self.refreshing.discard(key)
+
+    def _store(self, key, value):
+        self.entries[key] = (value, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > HOT_READ_CACHE_SIZE:
+            self.entries.popitem(last=False)
+
+    def forget(self, **match):
+        # Drop cached results whose arguments include every `match` item
+        for key in [key for key in self.entries if match.items() <= dict(key).items()]:
+            del self.entries[key]
+
+    def peek(self, *args, **kwargs):
+        # The cached result for these arguments if still fresh, without calling through
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        entry = self.entries.get(tuple(bound.arguments.items()))
+        if entry and not isinstance(entry[0], HTTPException) and time.monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+        return None
+
+coalesced_reads = {}
+
+def coalesced(name: str, ttl: float = 0, stale: float = 0, negative_ttl: float = 0):
+    # Usable on route handlers (FastAPI reads the wrapped signature) or plain async
+    # functions. Results are shared between callers and must not be mutated.
+    def decorate(fn):
+        read = coalesced_reads[name] = CoalescedRead(name, fn, ttl, stale, negative_ttl)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await read(*args, **kwargs)
+        wrapper.forget = read.forget
+        wrapper.peek = read.peek
+        return wrapper
+    return decorate
+
+def _coalescing_metrics():
+    samples = []
+    for name, read in coalesced_reads.items():
+        labels = {"read": name}
+        samples += [
+            ("crewz_coalesced_calls_total", labels, read.calls),
+            ("crewz_coalesced_executions_total", labels, read.executions),
+            ("crewz_coalesced_joined_total", labels, read.coalesced),
+            ("crewz_coalesced_cache_hits_total", labels, read.hits),
+            ("crewz_coalesced_stale_hits_total", labels, read.stale_hits),
+            ("crewz_coalesced_negative_hits_total", labels, read.negative_hits),
+        ]
+    return samples
+
+metrics_collectors.append(_coalescing_metrics)
+
+def _forget_user_reads(event: ChangeEvent):
+    if event.id:
+        get_user.forget(user_id=event.id)
+
+def _forget_owner_reads(event: ChangeEvent):
+    # New and deleted posts/vehicles change the owner's counters and post list; like
+    # counts on existing posts are left to the TTL
+    if event.op != "update":
+        owner = (event.doc or event.before or {}).get("user_id")
+        if owner:
+            get_user.forget(user_id=owner)
+            user_posts_page.forget(user_id=owner)
+
+invalidation_bus.subscribe("users", _forget_user_reads)
+invalidation_bus.subscribe("posts", _forget_owner_reads)
+invalidation_bus.subscribe("vehicles", _forget_owner_reads)
+
+# ===== FEED PAGE CACHE =====
+# The feed is global, so every viewer shares the same pages. Each cached page holds its
+# posts pre-serialized as JSON fragments that stop short of the closing brace. Serving
+# a page only appends the live counters and the viewer's liked_by_me flag to each
+# fragment, so like traffic patches pages rather than evicting them. Pages are keyed by
+# their keyset cursor, so a new post only drops the pages whose range it falls into
+# (normally just the first), and a deleted post only the pages that show it, as does an
+# author or vehicle change. Pages also expire after FEED_CACHE_TTL_SECONDS.
+FEED_CACHE_PAGES = int(os.environ.get('FEED_CACHE_PAGES', '256'))
+FEED_CACHE_TTL_SECONDS = float(os.environ.get('FEED_CACHE_TTL_SECONDS', '60'))
+FEED_PAGE_SIZE = 20
+FEED_PAGE_MAX = 50
+FEED_DYNAMIC_FIELDS = ("likes_count", "comments_count", "liked_by_me")
+
+class FeedPage:
+    __slots__ = ("fragments", "counts", "author_versions", "vehicle_ids", "archived", "oldest", "full", "built_at")
+
+    def __init__(self, items: List[dict], limit: int):
+        self.fragments = []  # (post_id, JSON object without its dynamic fields and closing brace)
+        self.counts = {}  # post_id -> [likes_count, comments_count]
+        self.author_versions = {}
+        self.vehicle_ids = set()
+        for item in items:
+            static = {key: value for key, value in item.items() if key not in FEED_DYNAMIC_FIELDS}
+            encoded = json.dumps(jsonable_encoder(static), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self.fragments.append((item["id"], encoded[:-1]))
+            self.counts[item["id"]] = [item.get("likes_count", 0), item.get("comments_count", 0)]
+            self.author_versions[item["id"]] = (item.get("user") or {}).get("version")
+            if item.get("vehicle_id"):
+                self.vehicle_ids.add(item["vehicle_id"])
+        self.archived = archived_ids(items)
+        self.oldest = (items[-1]["created_at"], items[-1]["id"]) if items else None
+        self.full = len(items) == limit
+        self.built_at = time.monotonic()
+
+    def covers(self, after: Optional[tuple], position: tuple) -> bool:
+        # Whether a post at `position` falls in this page's range (below `after`, down to
+        # its oldest item, or to the end of the feed when the page isn't full)
+        return (after is None or position < after) and (not self.full or position >= self.oldest)
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        return encode_cursor(*self.oldest) if self.full else None
+
+    def render(self, liked: set) -> bytes:
+        parts = []
+        for post_id, fragment in self.fragments:
+            likes, comments = self.counts[post_id]
+            parts.append(b'%s,"likes_count":%d,"comments_count":%d,"liked_by_me":%s}' % (
+                fragment, likes, comments, b"true" if post_id in liked else b"false"
+            ))
+        return b"[" + b",".join(parts) + b"]"
+
+class FeedPageCache:
+    def __init__(self, max_pages: int):
+        self.max_pages = max_pages
+        self.pages = OrderedDict()  # (after, limit) -> FeedPage
+        self.pages_by_post = {}  # post_id -> keys of the cached pages showing it
+        self.generation = 0  # bumped by structural invalidations; builds that straddle one aren't stored
+        self.building = 0
+        self.late_counts = {}  # counter updates seen while builds were in flight
+        self.hits = {"first": 0, "other": 0}
+        self.misses = {"first": 0, "other": 0}
+        self.invalidated = 0
+
+    async def serve(self, after: Optional[tuple], limit: int, viewer_id: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        # The rendered page and the cursor of the next one
+        key = (after, limit)
+        position = "first" if after is None else "other"
+        page = self.pages.get(key)
+        if page and time.monotonic() - page.built_at > FEED_CACHE_TTL_SECONDS:
+            self._drop(key)
+            page = None
+        if page:
+            self.hits[position] += 1
+            self.pages.move_to_end(key)
+        else:
+            self.misses[position] += 1
+            page = await build_feed_page(after, limit)
+        post_ids = [post_id for post_id, _ in page.fragments]
+        liked = await repos.likes.liked_post_ids(viewer_id, post_ids, page.archived) if viewer_id else set()
+        return page.render(liked), page.next_cursor
+
+    def store(self, key: tuple, page: FeedPage, generation: int):
+        if generation != self.generation:
+            return
+        for post_id, counts in self.late_counts.items():
+            if post_id in page.counts:
+                self._patch(page.counts[post_id], counts)
+        self._drop(key)
+        self.pages[key] = page
+        for post_id in page.counts:
+            self.pages_by_post.setdefault(post_id, set()).add(key)
+        while len(self.pages) > self.max_pages:
+            self._drop(next(iter(self.pages)))
+
+    def on_post_change(self, event: ChangeEvent):
+        if event.op == "update":
+            doc = event.doc or {}
+            counts = {field: doc[field] for field in ("likes_count", "comments_count") if doc.get(field) is not None}
+            if counts:
+                for key in self.pages_by_post.get(event.id, ()):
+                    self._patch(self.pages[key].counts[event.id], counts)
+                if self.building:
+                    self.late_counts.setdefault(event.id, {}).update(counts)
+            version = (doc.get("author") or {}).get("version")
+            if version is not None:
+                self._invalidate(
+                    key for key in self.pages_by_post.get(event.id, ())
+                    if self.pages[key].author_versions.get(event.id) != version
+                )
+            return
+        if event.op == "delete":
+            # Other pages keep their contents: keyset ranges don't shift
+            self._invalidate(self.pages if event.id is None else list(self.pages_by_post.get(event.id, ())))
+            return
+        created_at = (event.doc or {}).get("created_at")
+        if created_at is None:
+            self._invalidate(self.pages)
+        else:
+            self._invalidate(key for key, page in self.pages.items() if page.covers(key[0], (created_at, event.id)))
+
+    def on_vehicle_change(self, event: ChangeEvent):
+        if event.op != "insert":
+            self._invalidate(key for key, page in self.pages.items() if event.id is None or event.id in page.vehicle_ids)
+
+    @staticmethod
+    def _patch(counts: list, values: dict):
+        if "likes_count" in values:
+            counts[0] = values["likes_count"]
+        if "comments_count" in values:
+            counts[1] = values["comments_count"]
+
+    def _invalidate(self, keys):
+        keys = list(keys)
+        self.generation += 1
+        self.invalidated += len(keys)
+        for key in keys:
+            self._drop(key)
+
+    def _drop(self, key: tuple):
+        page = self.pages.pop(key, None)
+        if page:
+            for post_id in page.counts:
+                keys = self.pages_by_post.get(post_id)
+                if keys:
+                    keys.discard(key)
+                    if not keys:
+                        del self.pages_by_post[post_id]
+
+feed_pages = FeedPageCache(FEED_CACHE_PAGES)
+
+@coalesced("feed_page")
+async def build_feed_page(after: Optional[tuple], limit: int) -> FeedPage:
+    generation = feed_pages.generation
+    feed_pages.building += 1
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id: str = payload.get("user_id")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return user_id
-    except ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        page = FeedPage(await repos.posts.feed(after, limit), limit)
+        feed_pages.store((after, limit), page, generation)
+        return page
+    finally:
+        feed_pages.building -= 1
+        if not feed_pages.building:
+            feed_pages.late_counts.clear()
+
+invalidation_bus.subscribe("posts", feed_pages.on_post_change)
+invalidation_bus.subscribe("vehicles", feed_pages.on_vehicle_change)
+
+def _feed_cache_metrics():
+    samples = [("crewz_feed_cache_pages", {}, len(feed_pages.pages)),
+               ("crewz_feed_cache_invalidated_pages_total", {}, feed_pages.invalidated)]
+    for position in ("first", "other"):
+        samples += [
+            ("crewz_feed_cache_hits_total", {"page": position}, feed_pages.hits[position]),
+            ("crewz_feed_cache_misses_total", {"page": position}, feed_pages.misses[position]),
+        ]
+    return samples
+
+metrics_collectors.append(_feed_cache_metrics)
+
+# ===== USERNAME AVAILABILITY =====
+# A Bloom filter over case-folded taken usernames answers the sign-up form's
+# as-you-type checks from memory. Negatives are exact and positives are confirmed
+# against the database, so false positives only cost a query. The filter is built at
+# startup and grows with registrations seen on the invalidation bus.
+USERNAME_FILTER_CAPACITY = int(os.environ.get('USERNAME_FILTER_CAPACITY', '1000000'))
+USERNAME_FILTER_ERROR_RATE = float(os.environ.get('USERNAME_FILTER_ERROR_RATE', '0.01'))
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key.casefold()):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key.casefold()))
+
+    async def build(self):
+        async for username in repos.users.iter_usernames():
+            self.add(username)
+
+username_filter = BloomFilter(USERNAME_FILTER_CAPACITY, USERNAME_FILTER_ERROR_RATE)
+
+def _on_user_insert(event: ChangeEvent):
+    if event.op == "insert" and event.doc and event.doc.get("username"):
+        username_filter.add(event.doc["username"])
+
+invalidation_bus.subscribe("users", _on_user_insert)
+
+# ===== VEHICLE GALLERY =====
+# Vehicle images are stored one per document in vehicle_images, keyed by a per-vehicle
+# position, so vehicle documents stay small and list responses carry only a cover
+# image URL. Positions are never reused, so image URLs are immutable.
+VEHICLE_IMAGE_LIMIT = int(os.environ.get('VEHICLE_IMAGE_LIMIT', '20'))
+VEHICLE_IMAGE_PAGE_SIZE = 20
+
+def gallery_image_url(vehicle_id: str, position: int) -> str:
+    return f"/api/vehicles/{vehicle_id}/images/{position}"
+
+def vehicle_out(vehicle: dict) -> Vehicle:
+    cover = gallery_image_url(vehicle["id"], 0) if vehicle.get("image_count") else None
+    return Vehicle(**{**vehicle, "cover_image": cover})
+
+def decode_base64_image(data: str) -> Optional[bytes]:
+    try:
+        return base64.b64decode(data.split(",", 1)[-1])  # tolerate data: URLs
+    except ValueError:
+        return None
+
+VEHICLE_IMAGE_MIGRATION = "vehicle_images.gallery"
+MIGRATION_LEASE_SECONDS = 300
+
+async def migrate_embedded_vehicle_images():
+    # Moves images still stored inline on vehicle documents into the gallery. Runs once,
+    # on whichever worker takes the lease; safe to rerun after an interruption, as
+    # existing positions are kept.
+    if not await repos.migrations.claim(VEHICLE_IMAGE_MIGRATION, WORKER_ID, MIGRATION_LEASE_SECONDS):
+        return
+    migrated = 0
+    async for vehicle in repos.vehicles.iter_embedded_images():
+        if migrated % 100 == 99 and not await repos.migrations.claim(
+            VEHICLE_IMAGE_MIGRATION, WORKER_ID, MIGRATION_LEASE_SECONDS
+        ):
+            logger.warning("Lost the vehicle image migration lease, leaving the rest to its holder")
+            return
+        now = datetime.utcnow()
+        await repos.vehicle_images.insert_many([
+            {"vehicle_id": vehicle["id"], "user_id": vehicle["user_id"], "position": position, "data": data, "created_at": now}
+            for position, data in enumerate(vehicle["images"])
+        ])
+        await repos.vehicles.clear_embedded_images(vehicle["id"], len(vehicle["images"]))
+        migrated += 1
+    await repos.migrations.finish(VEHICLE_IMAGE_MIGRATION)
+    if migrated:
+        logger.info(f"Moved inline images of {migrated} vehicles into the gallery")
 
 # ===== AUTH ROUTES =====
-@api_router.post("/auth/register", response_model=AuthResponse)
+@api_router.post("/auth/register", response_model=AuthResponse,
+                 dependencies=[Depends(auth_rate_limit("register")), Depends(admission("auth"))])
 async def register(user_data: UserCreate):
-    # Check if user exists
-    existing_user = await db.users.find_one({"$or": [{"email": user_data.email}, {"username": user_data.username}]})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="User with this email or username already exists")
-    
     # Create user
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await run_in_threadpool(hash_password, user_data.password)
     user = User(
         username=user_data.username,
         email=user_data.email,
@@ -158,56 +4611,108 @@ async def register(user_data: UserCreate):
     user_dict = user.dict()
     user_dict["password"] = hashed_password
     
-    await db.users.insert_one(user_dict)
+    # The unique indexes on email and username decide; no racy pre-check
+    try:
+        await repos.users.insert(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="User with this email or username already exists")
+    username_filter.add(user.username)
+    invalidation_bus.publish("users", "insert", user.id, doc=user_dict)
     
-    # Create token
-    token = create_access_token(user.id)
+    # Create tokens
+    tokens = issue_tokens(user.id)
     
     return AuthResponse(
-        access_token=token,
+        access_token=tokens.access_token,
         token_type="bearer",
-        user=user
+        user=user,
+        refresh_token=tokens.refresh_token,
+        expires_in=tokens.expires_in
     )
 
-@api_router.post("/auth/login", response_model=AuthResponse)
+@api_router.get("/auth/availability")
+async def check_availability(username: str):
+    username = username.strip()
+    if not username:
+        raise HTTPException(status_code=400, detail="Username is required")
+    # A Bloom filter miss means the name is definitely free; only possible hits go to the database
+    available = username not in username_filter or not await repos.users.username_taken(username)
+    return {"username": username, "available": available}
+
+@api_router.post("/auth/login", response_model=AuthResponse,
+                 dependencies=[Depends(auth_rate_limit("login")), Depends(admission("auth"))])
 async def login(login_data: UserLogin):
     # Find user
-    user_data = await db.users.find_one({"email": login_data.email})
-    if not user_data or not verify_password(login_data.password, user_data["password"]):
+    user_data = await repos.users.get_by_email(login_data.email)
+    if not user_data or not await run_in_threadpool(verify_password, login_data.password, user_data["password"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # Create user object
     user_data.pop("password")  # Remove password from response
     user = User(**user_data)
     
-    # Create token
-    token = create_access_token(user.id)
+    # Create tokens
+    tokens = issue_tokens(user.id)
     
     return AuthResponse(
-        access_token=token,
+        access_token=tokens.access_token,
         token_type="bearer",
-        user=user
+        user=user,
+        refresh_token=tokens.refresh_token,
+        expires_in=tokens.expires_in
     )
 
-@api_router.get("/auth/me", response_model=User)
-async def get_current_user_info(current_user_id: str = Depends(get_current_user)):
-    user_data = await db.users.find_one({"id": current_user_id})
-    if not user_data:
-        raise HTTPException(status_code=404, detail="User not found")
+@api_router.post("/auth/refresh", response_model=TokenPair)
+async def refresh_tokens(refresh_data: RefreshRequest):
+    payload = decode_token(refresh_data.refresh_token, "refresh")
+    expires_at = datetime.utcfromtimestamp(payload["exp"])
+    if payload["sid"] in token_denylist:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    if payload["jti"] in token_denylist:
+        # A rotated-out refresh token came back: assume it leaked and end the session
+        await token_denylist.revoke(payload["sid"], expires_at)
+        raise HTTPException(status_code=401, detail="Token revoked")
     
-    user_data.pop("password", None)
-    return User(**user_data)
+    # Rotate: the presented refresh token is single-use
+    await token_denylist.revoke(payload["jti"], expires_at)
+    return issue_tokens(payload["user_id"], payload["sid"])
+
+@api_router.post("/auth/logout")
+async def logout(principal: Principal = Depends(get_principal)):
+    if principal.session_id:
+        # Covers the session's refresh tokens too, so keep it for their full lifetime
+        await token_denylist.revoke(principal.session_id, datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS))
+    return {"message": "Logged out successfully"}
+
+@api_router.get("/auth/me", response_model=User)
+async def get_current_user_info(principal: Principal = Depends(get_principal)):
+    return await principal.profile()
 
 # ===== USER ROUTES =====
 @api_router.get("/users/{user_id}", response_model=User)
+@coalesced("get_user", ttl=HOT_READ_TTL_SECONDS, stale=HOT_READ_STALE_SECONDS, negative_ttl=HOT_READ_NEGATIVE_TTL_SECONDS)
 async def get_user(user_id: str):
-    user_data = await db.users.find_one({"id": user_id})
+    user_data = await repos.users.get(user_id)
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
     
     user_data.pop("password", None)
     return User(**user_data)
 
+@api_router.post("/users/batch")
+async def get_users_batch(batch: BatchGetRequest):
+    # Author-style summaries; fresh get_user cache entries are used before the $in query
+    ids = batch_ids(batch)
+    found = {}
+    for user_id in ids:
+        cached = get_user.peek(user_id=user_id)
+        if cached:
+            found[user_id] = author_snapshot(cached.dict())
+    missing = [user_id for user_id in ids if user_id not in found]
+    for user in await repos.users.get_many(missing, AUTHOR_SNAPSHOT_FIELDS):
+        found[user["id"]] = author_snapshot(user)
+    return batch_response(batch.ids, found)
+
 @api_router.put("/users/profile")
 async def update_profile(
     full_name: Optional[str] = None,
@@ -224,191 +4729,360 @@ async def update_profile(
         update_data["profile_image"] = profile_image
     
     if update_data:
-        await db.users.update_one({"id": current_user_id}, {"$set": update_data})
+        if "full_name" in update_data or "profile_image" in update_data:
+            # Fields shown in post author snapshots changed: bump the version and propagate
+            user = await repos.users.update_returning(current_user_id, update_data, {"profile_version": 1})
+            if user:
+                author_propagator.enqueue(author_snapshot(user))
+        else:
+            await repos.users.update_fields(current_user_id, update_data)
+        await record_change("profile", current_user_id, "upsert", current_user_id)
+        invalidation_bus.publish("users", "update", current_user_id)
     
     return {"message": "Profile updated successfully"}
 
+@api_router.get("/users/{user_id}/avatar")
+async def get_user_avatar(user_id: str, v: Optional[int] = None):
+    users = await repos.users.get_many([user_id], ["profile_image", "profile_version"])
+    if not users or not users[0].get("profile_image"):
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    user = users[0]
+    content = decode_base64_image(user["profile_image"])
+    if content is None:
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    # Versioned URLs never change content, so they can be cached forever
+    cache_control = "public, max-age=31536000, immutable" if v == user.get("profile_version", 0) else "no-cache"
+    return Response(content=content, media_type="image/jpeg", headers={"Cache-Control": cache_control})
+
 # ===== VEHICLE ROUTES =====
 @api_router.post("/vehicles", response_model=Vehicle)
 async def create_vehicle(
     vehicle_data: VehicleCreate,
+    current_user_id: str = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    async def create(vehicle_id: str):
+        vehicle = Vehicle(**vehicle_data.dict(), id=vehicle_id, user_id=current_user_id)
+        vehicle_doc = vehicle.dict(exclude={"cover_image"})
+        await repos.vehicles.insert(vehicle_doc)
+        invalidation_bus.publish("vehicles", "insert", vehicle.id, doc=vehicle_doc)
+        
+        # Update user's vehicle count
+        await repos.users.increment(current_user_id, "vehicles_count", 1)
+        await record_change("vehicle", vehicle.id, "upsert", current_user_id)
+        
+        return vehicle
+
+    return await idempotency.run(
+        current_user_id, idempotency_key, {"route": "create_vehicle", **vehicle_data.dict()}, create, load=repos.vehicles.get
+    )
+
+VEHICLE_PAGE_SIZE = 50
+VEHICLE_PAGE_MAX = 100
+VEHICLE_STREAM_BATCH = int(os.environ.get('VEHICLE_STREAM_BATCH', '200'))
+
+async def vehicle_listing(user_id: str, cursor: Optional[str], limit: int, format: str):
+    # Keyset pages of {"vehicles", "next_cursor"}, or with format=ndjson the whole list
+    # from `cursor` on, streamed one vehicle per line as the cursor yields them
+    after = decode_cursor(cursor) if cursor else None
+    if format == "ndjson":
+        route = _read_route.get()
+
+        async def lines():
+            # Iterated after the handler returns, outside its read route
+            async with resumed_read(route):
+                async for vehicle in repos.vehicles.iter_by_user(user_id, after):
+                    yield json.dumps(jsonable_encoder(vehicle_out(vehicle)), ensure_ascii=False).encode("utf-8") + b"\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    limit = max(1, min(limit, VEHICLE_PAGE_MAX))
+    vehicles = [vehicle async for vehicle in repos.vehicles.iter_by_user(user_id, after, limit)]
+    return {
+        "vehicles": [vehicle_out(vehicle) for vehicle in vehicles],
+        "next_cursor": encode_cursor(vehicles[-1]["created_at"], vehicles[-1]["id"]) if len(vehicles) == limit else None,
+    }
+
+@api_router.get("/vehicles/my")
+async def get_my_vehicles(
+    cursor: Optional[str] = None,
+    limit: int = VEHICLE_PAGE_SIZE,
+    format: str = "json",
     current_user_id: str = Depends(get_current_user)
 ):
-    vehicle = Vehicle(**vehicle_data.dict(), user_id=current_user_id)
-    await db.vehicles.insert_one(vehicle.dict())
-    
-    # Update user's vehicle count
-    await db.users.update_one(
-        {"id": current_user_id},
-        {"$inc": {"vehicles_count": 1}}
+    return await vehicle_listing(current_user_id, cursor, limit, format)
+
+@api_router.get("/vehicles/user/{user_id}")
+async def get_user_vehicles(user_id: str, cursor: Optional[str] = None, limit: int = VEHICLE_PAGE_SIZE, format: str = "json"):
+    return await vehicle_listing(user_id, cursor, limit, format)
+
+async def apply_vehicle_update(
+    vehicle_id: str, user_id: str, fields: dict, if_match: Optional[str] = None, add_image: bool = False
+) -> dict:
+    # Ownership, version check and write in one round trip; returns the vehicle as
+    # updated. `add_image` reserves the next gallery position (image_count - 1 after).
+    version = None
+    if if_match is not None:
+        try:
+            version = int(if_match.strip().strip('"'))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="If-Match must be a vehicle version")
+    before = await repos.vehicles.update_owned(
+        vehicle_id, user_id, fields, version, VEHICLE_IMAGE_LIMIT if add_image else None
     )
+    if not before:
+        if version is not None or add_image:
+            # Only now tell a failed precondition apart from a missing vehicle
+            current = await repos.vehicles.get_many([vehicle_id], ["user_id", "version", "image_count"])
+            if current and current[0]["user_id"] == user_id:
+                if add_image and current[0].get("image_count", 0) >= VEHICLE_IMAGE_LIMIT:
+                    raise HTTPException(status_code=400, detail=f"A vehicle can have at most {VEHICLE_IMAGE_LIMIT} images")
+                if version is not None and current[0].get("version", 0) != version:
+                    raise HTTPException(status_code=412, detail="Vehicle was modified by another request")
+        raise HTTPException(status_code=404, detail="Vehicle not found or not owned by user")
     
+    vehicle = {**before, **fields, "version": before.get("version", 0) + 1}
+    if add_image:
+        vehicle["image_count"] = before.get("image_count", 0) + 1
+    invalidation_bus.publish("vehicles", "update", vehicle_id, doc=vehicle, before=before)
+    await record_change("vehicle", vehicle_id, "upsert", user_id)
     return vehicle
 
-@api_router.get("/vehicles/my", response_model=List[Vehicle])
-async def get_my_vehicles(current_user_id: str = Depends(get_current_user)):
-    vehicles = await db.vehicles.find({"user_id": current_user_id}).to_list(100)
-    return [Vehicle(**vehicle) for vehicle in vehicles]
-
-@api_router.get("/vehicles/user/{user_id}", response_model=List[Vehicle])
-async def get_user_vehicles(user_id: str):
-    vehicles = await db.vehicles.find({"user_id": user_id}).to_list(100)
-    return [Vehicle(**vehicle) for vehicle in vehicles]
-
 @api_router.put("/vehicles/{vehicle_id}")
 async def update_vehicle(
     vehicle_id: str,
     vehicle_data: VehicleCreate,
     current_user_id: str = Depends(get_current_user)
 ):
-    # Check ownership
-    vehicle = await db.vehicles.find_one({"id": vehicle_id, "user_id": current_user_id})
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found or not owned by user")
-    
-    await db.vehicles.update_one(
-        {"id": vehicle_id},
-        {"$set": vehicle_data.dict()}
-    )
-    
+    await apply_vehicle_update(vehicle_id, current_user_id, vehicle_data.dict())
     return {"message": "Vehicle updated successfully"}
 
+@api_router.patch("/vehicles/{vehicle_id}", response_model=dict)
+async def patch_vehicle(
+    vehicle_id: str,
+    vehicle_data: VehicleUpdate,
+    response: Response,
+    current_user_id: str = Depends(get_current_user),
+    if_match: Optional[str] = Header(None, alias="If-Match")
+):
+    fields = vehicle_data.dict(exclude_unset=True, exclude_none=True)
+    if not fields:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    vehicle = await apply_vehicle_update(vehicle_id, current_user_id, fields, if_match)
+    response.headers["ETag"] = f'"{vehicle["version"]}"'
+    return vehicle
+
 @api_router.delete("/vehicles/{vehicle_id}")
 async def delete_vehicle(
     vehicle_id: str,
     current_user_id: str = Depends(get_current_user)
 ):
     # Check ownership
-    result = await db.vehicles.delete_one({"id": vehicle_id, "user_id": current_user_id})
-    if result.deleted_count == 0:
+    vehicle = await repos.vehicles.delete_owned(vehicle_id, current_user_id)
+    if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found or not owned by user")
+    invalidation_bus.publish("vehicles", "delete", vehicle_id, before=vehicle)
+    await repos.vehicle_images.delete_for_vehicle(vehicle_id)
     
     # Update user's vehicle count
-    await db.users.update_one(
-        {"id": current_user_id},
-        {"$inc": {"vehicles_count": -1}}
-    )
+    await repos.users.increment(current_user_id, "vehicles_count", -1)
+    await record_change("vehicle", vehicle_id, "delete", current_user_id)
     
     return {"message": "Vehicle deleted successfully"}
 
+@api_router.post("/vehicles/batch")
+async def get_vehicles_batch(batch: BatchGetRequest):
+    vehicles = await repos.vehicles.get_many(batch_ids(batch), VEHICLE_SUMMARY_FIELDS + ["image_count"])
+    found = {}
+    for vehicle in vehicles:
+        vehicle["cover_image"] = gallery_image_url(vehicle["id"], 0) if vehicle.pop("image_count", 0) else None
+        found[vehicle["id"]] = vehicle
+    return batch_response(batch.ids, found)
+
+@api_router.get("/vehicles/autocomplete", response_model=List[dict])
+async def autocomplete_vehicles(q: str = "", limit: int = 10):
+    return make_model_index.suggest(q, max(1, min(limit, 25)))
+
+@api_router.get("/vehicles/{vehicle_id}/similar", response_model=List[dict])
+async def get_similar_vehicles(vehicle_id: str, limit: int = 10):
+    matches = similar_vehicles.similar(vehicle_id, max(1, min(limit, 50)))
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    vehicles = {
+        vehicle["id"]: vehicle
+        for vehicle in await repos.vehicles.get_many([match_id for match_id, _ in matches], VEHICLE_SUMMARY_FIELDS)
+    }
+    return [
+        {**vehicles[match_id], "similarity": round(score, 4)}
+        for match_id, score in matches if match_id in vehicles
+    ]
+
 class VehicleImageAdd(BaseModel):
     image_base64: str
 
-@api_router.post("/vehicles/{vehicle_id}/images")
+@api_router.post("/vehicles/{vehicle_id}/images", dependencies=[Depends(admission("upload"))])
 async def add_vehicle_image(
     vehicle_id: str,
     image_data: VehicleImageAdd,
-    current_user_id: str = Depends(get_current_user)
+    current_user_id: str = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    # Check ownership
-    vehicle = await db.vehicles.find_one({"id": vehicle_id, "user_id": current_user_id})
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found or not owned by user")
-    
-    # Add image to vehicle
-    await db.vehicles.update_one(
-        {"id": vehicle_id},
-        {"$push": {"images": image_data.image_base64}}
-    )
-    
-    return {"message": "Image added successfully"}
+    async def upload():
+        # Ownership and limit check plus position reservation in one conditional write
+        vehicle = await apply_vehicle_update(vehicle_id, current_user_id, {}, add_image=True)
+        position = vehicle["image_count"] - 1
+        await repos.vehicle_images.insert_many([{
+            "vehicle_id": vehicle_id,
+            "user_id": current_user_id,
+            "position": position,
+            "data": image_data.image_base64,
+            "created_at": datetime.utcnow(),
+        }])
+        return {"message": "Image added successfully", "position": position, "url": gallery_image_url(vehicle_id, position)}
+
+    payload = {
+        "route": "add_vehicle_image",
+        "vehicle_id": vehicle_id,
+        "image": hashlib.sha256(image_data.image_base64.encode()).hexdigest(),
+    }
+    return await idempotency.run(current_user_id, idempotency_key, payload, upload)
+
+@api_router.get("/vehicles/{vehicle_id}/images")
+async def list_vehicle_images(vehicle_id: str, after: Optional[int] = None, limit: int = VEHICLE_IMAGE_PAGE_SIZE):
+    limit = max(1, min(limit, 100))
+    images = await repos.vehicle_images.page(vehicle_id, after, limit)
+    if not images and after is None and not await repos.vehicles.get_many([vehicle_id], ["id"]):
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    return {
+        "images": [
+            {"position": image["position"], "url": gallery_image_url(vehicle_id, image["position"]), "created_at": image["created_at"]}
+            for image in images
+        ],
+        "next": images[-1]["position"] if len(images) == limit else None,
+    }
+
+@api_router.get("/vehicles/{vehicle_id}/images/{position}")
+async def get_vehicle_image(vehicle_id: str, position: int):
+    image = await repos.vehicle_images.get(vehicle_id, position)
+    content = decode_base64_image(image["data"]) if image else None
+    if content is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(content=content, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
 # ===== POST ROUTES =====
-@api_router.post("/posts", response_model=Post)
+@api_router.post("/posts", response_model=Post, dependencies=[Depends(admission("upload"))])
 async def create_post(
     post_data: PostCreate,
-    current_user_id: str = Depends(get_current_user)
+    current_user_id: str = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    post = Post(**post_data.dict(), user_id=current_user_id)
-    await db.posts.insert_one(post.dict())
-    
-    # Update user's posts count
-    await db.users.update_one(
-        {"id": current_user_id},
-        {"$inc": {"posts_count": 1}}
-    )
-    
-    return post
+    async def create(post_id: str):
+        authors = await repos.users.get_many([current_user_id], AUTHOR_SNAPSHOT_FIELDS)
+        post = Post(
+            **post_data.dict(),
+            id=post_id,
+            user_id=current_user_id,
+            author=author_snapshot(authors[0]) if authors else None,
+            tags=extract_tags(post_data.caption),
+            mentions=extract_mentions(post_data.caption)
+        )
+        # Counters, tag timelines and notifications follow from the insert as jobs
+        jobs = [("post.posts_count", {"post_id": post.id, "user_id": current_user_id})]
+        if post.tags:
+            jobs.append(("post.tags", {"post_id": post.id}))
+        if post.mentions:
+            jobs.append(("post.mentions", {"post_id": post.id}))
+        async with job_runner.outbox(jobs):
+            await repos.posts.insert(post.dict())
+        invalidation_bus.publish("posts", "insert", post.id, doc=post.dict())
+        await record_change("post", post.id, "upsert", current_user_id)
+        
+        return post
+
+    # Fingerprint images by digest rather than hashing the payloads into the record
+    payload = {
+        "route": "create_post",
+        **post_data.dict(exclude={"images"}),
+        "images": [hashlib.sha256(image.encode()).hexdigest() for image in post_data.images],
+    }
+    return await idempotency.run(current_user_id, idempotency_key, payload, create, load=repos.posts.get)
 
-@api_router.get("/posts/feed", response_model=List[dict])
+@api_router.post("/posts/batch")
+async def get_posts_batch(batch: BatchGetRequest, current_user_id: Optional[str] = Depends(get_optional_user)):
+    # Same shape as feed items, with liked_by_me for a signed-in viewer
+    posts = await annotate_liked_by_me(await repos.posts.feed_items(batch_ids(batch)), current_user_id)
+    return batch_response(batch.ids, {post["id"]: post for post in posts})
+
+@api_router.get("/posts/feed", response_model=List[dict], dependencies=[Depends(admission("feed"))])
 async def get_feed(
+    limit: int = FEED_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    current_user_id: str = Depends(get_current_user)
+):
+    # Pages by keyset cursor; the next page's cursor comes back in X-Next-Cursor
+    limit = max(1, min(limit, FEED_PAGE_MAX))
+    content, next_cursor = await feed_pages.serve(decode_cursor(cursor) if cursor else None, limit, current_user_id)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(content=content, media_type="application/json", headers=headers)
+
+@api_router.get("/posts/feed/ranked", response_model=List[dict], dependencies=[Depends(admission("feed"))])
+async def get_ranked_feed(
     limit: int = 20,
     skip: int = 0,
     current_user_id: str = Depends(get_current_user)
 ):
-    # Get posts with user info
-    pipeline = [
-        {"$sort": {"created_at": -1}},
-        {"$skip": skip},
-        {"$limit": limit},
-        {
-            "$lookup": {
-                "from": "users",
-                "localField": "user_id",
-                "foreignField": "id",
-                "as": "user"
-            }
-        },
-        {
-            "$lookup": {
-                "from": "vehicles",
-                "localField": "vehicle_id",
-                "foreignField": "id",
-                "as": "vehicle"
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,  # Exclude MongoDB _id
-                "id": 1,
-                "user_id": 1,
-                "vehicle_id": 1,
-                "caption": 1,
-                "images": 1,
-                "likes_count": 1,
-                "comments_count": 1,
-                "created_at": 1,
-                "user": {
-                    "$let": {
-                        "vars": {"user": {"$arrayElemAt": ["$user", 0]}},
-                        "in": {
-                            "id": "$$user.id",
-                            "username": "$$user.username",
-                            "full_name": "$$user.full_name",
-                            "profile_image": "$$user.profile_image"
-                        }
-                    }
-                },
-                "vehicle": {
-                    "$let": {
-                        "vars": {"vehicle": {"$arrayElemAt": ["$vehicle", 0]}},
-                        "in": {
-                            "$cond": {
-                                "if": {"$ne": ["$$vehicle", None]},
-                                "then": {
-                                    "id": "$$vehicle.id",
-                                    "make": "$$vehicle.make",
-                                    "model": "$$vehicle.model",
-                                    "year": "$$vehicle.year",
-                                    "type": "$$vehicle.type",
-                                    "color": "$$vehicle.color"
-                                },
-                                "else": None
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    ]
-    
-    posts = await db.posts.aggregate(pipeline).to_list(limit)
-    return posts
+    post_ids = await feed_ranker.rank(current_user_id, skip, limit)
+    posts = await repos.posts.feed_items(post_ids)
+    return await annotate_liked_by_me(posts, current_user_id)
+
+@api_router.get("/posts/trending", response_model=List[dict])
+async def get_trending_posts(limit: int = 20, current_user_id: Optional[str] = Depends(get_optional_user)):
+    # Served from the materialized top-K; refreshed in the background, never recomputed here
+    posts = [dict(post) for post in trending.top[:max(0, min(limit, TRENDING_TOP_K))]]
+    return await annotate_liked_by_me(posts, current_user_id)
+
+@api_router.get("/posts/user/{user_id}", response_model=List[ViewerPost])
+async def get_user_posts(
+    user_id: str,
+    limit: int = 20,
+    skip: int = 0,
+    current_user_id: Optional[str] = Depends(get_optional_user)
+):
+    # The page is shared between viewers; liked_by_me goes on per-request copies
+    posts = [dict(post) for post in await user_posts_page(user_id, skip, limit)]
+    posts = await annotate_liked_by_me(posts, current_user_id)
+    return [ViewerPost(**post) for post in posts]
+
+@coalesced("user_posts", ttl=HOT_READ_TTL_SECONDS, stale=HOT_READ_STALE_SECONDS)
+async def user_posts_page(user_id: str, skip: int, limit: int) -> List[dict]:
+    return await repos.posts.list_by_user(user_id, skip, limit)
+
+# ===== TAG ROUTES =====
+@api_router.get("/tags/{tag}")
+async def get_tag(tag: str):
+    tag = tag.lstrip("#").lower()
+    return {"tag": tag, "posts_count": await tag_counts.count(tag)}
 
-@api_router.get("/posts/user/{user_id}", response_model=List[Post])
-async def get_user_posts(user_id: str, limit: int = 20, skip: int = 0):
-    posts = await db.posts.find({"user_id": user_id}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    return [Post(**post) for post in posts]
+@api_router.get("/tags/{tag}/posts")
+async def get_tag_posts(
+    tag: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    current_user_id: Optional[str] = Depends(get_optional_user)
+):
+    limit = max(1, min(limit, 100))
+    entries = await repos.tags.post_ids(tag.lstrip("#").lower(), decode_cursor(cursor) if cursor else None, limit)
+    posts = await repos.posts.feed_items([post_id for _, post_id in entries])
+    return {
+        "posts": await annotate_liked_by_me(posts, current_user_id),
+        "next_cursor": encode_cursor(*entries[-1]) if len(entries) == limit else None,
+    }
+
+# ===== NOTIFICATION ROUTES =====
+@api_router.get("/notifications", response_model=List[Notification])
+async def get_notifications(limit: int = 50, current_user_id: str = Depends(get_current_user)):
+    notifications = await repos.notifications.list_for_user(current_user_id, max(1, min(limit, 100)))
+    return [Notification(**notification) for notification in notifications]
 
 # ===== LIKE ROUTES =====
 @api_router.post("/posts/{post_id}/like")
@@ -416,21 +5090,115 @@ async def toggle_like(
     post_id: str,
     current_user_id: str = Depends(get_current_user)
 ):
+    if await repos.posts.archived_partition(post_id):
+        raise HTTPException(status_code=409, detail="Archived posts are read-only")
+
     # Check if already liked
-    existing_like = await db.likes.find_one({"post_id": post_id, "user_id": current_user_id})
+    existing_like = await repos.likes.get(post_id, current_user_id)
     
     if existing_like:
         # Unlike
-        await db.likes.delete_one({"post_id": post_id, "user_id": current_user_id})
-        await db.posts.update_one({"id": post_id}, {"$inc": {"likes_count": -1}})
+        await repos.likes.delete(post_id, current_user_id)
+        likes_count = await repos.posts.increment(post_id, "likes_count", -1)
+        invalidation_bus.publish("likes", "delete", existing_like.get("id"), before=existing_like)
+        invalidation_bus.publish("posts", "update", post_id, doc={"id": post_id, "likes_count": likes_count})
+        await record_changes([("like", post_id, "delete"), ("post", post_id, "upsert")], current_user_id)
         return {"message": "Post unliked", "liked": False}
     else:
         # Like
         like = Like(post_id=post_id, user_id=current_user_id)
-        await db.likes.insert_one(like.dict())
-        await db.posts.update_one({"id": post_id}, {"$inc": {"likes_count": 1}})
+        await repos.likes.insert(like.dict())
+        likes_count = await repos.posts.increment(post_id, "likes_count", 1)
+        invalidation_bus.publish("likes", "insert", like.id, doc=like.dict())
+        invalidation_bus.publish("posts", "update", post_id, doc={"id": post_id, "likes_count": likes_count})
+        await record_changes([("like", post_id, "upsert"), ("post", post_id, "upsert")], current_user_id)
         return {"message": "Post liked", "liked": True}
 
+# ===== SYNC ROUTES =====
+@api_router.get("/sync")
+async def sync(since: Optional[str] = None, current_user_id: str = Depends(get_current_user)):
+    try:
+        seq = int(since) if since is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    if seq is not None and seq < 0:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    oldest = await repos.changes.oldest_seq()
+    # "0" is a real token (issued while the log was empty), not a missing one
+    if seq is None or (oldest is not None and oldest > seq + 1):
+        # No token, or older than the log's retention: client must refetch, then sync from here
+        return {"token": str(await repos.changes.latest_seq()), "reset": True, "has_more": False}
+
+    until = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    entries = await repos.changes.since(seq, current_user_id, SYNC_GLOBAL_ENTITIES, until, SYNC_MAX_CHANGES)
+    has_more = len(entries) == SYNC_MAX_CHANGES
+    if has_more:
+        token = entries[-1]["seq"]
+    else:
+        # Everything settled has been scanned, so skip past other users' entries too, or
+        # each poll rescans them
+        token = max(seq, await repos.changes.settled_seq(until))
+    latest = {}  # (entity, id) -> op; the last change for an entity wins
+    for entry in entries:
+        key = (entry["entity"], entry["entity_id"])
+        latest.pop(key, None)
+        latest[key] = entry["op"]
+
+    def ids(entity, op):
+        return [entity_id for (kind, entity_id), change in latest.items() if kind == entity and change == op]
+
+    # Sequential, as the request's causal session doesn't support concurrent operations
+    posts = await repos.posts.feed_items(ids("post", "upsert"))
+    vehicles = await repos.vehicles.get_many(ids("vehicle", "upsert"))
+    posts = await annotate_liked_by_me(posts, current_user_id)
+    profile = None
+    if ("profile", current_user_id) in latest:
+        profile = await repos.users.get(current_user_id)
+        if profile:
+            profile.pop("password", None)
+            profile = User(**profile)
+    return {
+        "token": str(token),
+        "reset": False,
+        "has_more": has_more,
+        "posts": {"upserted": posts, "deleted": ids("post", "delete")},
+        "vehicles": {"upserted": [vehicle_out(vehicle) for vehicle in vehicles], "deleted": ids("vehicle", "delete")},
+        "likes": {"added": ids("like", "upsert"), "removed": ids("like", "delete")},
+        "profile": profile,
+    }
+
+# ===== HEALTH ROUTES =====
+# Liveness only says the process is serving; readiness waits for startup (database
+# warm-up, indexes, in-process caches) and a successful ping, so traffic isn't routed to
+# cold workers and is drained before shutdown.
+READINESS_PING_TIMEOUT_SECONDS = float(os.environ.get('READINESS_PING_TIMEOUT_SECONDS', '1'))
+
+class Readiness:
+    def __init__(self):
+        self.ready = False
+
+readiness = Readiness()
+
+@api_router.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness_check():
+    if not readiness.ready:
+        raise HTTPException(status_code=503, detail="Starting up or shutting down")
+    if client:
+        try:
+            await asyncio.wait_for(client.admin.command("ping"), READINESS_PING_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, PyMongoError):
+            raise HTTPException(status_code=503, detail="Database unreachable")
+    return {"status": "ready"}
+
+# ===== METRICS ROUTES =====
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return render_metrics()
+
 # Include router
 app.include_router(api_router)
 
@@ -441,15 +5209,50 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["traceparent", "X-Causal-Token", "X-Next-Cursor"],
 )
+app.add_middleware(TracingMiddleware)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+# ===== LIFECYCLE =====
+MONGO_WARM_CONNECTIONS = int(os.environ.get('MONGO_WARM_CONNECTIONS', os.environ.get('MONGO_MIN_POOL_SIZE', '10')))
+
+async def warm_database():
+    # Fail fast on a bad MONGO_URL, then open connections up front (concurrent pings each
+    # check one out) so the first requests don't pay for TCP/TLS handshakes and auth
+    await client.admin.command("ping")
+    await asyncio.gather(*[client.admin.command("ping") for _ in range(MONGO_WARM_CONNECTIONS)])
+
+async def startup():
+    tracer.exporter.start()
+    if client:
+        await warm_database()
+    await repos.ensure_indexes()
+    await repos.posts.load_partitions()
+    await migrate_embedded_vehicle_images()
+    await similar_vehicles.build()
+    await make_model_index.build()
+    await username_filter.build()
+    await trending.load()
+    trending.start()
+    tag_counts.start()
+    author_propagator.start()
+    post_archiver.start()
+    job_runner.start()
+    await invalidation_bus.start()
+    await token_denylist.sync()
+    token_denylist.start()
+    await build_feed_page(None, FEED_PAGE_SIZE)  # the default first page, so the first feed request is a hit
+    readiness.ready = True
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def shutdown():
+    readiness.ready = False
+    await tracer.exporter.stop()
+    await trending.stop()
+    await tag_counts.stop()
+    await author_propagator.stop()
+    await post_archiver.stop()
+    await job_runner.stop()
+    await invalidation_bus.stop()
+    await token_denylist.stop()
+    if client:
+        client.close()
@@ -13,7 +13,7 @@ import sys
 import os
 
 # Get backend URL from environment
-BACKEND_URL = "https://ridesocial.preview.emergentagent.com/api"
+BACKEND_URL = os.environ.get("BACKEND_URL", "https://ridesocial.preview.emergentagent.com/api")
 
 class CrewZNationAPITester:
     def __init__(self):
@@ -209,7 +209,7 @@ class CrewZNationAPITester:
         # Test 2: Get My Vehicles
         response = self.make_request("GET", "/vehicles/my")
         if response and response.status_code == 200:
-            data = response.json()
+            data = response.json().get("vehicles")
             if isinstance(data, list) and len(data) > 0:
                 found_vehicle = any(v.get("id") == self.test_vehicle_id for v in data)
                 if found_vehicle:
@@ -279,7 +279,7 @@ class CrewZNationAPITester:
                 # Verify it's actually deleted
                 response = self.make_request("GET", "/vehicles/my")
                 if response and response.status_code == 200:
-                    data = response.json()
+                    data = response.json()["vehicles"]
                     found_vehicle = any(v.get("id") == self.test_vehicle_id for v in data)
                     if not found_vehicle:
                         self.log_result("vehicle_management", "Verify Vehicle Deletion", True, 
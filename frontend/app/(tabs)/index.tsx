@@ -29,11 +29,12 @@ interface Post {
   likes_count: number;
   comments_count: number;
   created_at: string;
+  liked_by_me?: boolean;
   user?: {
     id: string;
     username: string;
     full_name: string;
-    profile_image?: string;
+    avatar_url?: string;
   };
   vehicle?: {
     make: string;
@@ -79,6 +80,7 @@ export default function HomeScreen() {
           if (post.id === postId) {
             return {
               ...post,
+              liked_by_me: response.data.liked,
               likes_count: response.data.liked ? post.likes_count + 1 : post.likes_count - 1
             };
           }
@@ -97,9 +99,9 @@ export default function HomeScreen() {
       <View style={styles.postHeader}>
         <View style={styles.userInfo}>
           <View style={styles.avatar}>
-            {post.user?.profile_image ? (
+            {post.user?.avatar_url ? (
               <Image 
-                source={{ uri: `data:image/jpeg;base64,${post.user.profile_image}` }} 
+                source={{ uri: `${API_BASE_URL}${post.user.avatar_url}` }} 
                 style={styles.avatarImage}
               />
             ) : (
@@ -145,7 +147,11 @@ export default function HomeScreen() {
             style={styles.actionButton}
             onPress={() => handleLike(post.id)}
           >
-            <Ionicons name="heart-outline" size={24} color="#fff" />
+            <Ionicons
+              name={post.liked_by_me ? 'heart' : 'heart-outline'}
+              size={24}
+              color={post.liked_by_me ? '#ff3b5c' : '#fff'}
+            />
           </TouchableOpacity>
           <TouchableOpacity style={styles.actionButton}>
             <Ionicons name="chatbubble-outline" size={24} color="#fff" />
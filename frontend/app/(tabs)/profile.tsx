@@ -26,7 +26,8 @@ interface Vehicle {
   model: string;
   year: number;
   type: string;
-  images: string[];
+  image_count: number;
+  cover_image: string | null;
 }
 
 interface Post {
@@ -61,7 +62,7 @@ export default function ProfileScreen() {
         axios.get(`${API_BASE_URL}/api/posts/user/${user?.id}`)
       ]);
 
-      setVehicles(vehiclesResponse.data);
+      setVehicles(vehiclesResponse.data.vehicles);
       setPosts(postsResponse.data);
     } catch (error) {
       console.error('Error loading profile data:', error);
@@ -104,9 +105,9 @@ export default function ProfileScreen() {
               style={styles.vehicleCard}
               onPress={() => router.push(`/vehicle-details?id=${vehicle.id}`)}
             >
-              {vehicle.images.length > 0 ? (
+              {vehicle.cover_image ? (
                 <Image
-                  source={{ uri: `data:image/jpeg;base64,${vehicle.images[0]}` }}
+                  source={{ uri: `${API_BASE_URL}${vehicle.cover_image}` }}
                   style={styles.vehicleImage}
                 />
               ) : (
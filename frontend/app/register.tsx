@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import {
   View,
   Text,
@@ -14,6 +14,10 @@ import { useRouter } from 'expo-router';
 import { useAuth } from '../contexts/AuthContext';
 import { StatusBar } from 'expo-status-bar';
 import { Ionicons } from '@expo/vector-icons';
+import axios from 'axios';
+import Constants from 'expo-constants';
+
+const API_BASE_URL = Constants.expoConfig?.extra?.apiUrl || process.env.EXPO_PUBLIC_BACKEND_URL;
 
 export default function Register() {
   const [formData, setFormData] = useState({
@@ -26,10 +30,37 @@ export default function Register() {
   const [loading, setLoading] = useState(false);
   const [showPassword, setShowPassword] = useState(false);
   const [showConfirmPassword, setShowConfirmPassword] = useState(false);
+  const [usernameAvailable, setUsernameAvailable] = useState<boolean | null>(null);
   
   const { register } = useAuth();
   const router = useRouter();
 
+  // Check username availability as the user types, debounced
+  useEffect(() => {
+    const username = formData.username.trim();
+    setUsernameAvailable(null);
+    if (username.length < 3) {
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${API_BASE_URL}/api/auth/availability`, {
+          params: { username }
+        });
+        if (!cancelled) {
+          setUsernameAvailable(response.data.available);
+        }
+      } catch (error) {
+        // Leave it to registration to report a taken name
+      }
+    }, 300);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [formData.username]);
+
   const handleRegister = async () => {
     const { username, email, password, confirmPassword, full_name } = formData;
     
@@ -54,6 +85,11 @@ export default function Register() {
       return;
     }
 
+    if (usernameAvailable === false) {
+      Alert.alert('Error', 'That username is already taken');
+      return;
+    }
+
     setLoading(true);
     try {
       await register(username.trim(), email.trim().toLowerCase(), password, full_name.trim());
@@ -104,7 +140,17 @@ export default function Register() {
               autoCapitalize="none"
               autoCorrect={false}
             />
+            {usernameAvailable !== null && (
+              <Ionicons
+                name={usernameAvailable ? "checkmark-circle-outline" : "close-circle-outline"}
+                size={20}
+                color={usernameAvailable ? "#4CAF50" : "#FF4444"}
+              />
+            )}
           </View>
+          {usernameAvailable === false && (
+            <Text style={styles.fieldError}>That username is already taken</Text>
+          )}
 
           <View style={styles.inputContainer}>
             <Ionicons name="mail-outline" size={20} color="#888" style={styles.inputIcon} />
@@ -246,6 +292,13 @@ const styles = StyleSheet.create({
   passwordInput: {
     paddingRight: 40,
   },
+  fieldError: {
+    color: '#FF4444',
+    fontSize: 13,
+    marginTop: -8,
+    marginBottom: 16,
+    marginLeft: 4,
+  },
   eyeIcon: {
     position: 'absolute',
     right: 16,
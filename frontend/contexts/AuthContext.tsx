@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useEffect, useState, ReactNode } from 'react';
+import React, { createContext, useContext, useEffect, useRef, useState, ReactNode } from 'react';
 import AsyncStorage from '@react-native-async-storage/async-storage';
 import axios from 'axios';
 import Constants from 'expo-constants';
@@ -35,14 +35,20 @@ export const AuthProvider = ({ children }: { children: ReactNode }) => {
   const [user, setUser] = useState<User | null>(null);
   const [token, setToken] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const refreshing = useRef<Promise<string | null> | null>(null);
+  // Echoed back so reads served by replicas still include this user's own latest writes
+  const causalToken = useRef<string | null>(null);
 
   // Configure axios interceptor
   useEffect(() => {
     const interceptor = axios.interceptors.request.use(
       (config) => {
-        if (token) {
+        if (token && !config.headers.Authorization) {
           config.headers.Authorization = `Bearer ${token}`;
         }
+        if (token && causalToken.current) {
+          config.headers['X-Causal-Token'] = causalToken.current;
+        }
         return config;
       },
       (error) => Promise.reject(error)
@@ -51,6 +57,64 @@ export const AuthProvider = ({ children }: { children: ReactNode }) => {
     return () => axios.interceptors.request.eject(interceptor);
   }, [token]);
 
+  // Access tokens are short-lived: on a 401, refresh once and retry the request
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(
+      (response) => {
+        const causal = response.headers['x-causal-token'];
+        if (causal) {
+          causalToken.current = causal;
+        }
+        return response;
+      },
+      async (error) => {
+        const original = error.config;
+        if (error.response?.status !== 401 || !original || original._retried || original.url?.includes('/api/auth/')) {
+          return Promise.reject(error);
+        }
+        original._retried = true;
+        const newToken = await refreshAccessToken();
+        if (!newToken) {
+          return Promise.reject(error);
+        }
+        original.headers.Authorization = `Bearer ${newToken}`;
+        return axios(original);
+      }
+    );
+
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
+  const refreshAccessToken = (): Promise<string | null> => {
+    // Concurrent 401s share one refresh; refresh tokens are single-use
+    if (!refreshing.current) {
+      refreshing.current = (async () => {
+        try {
+          const refreshToken = await AsyncStorage.getItem('refresh_token');
+          if (!refreshToken) {
+            return null;
+          }
+          const response = await axios.post(`${API_BASE_URL}/api/auth/refresh`, {
+            refresh_token: refreshToken
+          });
+          const { access_token, refresh_token } = response.data;
+          setToken(access_token);
+          await AsyncStorage.setItem('auth_token', access_token);
+          await AsyncStorage.setItem('refresh_token', refresh_token);
+          return access_token;
+        } catch (error) {
+          await AsyncStorage.multiRemove(['auth_token', 'refresh_token', 'user_data']);
+          setToken(null);
+          setUser(null);
+          return null;
+        } finally {
+          refreshing.current = null;
+        }
+      })();
+    }
+    return refreshing.current;
+  };
+
   // Load user data on app start
   useEffect(() => {
     loadStoredAuth();
@@ -65,17 +129,20 @@ export const AuthProvider = ({ children }: { children: ReactNode }) => {
         setToken(storedToken);
         setUser(JSON.parse(storedUser));
         
-        // Verify token is still valid
+        // Verify token is still valid, refreshing it if it has expired
         try {
           const response = await axios.get(`${API_BASE_URL}/api/auth/me`, {
             headers: { Authorization: `Bearer ${storedToken}` }
           });
           setUser(response.data);
         } catch (error) {
-          // Token is invalid, clear storage
-          await AsyncStorage.multiRemove(['auth_token', 'user_data']);
-          setToken(null);
-          setUser(null);
+          const newToken = await refreshAccessToken();
+          if (newToken) {
+            const response = await axios.get(`${API_BASE_URL}/api/auth/me`, {
+              headers: { Authorization: `Bearer ${newToken}` }
+            });
+            setUser(response.data);
+          }
         }
       }
     } catch (error) {
@@ -92,12 +159,13 @@ export const AuthProvider = ({ children }: { children: ReactNode }) => {
         password
       });
 
-      const { access_token, user: userData } = response.data;
+      const { access_token, refresh_token, user: userData } = response.data;
       
       setToken(access_token);
       setUser(userData);
       
       await AsyncStorage.setItem('auth_token', access_token);
+      await AsyncStorage.setItem('refresh_token', refresh_token);
       await AsyncStorage.setItem('user_data', JSON.stringify(userData));
     } catch (error: any) {
       throw new Error(error.response?.data?.detail || 'Login failed');
@@ -113,12 +181,13 @@ export const AuthProvider = ({ children }: { children: ReactNode }) => {
         full_name
       });
 
-      const { access_token, user: userData } = response.data;
+      const { access_token, refresh_token, user: userData } = response.data;
       
       setToken(access_token);
       setUser(userData);
       
       await AsyncStorage.setItem('auth_token', access_token);
+      await AsyncStorage.setItem('refresh_token', refresh_token);
       await AsyncStorage.setItem('user_data', JSON.stringify(userData));
     } catch (error: any) {
       throw new Error(error.response?.data?.detail || 'Registration failed');
@@ -127,7 +196,12 @@ export const AuthProvider = ({ children }: { children: ReactNode }) => {
 
   const logout = async () => {
     try {
-      await AsyncStorage.multiRemove(['auth_token', 'user_data']);
+      if (token) {
+        // Revokes the session server-side; local sign-out proceeds regardless
+        await axios.post(`${API_BASE_URL}/api/auth/logout`).catch(() => undefined);
+      }
+      await AsyncStorage.multiRemove(['auth_token', 'refresh_token', 'user_data']);
+      causalToken.current = null;
       setToken(null);
       setUser(null);
     } catch (error) {
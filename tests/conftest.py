@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import uuid
+
+import pytest
+
+os.environ.setdefault("DB_BACKEND", "memory")
+os.environ.setdefault("SYNC_SETTLE_SECONDS", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def register(client):
+    def register_user(username=None, password="secret-pw", full_name="Test Rider"):
+        username = username or f"rider_{uuid.uuid4().hex[:10]}"
+        response = client.post("/api/auth/register", json={
+            "username": username,
+            "email": f"{username}@example.com",
+            "password": password,
+            "full_name": full_name,
+        })
+        assert response.status_code == 200, response.text
+        body = response.json()
+        body["headers"] = {"Authorization": f"Bearer {body['access_token']}"}
+        return body
+    return register_user
+
+
+@pytest.fixture
+def user(register):
+    return register()
+
+
+@pytest.fixture
+def other_user(register):
+    return register()
+
+
+@pytest.fixture
+def vehicle(client, user):
+    response = client.post("/api/vehicles", json={"make": "BMW", "model": "M3", "year": 2020, "type": "car"},
+                           headers=user["headers"])
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+def post(client, user):
+    response = client.post("/api/posts", json={"caption": "First ride #Track", "images": []}, headers=user["headers"])
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def eventually(check, timeout=5.0, interval=0.05):
+    # Background work (jobs, tag counts) lands shortly after the response
+    deadline = time.monotonic() + timeout
+    while True:
+        result = check()
+        if result or time.monotonic() > deadline:
+            return result
+        time.sleep(interval)
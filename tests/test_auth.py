@@ -0,0 +1,69 @@
+import uuid
+
+import server
+
+
+def test_register_login_and_me(client, register):
+    user = register(full_name="Alice Rider")
+    me = client.get("/api/auth/me", headers=user["headers"])
+    assert me.status_code == 200
+    assert me.json()["full_name"] == "Alice Rider"
+    assert "password" not in me.json()
+
+    email = f"{user['user']['username']}@example.com"
+    login = client.post("/api/auth/login", json={"email": email.upper(), "password": "secret-pw"})
+    assert login.status_code == 200
+    assert login.json()["refresh_token"]
+
+
+def test_register_rejects_taken_username_case_insensitively(client, user):
+    username = user["user"]["username"]
+    response = client.post("/api/auth/register", json={
+        "username": username.upper(), "email": f"{uuid.uuid4().hex}@example.com", "password": "pw", "full_name": "Copy",
+    })
+    assert response.status_code == 400
+
+
+def test_username_availability(client, user):
+    taken = client.get("/api/auth/availability", params={"username": user["user"]["username"].upper()})
+    assert taken.json()["available"] is False
+    free = client.get("/api/auth/availability", params={"username": f"free_{uuid.uuid4().hex[:8]}"})
+    assert free.json()["available"] is True
+
+
+def test_register_validation_error(client):
+    response = client.post("/api/auth/register", json={"username": "nobody"})
+    assert response.status_code == 422
+
+
+def test_refresh_rotates_and_reuse_is_rejected(client, user):
+    rotated = client.post("/api/auth/refresh", json={"refresh_token": user["refresh_token"]})
+    assert rotated.status_code == 200
+    reused = client.post("/api/auth/refresh", json={"refresh_token": user["refresh_token"]})
+    assert reused.status_code == 401
+
+
+def test_logout_revokes_session(client, user):
+    assert client.post("/api/auth/logout", headers=user["headers"]).status_code == 200
+    assert client.get("/api/auth/me", headers=user["headers"]).status_code == 401
+    refreshed = client.post("/api/auth/refresh", json={"refresh_token": user["refresh_token"]})
+    assert refreshed.status_code == 401
+
+
+def test_login_attempts_are_rate_limited_before_admission(client, user):
+    email = f"{user['user']['username']}@example.com"
+    admitted = server.admission_controllers["auth"].admitted
+    statuses = [client.post("/api/auth/login", json={"email": email, "password": "wrong"}).status_code
+                for _ in range(server.auth_rate_limiter.burst + 1)]
+    assert statuses[:-1] == [401] * server.auth_rate_limiter.burst
+    assert statuses[-1] == 429
+    assert server.admission_controllers["auth"].admitted - admitted == server.auth_rate_limiter.burst
+
+
+def test_auth_is_shed_when_admission_is_saturated(client, monkeypatch):
+    controller = server.admission_controllers["auth"]
+    monkeypatch.setattr(controller, "concurrency", 0)
+    monkeypatch.setattr(controller, "max_queue", 0)
+    response = client.post("/api/auth/login", json={"email": "busy@example.com", "password": "pw"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
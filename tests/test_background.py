@@ -0,0 +1,31 @@
+import asyncio
+
+import server
+
+
+class Flaky(server.BackgroundLoop):
+    def __init__(self):
+        super().__init__(0, "Flaky tick failed")
+        self.ticks = 0
+        self.stopped = False
+
+    async def tick(self):
+        self.ticks += 1
+        if self.ticks == 1:
+            raise RuntimeError("boom")
+
+    async def on_stop(self):
+        self.stopped = True
+
+
+def test_background_loop_survives_a_failed_tick(caplog):
+    async def scenario():
+        loop = Flaky()
+        loop.start()
+        while loop.ticks < 3:
+            await asyncio.sleep(0)
+        await loop.stop()
+        return loop
+    loop = asyncio.run(scenario())
+    assert loop.stopped
+    assert "Flaky tick failed: boom" in caplog.text
@@ -0,0 +1,18 @@
+import server
+
+
+def test_liveness_and_readiness(client):
+    assert client.get("/api/health/live").json() == {"status": "ok"}
+    assert client.get("/api/health/ready").json() == {"status": "ready"}
+
+
+def test_not_ready_during_shutdown(client, monkeypatch):
+    monkeypatch.setattr(server.readiness, "ready", False)
+    assert client.get("/api/health/ready").status_code == 503
+
+
+def test_metrics(client, user):
+    client.get("/api/auth/me", headers=user["headers"])
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    assert "admission" in response.text
@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+import server
+
+
+def fingerprint(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def test_lock_is_renewed_while_work_runs(client, monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_LOCK_SECONDS", 0.3)
+    payload = {"route": "slow"}
+
+    async def scenario():
+        async def work(resource_id):
+            await asyncio.sleep(0.7)
+            return {"id": resource_id}
+
+        async def load(resource_id):
+            return {"id": resource_id}
+        first = asyncio.create_task(server.idempotency.run("u-renew", "k", payload, work, load=load))
+        await asyncio.sleep(0.5)
+        owned, _ = await server.repos.idempotency.claim("u-renew:k", fingerprint(payload), "other", 0.3)
+        return owned, await first
+    owned, response = client.portal.call(scenario)
+    assert owned is False
+    assert response["id"]
+
+
+def test_lock_renewal_runs_outside_the_request_session(client, monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_LOCK_SECONDS", 0.3)
+    routes = []
+
+    async def renew(scope):
+        routes.append(server._read_route.get())
+    monkeypatch.setattr(server.repos.idempotency, "renew", renew)
+
+    async def scenario():
+        async def work():
+            await asyncio.sleep(0.3)
+            return {"ok": True}
+        token = server._read_route.set(server.ReadRoute("u-session", None, object()))
+        try:
+            return await server.idempotency.run("u-session", "k", {"route": "slow"}, work)
+        finally:
+            server._read_route.reset(token)
+    assert client.portal.call(scenario) == {"ok": True}
+    assert routes and routes == [None] * len(routes)
+
+
+def test_takeover_reuses_a_resource_the_dead_worker_created(client, user, monkeypatch):
+    body = {"caption": "half done", "images": []}
+    payload = {"route": "create_post", "caption": "half done", "vehicle_id": None, "images": []}
+    scope = f"{user['user']['id']}:crashed"
+
+    async def crash_after_insert():
+        # A worker claimed the key and inserted the post, then died before completing
+        await server.repos.idempotency.claim(scope, fingerprint(payload), "post-from-dead-worker", 30)
+        server.repos.idempotency.records[scope]["locked_at"] = datetime.utcnow() - timedelta(minutes=5)
+        post = server.Post(**body, id="post-from-dead-worker", user_id=user["user"]["id"])
+        await server.repos.posts.insert(post.dict())
+    client.portal.call(crash_after_insert)
+
+    response = client.post("/api/posts", json=body, headers={**user["headers"], "Idempotency-Key": "crashed"})
+    assert response.status_code == 200
+    assert response.json()["id"] == "post-from-dead-worker"
+    posts = client.get(f"/api/posts/user/{user['user']['id']}").json()
+    assert [post["id"] for post in posts] == ["post-from-dead-worker"]
+
+
+def test_failed_complete_still_answers_and_replays(client, user, monkeypatch):
+    async def failing_complete(scope, result):
+        raise RuntimeError("primary stepped down")
+    monkeypatch.setattr(server.repos.idempotency, "complete", failing_complete)
+    headers = {**user["headers"], "Idempotency-Key": "complete-fails"}
+    body = {"make": "Mazda", "model": "MX-5", "year": 1995, "type": "car"}
+    created = client.post("/api/vehicles", json=body, headers=headers)
+    assert created.status_code == 200
+    monkeypatch.undo()
+
+    # The claim stayed pending; once its lock lapses a retry finds the vehicle instead of inserting another
+    server.repos.idempotency.records[f"{user['user']['id']}:complete-fails"]["locked_at"] -= timedelta(minutes=5)
+    server.idempotency.cache.clear()
+    replay = client.post("/api/vehicles", json=body, headers=headers)
+    assert replay.json()["id"] == created.json()["id"]
+    assert len(client.get("/api/vehicles/my", headers=user["headers"]).json()["vehicles"]) == 1
@@ -0,0 +1,121 @@
+# Runs against a real MongoDB when MONGO_TEST_URL points at one, e.g. a single-member
+# replica set started with `mongod --replSet rs0` and `rs.initiate()`
+import asyncio
+import os
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+
+pytestmark = pytest.mark.skipif(not MONGO_TEST_URL, reason="MONGO_TEST_URL is not set")
+
+
+def run_against_mongo(monkeypatch, scenario):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def run():
+        client = AsyncIOMotorClient(MONGO_TEST_URL)
+        name = f"crewz_test_{uuid.uuid4().hex[:8]}"
+        monkeypatch.setattr(server, "client", client)
+        monkeypatch.setattr(server, "db", server.TracedDatabase(client[name]))
+        try:
+            await scenario(server.db)
+        finally:
+            await client.drop_database(name)
+            client.close()
+    asyncio.run(run())
+
+
+async def wait_for(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+
+def test_capped_bus_relays_events_between_workers(monkeypatch):
+    async def scenario(db):
+        publisher, follower = server.InvalidationBus(), server.InvalidationBus()
+        own, received = [], []
+        publisher.subscribe("posts", own.append)
+        follower.subscribe("posts", received.append)
+        await publisher._start_capped()
+        await follower._start_capped()
+        try:
+            publisher.publish("posts", "insert", "p1", doc={"id": "p1", "images": ["aGVsbG8="]})
+            await wait_for(lambda: received)
+            await asyncio.sleep(0.6)  # the publisher's own tail must skip it
+        finally:
+            await publisher.stop()
+            await follower.stop()
+        assert [event.id for event in own] == ["p1"]
+        assert [(event.op, event.doc) for event in received] == [("insert", {"id": "p1"})]
+    run_against_mongo(monkeypatch, scenario)
+
+
+def test_users_keep_a_duplicate_check_without_the_unique_index(monkeypatch):
+    async def scenario(db):
+        users = server.MotorUserRepo(db)
+        # Case-variant duplicates from before the index existed block its build
+        await db.users.insert_many([
+            {"id": "a", "email": "dup@example.com", "username": "one"},
+            {"id": "b", "email": "DUP@example.com", "username": "two"},
+        ])
+        await users.ensure_indexes()
+        assert users.unique_indexes == {"username"}
+        with pytest.raises(server.DuplicateKeyError):
+            await users.insert({"id": "c", "email": "Dup@Example.com", "username": "three"})
+        with pytest.raises(server.DuplicateKeyError):
+            await users.insert({"id": "d", "email": "new@example.com", "username": "ONE"})
+    run_against_mongo(monkeypatch, scenario)
+
+
+def test_read_routing_reads_a_users_own_writes(monkeypatch):
+    async def scenario(db):
+        user_id = str(uuid.uuid4())
+        preference = server.READ_MODES["secondaryPreferred"](max_staleness=server.READ_MAX_STALENESS_SECONDS)
+        request = SimpleNamespace(headers={"authorization": f"Bearer {server.create_access_token(user_id)}"})
+        async with server.read_routing(request, preference) as route:
+            assert route.user_id == user_id and route.session is not None
+            await db.vehicles.insert_one({"id": "v1", "user_id": user_id})
+            # Routed to the secondaryPreferred collection, in the session that made the write
+            assert await db.vehicles.find_one({"id": "v1"}) is not None
+            assert route.session.operation_time is not None
+            header = server.encode_causal_token(user_id, route.session.cluster_time, route.session.operation_time)
+            async with server.shared_read():
+                shared = server._read_route.get()
+                assert shared.user_id is None and shared.session is not route.session
+                assert shared.read_preference is preference
+                assert await db.vehicles.count_documents({"user_id": user_id}) == 1
+            assert server._read_route.get() is route
+        assert route.session.has_ended
+        written = route.session.operation_time
+        assert server.causal_clock.get(user_id)[1] == written
+
+        # Another worker without this user's clock picks it up from X-Causal-Token
+        monkeypatch.setattr(server, "causal_clock", server.CausalClock(server.CAUSAL_CLOCK_USERS))
+        request.headers["x-causal-token"] = header
+        async with server.read_routing(request, preference) as route:
+            assert route.session.operation_time >= written
+            assert await db.vehicles.find_one({"id": "v1"}) is not None
+    run_against_mongo(monkeypatch, scenario)
+
+
+def test_retried_tag_and_notification_inserts_are_ignored(monkeypatch):
+    async def scenario(db):
+        tags, notifications = server.MotorTagRepo(db), server.MotorNotificationRepo(db)
+        await tags.ensure_indexes()
+        assert tags.unique_index
+        now = server.datetime.utcnow()
+        assert await tags.add_post("p1", ["a", "b"], now) == ["a", "b"]
+        assert await tags.add_post("p1", ["a", "b", "c"], now) == ["c"]
+        mention = server.Notification(id="mention:p1:u1", user_id="u1", type="mention", actor_id="u2", post_id="p1").dict()
+        await notifications.insert_many([mention])
+        await notifications.insert_many([mention])
+        assert len(await notifications.list_for_user("u1", 10)) == 1
+    run_against_mongo(monkeypatch, scenario)
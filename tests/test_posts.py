@@ -0,0 +1,181 @@
+import asyncio
+
+import server
+
+from tests.conftest import eventually
+
+
+def test_feed_lists_new_posts(client, user, post):
+    feed = client.get("/api/posts/feed", params={"limit": 50}, headers=user["headers"])
+    assert feed.status_code == 200
+    assert post["id"] in [item["id"] for item in feed.json()]
+
+
+def test_feed_requires_auth(client):
+    assert client.get("/api/posts/feed").status_code in (401, 403)
+
+
+def test_feed_is_shed_when_admission_is_saturated(client, user, monkeypatch):
+    controller = server.admission_controllers["feed"]
+    monkeypatch.setattr(controller, "concurrency", 0)
+    monkeypatch.setattr(controller, "max_queue", 0)
+    assert client.get("/api/posts/feed", headers=user["headers"]).status_code == 503
+
+
+def test_create_post_validation(client, user):
+    assert client.post("/api/posts", json={"images": []}, headers=user["headers"]).status_code == 422
+
+
+def test_create_post_is_idempotent(client, user):
+    headers = {**user["headers"], "Idempotency-Key": "post-1"}
+    first = client.post("/api/posts", json={"caption": "once", "images": []}, headers=headers)
+    replay = client.post("/api/posts", json={"caption": "once", "images": []}, headers=headers)
+    assert replay.json()["id"] == first.json()["id"]
+    assert client.post("/api/posts", json={"caption": "twice", "images": []}, headers=headers).status_code == 422
+
+
+def test_idempotency_key_in_progress(client, user, monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_WAIT_SECONDS", 0.2)
+    key = "post-in-flight"
+    scope = f"{user['user']['id']}:{key}"
+
+    async def claim():
+        return await server.repos.idempotency.claim(scope, "other-request", None, 60)
+    client.portal.call(claim)
+    response = client.post("/api/posts", json={"caption": "racing", "images": []},
+                           headers={**user["headers"], "Idempotency-Key": key})
+    assert response.status_code == 409
+
+
+def test_like_toggle(client, user, other_user, post):
+    liked = client.post(f"/api/posts/{post['id']}/like", headers=other_user["headers"]).json()
+    assert liked["liked"] is True
+    batch = client.post("/api/posts/batch", json={"ids": [post["id"]]}, headers=other_user["headers"]).json()
+    assert batch["items"][0]["likes_count"] == 1
+    assert batch["items"][0]["liked_by_me"] is True
+
+    unliked = client.post(f"/api/posts/{post['id']}/like", headers=other_user["headers"]).json()
+    assert unliked["liked"] is False
+
+
+def test_like_on_archived_post_conflicts(client, user, post, monkeypatch):
+    monkeypatch.setitem(server.repos.posts.locator, post["id"], "2020-01")
+    assert client.post(f"/api/posts/{post['id']}/like", headers=user["headers"]).status_code == 409
+
+
+def test_user_posts(client, user, post):
+    posts = client.get(f"/api/posts/user/{user['user']['id']}").json()
+    assert [item["id"] for item in posts] == [post["id"]]
+
+
+def test_ranked_feed_and_trending(client, user, post):
+    ranked = client.get("/api/posts/feed/ranked", headers=user["headers"])
+    assert ranked.status_code == 200
+    assert client.get("/api/posts/trending").status_code == 200
+
+
+def test_tags_and_mentions(client, user, other_user):
+    username = other_user["user"]["username"]
+    created = client.post("/api/posts", json={"caption": f"Meet @{username} #Canyons", "images": []},
+                          headers=user["headers"]).json()
+
+    def tagged():
+        return client.get("/api/tags/canyons/posts").json()["posts"]
+    assert [item["id"] for item in eventually(tagged)] == [created["id"]]
+    assert eventually(lambda: client.get("/api/tags/canyons").json()["posts_count"] == 1)
+
+    def notified():
+        return client.get("/api/notifications", headers=other_user["headers"]).json()
+    notifications = eventually(notified)
+    assert [n["post_id"] for n in notifications] == [created["id"]]
+
+
+def test_mentions_match_usernames_case_insensitively(client, user, register):
+    mentioned = register(username=f"Casey_{user['user']['id'][:6]}")
+    caption = f"Riding with @{mentioned['user']['username'].lower()} and @{mentioned['user']['username'].upper()}"
+    created = client.post("/api/posts", json={"caption": caption, "images": []}, headers=user["headers"]).json()
+
+    notifications = eventually(lambda: client.get("/api/notifications", headers=mentioned["headers"]).json())
+    assert [n["post_id"] for n in notifications] == [created["id"]]
+
+
+def test_post_jobs_are_idempotent_when_retried(client, register):
+    author, mentioned = register(), register()
+    caption = f"Meet @{mentioned['user']['username']} #Retried"
+    created = client.post("/api/posts", json={"caption": caption, "images": []}, headers=author["headers"]).json()
+    eventually(lambda: client.get("/api/tags/retried").json()["posts_count"] == 1)
+    eventually(lambda: client.get("/api/notifications", headers=mentioned["headers"]).json())
+
+    async def retry_jobs():
+        await server.count_post(created["id"], author["user"]["id"])
+        await server.index_post_tags(created["id"])
+        await server.notify_post_mentions(created["id"])
+        await server.tag_counts.flush()
+        return await server.repos.users.get(author["user"]["id"])
+    assert client.portal.call(retry_jobs)["posts_count"] == 1
+    assert client.get("/api/tags/retried").json()["posts_count"] == 1
+    assert len(client.get("/api/tags/retried/posts").json()["posts"]) == 1
+    assert len(client.get("/api/notifications", headers=mentioned["headers"]).json()) == 1
+
+
+def test_published_events_are_relayed_without_payloads():
+    bus = server.InvalidationBus()
+    received = []
+    bus.subscribe("posts", received.append)
+    bus._outbox = asyncio.Queue()
+    bus.publish("posts", "insert", "p1", doc={"id": "p1", "images": ["aGVsbG8="]})
+
+    assert [event.id for event in received] == ["p1"]
+    entry = bus._outbox.get_nowait()
+    assert entry["origin"] == bus.origin
+    assert entry["doc"] == {"id": "p1"}
+
+
+def test_feed_pages_by_cursor_and_caches_by_cursor(client, register):
+    author = register()
+    created = [client.post("/api/posts", json={"caption": f"page {n}", "images": []}, headers=author["headers"]).json()
+               for n in range(3)]
+    first = client.get("/api/posts/feed", params={"limit": 2}, headers=author["headers"])
+    assert [item["id"] for item in first.json()] == [created[2]["id"], created[1]["id"]]
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get("/api/posts/feed", params={"limit": 2, "cursor": cursor}, headers=author["headers"])
+    assert second.json()[0]["id"] == created[0]["id"]
+
+    # A new post lands on the first page only; the page behind the cursor stays cached
+    misses = server.feed_pages.misses["other"]
+    newest = client.post("/api/posts", json={"caption": "newest", "images": []}, headers=author["headers"]).json()
+    assert client.get("/api/posts/feed", params={"limit": 2}, headers=author["headers"]).json()[0]["id"] == newest["id"]
+    again = client.get("/api/posts/feed", params={"limit": 2, "cursor": cursor}, headers=author["headers"])
+    assert again.json() == second.json()
+    assert server.feed_pages.misses["other"] == misses
+
+
+def test_feed_limit_is_clamped_and_pages_expire(client, user, post, monkeypatch):
+    response = client.get("/api/posts/feed", params={"limit": 100000}, headers=user["headers"])
+    assert len(response.json()) <= server.FEED_PAGE_MAX
+    assert (None, 100000) not in server.feed_pages.pages
+
+    monkeypatch.setattr(server, "FEED_CACHE_TTL_SECONDS", 0)
+    misses = server.feed_pages.misses["first"]
+    client.get("/api/posts/feed", params={"limit": 3}, headers=user["headers"])
+    client.get("/api/posts/feed", params={"limit": 3}, headers=user["headers"])
+    assert server.feed_pages.misses["first"] == misses + 2
+
+
+def test_rank_pool_is_not_built_under_the_viewer_session(client, user, monkeypatch):
+    routes = []
+
+    async def build_pool():
+        routes.append(server._read_route.get())
+        return server.CandidatePool([], {})
+    monkeypatch.setattr(server.feed_ranker, "pool", None)
+    monkeypatch.setattr(server.feed_ranker, "_build_pool", build_pool)
+
+    async def rank_as_viewer():
+        token = server._read_route.set(server.ReadRoute(user["user"]["id"], None, None))
+        try:
+            await server.feed_ranker.get_pool()
+        finally:
+            server._read_route.reset(token)
+    client.portal.call(rank_as_viewer)
+    assert routes == [None]
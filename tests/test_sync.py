@@ -0,0 +1,60 @@
+import server
+
+
+def test_sync_without_token_resets(client, user):
+    body = client.get("/api/sync", headers=user["headers"]).json()
+    assert body["reset"] is True
+    assert body["token"].isdigit()
+
+
+def test_sync_returns_changes_since_token(client, user, other_user):
+    token = client.get("/api/sync", headers=other_user["headers"]).json()["token"]
+    created = client.post("/api/posts", json={"caption": "sync me", "images": []}, headers=user["headers"]).json()
+    client.post(f"/api/posts/{created['id']}/like", headers=other_user["headers"])
+
+    body = client.get("/api/sync", params={"since": token}, headers=other_user["headers"]).json()
+    assert body["reset"] is False
+    assert created["id"] in [item["id"] for item in body["posts"]["upserted"]]
+    assert body["likes"]["added"] == [created["id"]]
+    assert int(body["token"]) > int(token)
+
+
+def test_sync_rejects_malformed_token(client, user):
+    assert client.get("/api/sync", params={"since": "abc"}, headers=user["headers"]).status_code == 400
+
+
+def test_like_records_its_changes_in_one_batch(client, user, other_user, post, monkeypatch):
+    batches = []
+    record = server.repos.changes.record
+
+    async def recording(changes, owner_id):
+        batches.append(list(changes))
+        await record(changes, owner_id)
+    monkeypatch.setattr(server.repos.changes, "record", recording)
+
+    client.post(f"/api/posts/{post['id']}/like", headers=other_user["headers"])
+    assert batches == [[("like", post["id"], "upsert"), ("post", post["id"], "upsert")]]
+
+
+def test_sync_token_zero_is_not_a_reset(client, user, monkeypatch):
+    monkeypatch.setattr(server.repos, "changes", server.MemoryChangeLogRepo())
+    reset = client.get("/api/sync", headers=user["headers"]).json()
+    assert reset == {"token": "0", "reset": True, "has_more": False}
+
+    client.put("/api/users/profile", params={"bio": "new"}, headers=user["headers"])
+    body = client.get("/api/sync", params={"since": reset["token"]}, headers=user["headers"]).json()
+    assert body["reset"] is False
+    assert body["profile"]["bio"] == "new"
+    assert body["token"] == "1"
+    assert client.get("/api/sync", params={"since": "-1"}, headers=user["headers"]).status_code == 400
+
+
+def test_sync_token_skips_other_users_changes(client, user, other_user, monkeypatch):
+    monkeypatch.setattr(server.repos, "changes", server.MemoryChangeLogRepo())
+    token = client.get("/api/sync", headers=user["headers"]).json()["token"]
+    client.put("/api/users/profile", params={"bio": "theirs"}, headers=other_user["headers"])
+    client.put("/api/users/profile", params={"bio": "theirs too"}, headers=other_user["headers"])
+
+    body = client.get("/api/sync", params={"since": token}, headers=user["headers"]).json()
+    assert body["profile"] is None
+    assert body["token"] == "2"
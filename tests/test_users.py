@@ -0,0 +1,59 @@
+import server
+
+
+def test_get_user_and_profile_update(client, user):
+    user_id = user["user"]["id"]
+    assert client.get(f"/api/users/{user_id}").json()["username"] == user["user"]["username"]
+
+    response = client.put("/api/users/profile", params={"bio": "Track days"}, headers=user["headers"])
+    assert response.status_code == 200
+    assert client.get("/api/auth/me", headers=user["headers"]).json()["bio"] == "Track days"
+
+
+def test_get_missing_user(client):
+    assert client.get("/api/users/does-not-exist").status_code == 404
+
+
+def test_users_batch_returns_summaries_and_missing_ids(client, user):
+    user_id = user["user"]["id"]
+    response = client.post("/api/users/batch", json={"ids": [user_id, "missing"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["items"][0]["username"] == user["user"]["username"]
+    assert body["items"][1] is None
+    assert body["missing"] == ["missing"]
+
+
+def test_users_batch_validation(client):
+    assert client.post("/api/users/batch", json={}).status_code == 422
+
+
+def test_avatar(client, user):
+    user_id = user["user"]["id"]
+    assert client.get(f"/api/users/{user_id}/avatar").status_code == 404
+    client.put("/api/users/profile", params={"profile_image": "aGVsbG8="}, headers=user["headers"])
+    response = client.get(f"/api/users/{user_id}/avatar")
+    assert response.status_code == 200
+    assert response.content == b"hello"
+
+
+def test_author_fields_flag_avatar_without_the_payload(client, user):
+    user_id = user["user"]["id"]
+    client.put("/api/users/profile", params={"profile_image": "aGVsbG8="}, headers=user["headers"])
+
+    async def author_fields():
+        return await server.repos.users.get_many([user_id], server.AUTHOR_SNAPSHOT_FIELDS)
+    [author] = client.portal.call(author_fields)
+    assert author["has_avatar"] is True
+    assert "profile_image" not in author
+
+    created = client.post("/api/posts", json={"caption": "with avatar", "images": []}, headers=user["headers"]).json()
+    assert created["author"]["avatar_url"]
+
+
+def test_users_batch_links_avatar_without_the_payload(client, user):
+    user_id = user["user"]["id"]
+    client.put("/api/users/profile", params={"profile_image": "aGVsbG8="}, headers=user["headers"])
+    item = client.post("/api/users/batch", json={"ids": [user_id]}).json()["items"][0]
+    assert item["avatar_url"].startswith(f"/api/users/{user_id}/avatar?v=")
+    assert "profile_image" not in item
@@ -0,0 +1,218 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+
+
+def add_vehicle(client, user, **fields):
+    body = {"make": "BMW", "model": "M3", "year": 2020, "type": "car", **fields}
+    response = client.post("/api/vehicles", json=body, headers=user["headers"])
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_my_vehicles_paginate_by_cursor(client, user):
+    ids = {add_vehicle(client, user, model=f"M{n}")["id"] for n in range(3)}
+    first = client.get("/api/vehicles/my", params={"limit": 2}, headers=user["headers"]).json()
+    assert len(first["vehicles"]) == 2 and first["next_cursor"]
+    second = client.get("/api/vehicles/my", params={"limit": 2, "cursor": first["next_cursor"]},
+                        headers=user["headers"]).json()
+    assert {v["id"] for v in first["vehicles"] + second["vehicles"]} == ids
+    assert second["next_cursor"] is None
+
+
+def test_user_vehicles_ndjson(client, user, vehicle):
+    response = client.get(f"/api/vehicles/user/{user['user']['id']}", params={"format": "ndjson"})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines() if line]
+    assert [row["id"] for row in rows] == [vehicle["id"]]
+
+
+class FakeSession:
+    cluster_time = operation_time = None
+    has_ended = False
+
+    def advance_cluster_time(self, cluster_time):
+        pass
+
+    def advance_operation_time(self, operation_time):
+        pass
+
+    async def end_session(self):
+        self.has_ended = True
+
+
+class FakeClient:
+    async def start_session(self, causal_consistency):
+        return FakeSession()
+
+
+def test_streamed_vehicles_are_read_under_the_request_route(client, user, vehicle, monkeypatch):
+    monkeypatch.setattr(server, "client", FakeClient())
+    iterate = server.repos.vehicles.iter_by_user
+    routes = []
+
+    def iter_by_user(*args, **kwargs):
+        route = server._read_route.get()
+        routes.append((route.user_id, route.session.has_ended))
+        return iterate(*args, **kwargs)
+    monkeypatch.setattr(server.repos.vehicles, "iter_by_user", iter_by_user)
+
+    response = client.get("/api/vehicles/my", params={"format": "ndjson"}, headers=user["headers"])
+    assert [json.loads(line)["id"] for line in response.text.splitlines() if line] == [vehicle["id"]]
+    assert routes == [(user["user"]["id"], False)]
+
+
+def test_patch_with_if_match(client, user, vehicle):
+    response = client.patch(f"/api/vehicles/{vehicle['id']}", json={"color": "red"},
+                            headers={**user["headers"], "If-Match": '"0"'})
+    assert response.status_code == 200
+    assert response.json()["color"] == "red"
+    assert response.headers["ETag"] == '"1"'
+
+    stale = client.patch(f"/api/vehicles/{vehicle['id']}", json={"color": "blue"},
+                         headers={**user["headers"], "If-Match": '"0"'})
+    assert stale.status_code == 412
+
+
+def test_patch_requires_ownership(client, other_user, vehicle):
+    response = client.patch(f"/api/vehicles/{vehicle['id']}", json={"color": "red"}, headers=other_user["headers"])
+    assert response.status_code == 404
+
+
+def test_put_validation(client, user, vehicle):
+    response = client.put(f"/api/vehicles/{vehicle['id']}", json={"make": "BMW"}, headers=user["headers"])
+    assert response.status_code == 422
+
+
+def test_vehicles_batch(client, vehicle):
+    body = client.post("/api/vehicles/batch", json={"ids": [vehicle["id"], "missing"]}).json()
+    assert body["items"][0]["id"] == vehicle["id"]
+    assert body["missing"] == ["missing"]
+
+
+def test_autocomplete_and_similar(client, user):
+    car = add_vehicle(client, user, make="Porsche", model="911")
+    other_car = add_vehicle(client, user, make="Porsche", model="Cayman")
+    add_vehicle(client, user, make="Ducati", model="Monster", type="motorcycle")
+
+    suggestions = client.get("/api/vehicles/autocomplete", params={"q": "pors"}).json()
+    assert any(s["make"] == "Porsche" for s in suggestions)
+
+    similar = client.get(f"/api/vehicles/{car['id']}/similar").json()
+    assert similar[0]["id"] == other_car["id"]
+    assert client.get("/api/vehicles/missing/similar").status_code == 404
+
+
+def test_gallery_images(client, user, vehicle):
+    added = client.post(f"/api/vehicles/{vehicle['id']}/images", json={"image_base64": "aGVsbG8="},
+                        headers=user["headers"])
+    assert added.status_code == 200
+    listing = client.get(f"/api/vehicles/{vehicle['id']}/images").json()
+    assert [image["position"] for image in listing["images"]] == [0]
+    assert client.get(f"/api/vehicles/{vehicle['id']}/images/0").content == b"hello"
+    assert client.get(f"/api/vehicles/{vehicle['id']}/images/5").status_code == 404
+
+
+def test_delete_vehicle(client, user, vehicle):
+    assert client.delete(f"/api/vehicles/{vehicle['id']}", headers=user["headers"]).status_code == 200
+    assert client.get(f"/api/vehicles/{vehicle['id']}/images").status_code == 404
+    assert client.delete(f"/api/vehicles/{vehicle['id']}", headers=user["headers"]).status_code == 404
+
+
+def test_idempotent_create_replays(client, user):
+    headers = {**user["headers"], "Idempotency-Key": "create-1"}
+    body = {"make": "Audi", "model": "RS4", "year": 2018, "type": "car"}
+    first = client.post("/api/vehicles", json=body, headers=headers)
+    replay = client.post("/api/vehicles", json=body, headers=headers)
+    assert replay.status_code == 200
+    assert replay.json()["id"] == first.json()["id"]
+
+    mismatch = client.post("/api/vehicles", json={**body, "model": "RS6"}, headers=headers)
+    assert mismatch.status_code == 422
+
+
+def test_idempotent_replay_after_delete_is_gone(client, user):
+    headers = {**user["headers"], "Idempotency-Key": "create-2"}
+    body = {"make": "Audi", "model": "RS3", "year": 2019, "type": "car"}
+    created = client.post("/api/vehicles", json=body, headers=headers).json()
+    client.delete(f"/api/vehicles/{created['id']}", headers=user["headers"])
+    assert client.post("/api/vehicles", json=body, headers=headers).status_code == 410
+
+
+def test_similarity_one_hot_does_not_collide():
+    index = server.VehicleFeatureIndex(capacity=2)
+    index.upsert({"id": "car", "make": "Honda", "type": "car", "year": 2020})
+    index.upsert({"id": "bike", "make": "Honda", "type": "motorcycle", "year": 2020})
+    index.upsert({"id": "other-car", "make": "Toyota", "type": "car", "year": 2020})
+    for n in range(100):
+        index.upsert({"id": f"filler-{n}", "make": f"make-{n}", "type": "truck", "year": 1950})
+
+    matches = dict(index.similar("car", 3))
+    # Shared make and year, different type: not a full match, and no hash bucket can make it one
+    assert matches["bike"] == pytest.approx(matches["other-car"])
+    assert matches["bike"] < 0.99
+    # New makes don't widen the matrix
+    assert index.matrix.shape[1] == index.dims
+
+
+def test_similarity_scores_are_cosines():
+    index = server.VehicleFeatureIndex(capacity=2)
+    index.upsert({"id": "a", "make": "Honda", "type": "car", "year": 2020, "modifications": "turbo exhaust"})
+    index.upsert({"id": "b", "make": "Honda", "type": "car", "year": 2020, "modifications": "turbo exhaust"})
+    index.upsert({"id": "c", "make": "Ford", "type": "truck", "year": 2020, "modifications": "turbo exhaust"})
+    index.remove("b")
+    index.compact()
+    index.upsert({"id": "b", "make": "Honda", "type": "car", "year": 2020, "modifications": "turbo exhaust"})
+
+    matches = dict(index.similar("a", 2))
+    assert matches["b"] == pytest.approx(1.0)
+    # Same year and tokens but no shared category: only the dense part, 2 of the 4 squared norm
+    assert matches["c"] == pytest.approx(1.0 - 2.0 / (2.0 + 2.0))
+
+
+def test_change_stream_update_without_pre_image_resyncs_only_on_make_or_model(monkeypatch):
+    resyncs = []
+    monkeypatch.setattr(server.invalidation_bus, "request_resync", resyncs.append)
+    monkeypatch.setattr(server, "similar_vehicles", server.VehicleFeatureIndex())
+    doc = {"id": "v1", "user_id": "u1", "make": "BMW", "model": "M3", "type": "car", "year": 2020}
+
+    def change(updated):
+        return {
+            "operationType": "update", "ns": {"coll": "vehicles"}, "fullDocument": doc,
+            "updateDescription": {"updatedFields": updated, "removedFields": []},
+        }
+    server._on_vehicle_change(server.InvalidationBus._event(change({"color": "red", "version": 2})))
+    assert resyncs == []
+    server._on_vehicle_change(server.InvalidationBus._event(change({"model": "M3", "version": 3})))
+    assert resyncs == ["vehicles"]
+
+
+def test_embedded_image_migration_runs_once_and_keeps_reserved_positions(client, user, vehicle, monkeypatch):
+    monkeypatch.setattr(server.repos, "migrations", server.MemoryMigrationRepo())
+    stored = server.repos.vehicles.by_id[vehicle["id"]]
+    # An upload reserved positions 0-2 while the vehicle still had two inline images
+    monkeypatch.setitem(stored, "images", ["aGVsbG8=", "d29ybGQ="])
+    monkeypatch.setitem(stored, "image_count", 3)
+
+    client.portal.call(server.migrate_embedded_vehicle_images)
+    assert "images" not in stored
+    assert stored["image_count"] == 3
+    assert server.repos.migrations.entries[server.VEHICLE_IMAGE_MIGRATION]["done"]
+
+    stored["images"] = ["aGVsbG8="]
+    client.portal.call(server.migrate_embedded_vehicle_images)
+    assert stored.pop("images") == ["aGVsbG8="]  # done: later startups don't rescan
+
+
+def test_migration_lease_excludes_other_workers():
+    async def scenario():
+        migrations = server.MemoryMigrationRepo()
+        assert await migrations.claim("m", "w1", 60)
+        assert not await migrations.claim("m", "w2", 60)
+        assert await migrations.claim("m", "w1", 60)
+        await migrations.finish("m")
+        assert not await migrations.claim("m", "w1", 60)
+    asyncio.run(scenario())